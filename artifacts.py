@@ -0,0 +1,249 @@
+"""執行產出：截圖、PDF 與 OCR 結果寫到各次執行的目錄，並依保存期限清理。
+
+每次執行的產出與執行狀態放在同一個目錄，依年月分層（單一目錄的項目數有上限）：
+    output/runs/2026/02/20260226-153012/
+        state.json、ocr.json … filled.json   各階段結果（runstate.py）
+        manifest.json                        輸入檔雜湊、產出檔、請購單號、各階段時間
+        events.jsonl                         事件紀錄（events.py）
+        *_ocr.json、*_merged_ocr.json        OCR 結果
+        *_filled.jpg、verify_*.jpg           截圖（SCREENSHOT_TYPE，JPEG 依 SCREENSHOT_QUALITY 壓縮）
+不屬於任何執行的產出（watcher.py 逐檔 OCR、執行前的預先登入）寫到 output/misc/<年>/<月>/。
+use() 只影響呼叫它的執行緒（瀏覽器與填單在同一執行緒，multiuser.py 每位使用者各自設定）。
+
+保存期限（config.py，0 表示不限制）：
+    ARTIFACT_KEEP_DAYS  截圖保存天數，之後只留 JSON 紀錄與 PDF
+    RUN_KEEP_DAYS       執行目錄（含 manifest、PDF）保存天數，依執行 ID 的日期
+    RUNS_MAX_MB         runs/ 總大小上限，超過時從最舊的執行整個刪除
+main.py、watcher.py、multiuser.py、folders.py 每次執行結束後自動清理（本次執行不會被刪除）；
+misc/ 與 output/ 最上層舊版的平面檔案（*_filled.png、verify_*.png、*_ocr.json…）依修改時間清理。
+送出紀錄在帳本（ledger.sqlite3），刪除舊的執行不影響重複送出的判斷。
+
+用法：
+    python artifacts.py             # 各年月的執行數與大小，以及會被清理的項目
+    python artifacts.py --prune     # 立即清理
+"""
+
+import argparse
+import re
+import shutil
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from config import (
+    OUTPUT_DIR, RUNS_DIR, MISC_DIR, SCREENSHOT_TYPE, SCREENSHOT_QUALITY,
+    ARTIFACT_KEEP_DAYS, RUN_KEEP_DAYS, RUNS_MAX_MB,
+)
+
+IMAGE_SUFFIXES = {".png", ".jpg", ".jpeg", ".webp"}
+_RUN_ID = re.compile(r"^(\d{8})-(\d{6})")
+
+_local = threading.local()
+
+
+# ════════════════════════════════════════════════════════════
+#  產出目錄
+# ════════════════════════════════════════════════════════════
+
+def directory() -> Path:
+    """目前執行緒的產出目錄；未指定時為 misc/<年>/<月>/。"""
+    current = getattr(_local, "directory", None)
+    if current is not None:
+        return current
+    now = datetime.now()
+    return Path(MISC_DIR) / f"{now:%Y}" / f"{now:%m}"
+
+
+@contextmanager
+def use(path):
+    """with 區塊內，目前執行緒的產出寫到 path（通常是執行狀態目錄）。"""
+    previous = getattr(_local, "directory", None)
+    _local.directory = Path(path)
+    try:
+        yield
+    finally:
+        _local.directory = previous
+
+
+def path(name: str) -> Path:
+    """產出目錄中的檔案路徑（目錄不存在時建立）。"""
+    current = directory()
+    current.mkdir(parents=True, exist_ok=True)
+    return current / name
+
+
+def screenshot(target, name: str, **kwargs) -> Path:
+    """Playwright 頁面或元素截圖存為 name.jpg（或 .png），回傳路徑；kwargs 如 full_page=True。"""
+    options = {"type": SCREENSHOT_TYPE}
+    if SCREENSHOT_TYPE == "jpeg":
+        options["quality"] = SCREENSHOT_QUALITY
+    out = path(f"{name}.{'jpg' if SCREENSHOT_TYPE == 'jpeg' else SCREENSHOT_TYPE}")
+    target.screenshot(path=str(out), **options, **kwargs)
+    return out
+
+
+# ════════════════════════════════════════════════════════════
+#  保存期限
+# ════════════════════════════════════════════════════════════
+
+def run_dirs(root=RUNS_DIR) -> list:
+    """root 下的執行目錄（<年>/<月>/<ID> 與舊版平面 <ID>），依 ID 由舊到新。"""
+    root = Path(root)
+    if not root.is_dir():
+        return []
+    found = []
+    for entry in root.iterdir():
+        if not entry.is_dir():
+            continue
+        if _RUN_ID.match(entry.name):
+            found.append(entry)
+        elif entry.name.isdigit():
+            for month in entry.iterdir():
+                if month.is_dir():
+                    found.extend(d for d in month.iterdir() if d.is_dir())
+    return sorted(found, key=lambda d: d.name)
+
+
+def _run_time(run_dir: Path) -> datetime:
+    m = _RUN_ID.match(run_dir.name)
+    if m:
+        try:
+            return datetime.strptime(m.group(1) + m.group(2), "%Y%m%d%H%M%S")
+        except ValueError:
+            pass
+    return datetime.fromtimestamp(run_dir.stat().st_mtime)
+
+
+def _files(root: Path) -> list:
+    return [f for f in root.rglob("*") if f.is_file()] if root.is_dir() else []
+
+
+def plan(now: datetime = None, keep=()) -> list:
+    """
+    依保存期限列出要刪除的項目，不刪除任何東西。
+
+    keep: 不清理的執行目錄（本次執行）
+    Returns:
+        [(路徑, 原因, 位元組)]，路徑為整個執行目錄或單一檔案
+    """
+    now = now or datetime.now()
+    keep = {Path(p).resolve() for p in keep}
+    image_cutoff = now - timedelta(days=ARTIFACT_KEEP_DAYS) if ARTIFACT_KEEP_DAYS else None
+    run_cutoff = now - timedelta(days=RUN_KEEP_DAYS) if RUN_KEEP_DAYS else None
+
+    def _expired(f: Path, cutoff) -> bool:
+        return cutoff is not None and datetime.fromtimestamp(f.stat().st_mtime) < cutoff
+
+    items = []
+    remaining = []      # [(執行目錄, 清理截圖後的大小, 截圖項目)]
+    for run_dir in run_dirs():
+        files = _files(run_dir)
+        size = sum(f.stat().st_size for f in files)
+        if run_dir.resolve() in keep:
+            remaining.append((run_dir, size, None))
+            continue
+        if run_cutoff is not None and _run_time(run_dir) < run_cutoff:
+            items.append((run_dir, "執行過期", size))
+            continue
+        images = [(f, "截圖過期", f.stat().st_size) for f in files
+                  if f.suffix.lower() in IMAGE_SUFFIXES and _expired(f, image_cutoff)]
+        remaining.append((run_dir, size - sum(b for _, _, b in images), images))
+
+    # runs/ 總大小超過上限：從最舊的執行整個刪除（該執行的截圖項目併入）
+    total = sum(size for _, size, _ in remaining)
+    for run_dir, size, images in remaining:
+        if not RUNS_MAX_MB or total <= RUNS_MAX_MB * 1024 * 1024:
+            items.extend(images or [])
+        elif images is None:
+            continue
+        else:
+            items.append((run_dir, "超過總大小上限",
+                          size + sum(b for _, _, b in images)))
+            total -= size
+
+    # 不屬於執行的產出與舊版平面檔案：依修改時間
+    loose = _files(Path(MISC_DIR))
+    if Path(OUTPUT_DIR).is_dir():
+        loose += [f for f in Path(OUTPUT_DIR).iterdir() if f.is_file()
+                  and (f.suffix.lower() in IMAGE_SUFFIXES | {".pdf"}
+                       or f.name.endswith("_ocr.json"))]
+    for f in loose:
+        cutoff = image_cutoff if f.suffix.lower() in IMAGE_SUFFIXES else run_cutoff
+        if _expired(f, cutoff):
+            items.append((f, "截圖過期" if cutoff is image_cutoff else "檔案過期",
+                          f.stat().st_size))
+    return items
+
+
+def _remove_empty(root: Path) -> None:
+    """刪除 root 下清理後變空的 <年>/<月> 目錄。"""
+    if not root.is_dir():
+        return
+    # 只看年、月兩層：執行目錄建立後才寫入 state.json，空的執行目錄可能正在建立
+    for d in sorted((d for d in root.glob("*/*") if d.is_dir()), reverse=True) + \
+            sorted(d for d in root.glob("*") if d.is_dir()):
+        if d.name.isdigit() and not any(d.iterdir()):
+            d.rmdir()
+
+
+def prune(now: datetime = None, keep=()) -> tuple:
+    """依保存期限刪除舊的產出（見 plan()），回傳 (項目數, 釋放的位元組)。"""
+    items = plan(now, keep)
+    freed = 0
+    for p, _, size in items:
+        try:
+            if p.is_dir():
+                shutil.rmtree(p)
+            else:
+                p.unlink()
+        except OSError as e:
+            print(f"  [WARN] 無法刪除 {p}: {e}")
+            continue
+        freed += size
+    _remove_empty(Path(RUNS_DIR))
+    _remove_empty(Path(MISC_DIR))
+    return len(items), freed
+
+
+def prune_after_run(keep=()) -> None:
+    """執行結束後的自動清理（失敗時只警告，不影響結果）。"""
+    try:
+        count, freed = prune(keep=keep)
+    except OSError as e:
+        print(f"  [WARN] 清理舊的執行產出失敗: {e}")
+        return
+    if count:
+        print(f"  已清理 {count} 項過期的執行產出（{freed / 1024 / 1024:.1f} MB）")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="執行產出的使用量與保存期限清理")
+    parser.add_argument("--prune", action="store_true", help="立即刪除過期的項目")
+    args = parser.parse_args()
+
+    usage = {}      # 年/月 → [執行數, 位元組]
+    for run_dir in run_dirs():
+        month = f"{_run_time(run_dir):%Y/%m}"
+        entry = usage.setdefault(month, [0, 0])
+        entry[0] += 1
+        entry[1] += sum(f.stat().st_size for f in _files(run_dir))
+    print(f"{RUNS_DIR}/")
+    for month, (count, size) in sorted(usage.items()):
+        print(f"  {month}  {count:>5} 次執行  {size / 1024 / 1024:>9.1f} MB")
+
+    if args.prune:
+        count, freed = prune()
+        print(f"\n已清理 {count} 項（{freed / 1024 / 1024:.1f} MB）")
+        return
+    items = plan()
+    print(f"\n依保存期限將清理 {len(items)} 項"
+          f"（截圖 {ARTIFACT_KEEP_DAYS} 天、執行 {RUN_KEEP_DAYS} 天、上限 {RUNS_MAX_MB} MB）：")
+    for p, reason, size in items:
+        print(f"  {reason:<8} {size / 1024:>10.0f} KB  {p}")
+    if items:
+        print("執行 python artifacts.py --prune 刪除")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""效能基準：純資料處理函式的吞吐量與記憶體，與保存的基準比較。
+
+測量對象（輸入由合成資料產生器建立，品名含 "500Ω/50W"、"10μF ±5%" 等 Unicode）：
+    tax         main._process_receipt_tax       每張收據
+    merge       main.merge_receipts             n 張收據合併為一張
+    match       main.match_foreign_receipts_to_statements（greedy，不含別名寫檔）
+                n 筆刷卡交易，外幣收據 min(n, 200) 張（同 bench_matcher.py）
+    big5        form_filler._sanitize_big5      每個品名
+    js_escape   form_filler._js_escape          每個品名
+    receipt_no  form_filler._sanitize_receipt_no 每個發票號碼
+
+每項依規模（預設 1 / 1000 / 100000）測：
+    每單位耗時（µs，取 --repeat 次中最快）、每秒處理量、tracemalloc 記憶體峰值
+有基準檔（bench_baseline.json）時，耗時或記憶體超過基準 (1 + --threshold) 倍
+視為退步，結束碼 1。基準與機器有關，換機器後請重新 --save-baseline。
+
+用法：
+    python bench.py                        # 全部項目，與基準比較
+    python bench.py --save-baseline        # 目前結果存為基準
+    python bench.py --only tax merge --sizes 1 1000
+    python bench.py --threshold 0.5        # 容許 50% 誤差
+"""
+
+import argparse
+import contextlib
+import copy
+import io
+import json
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+from pathlib import Path
+
+import main
+from form_filler import _sanitize_big5, _js_escape, _sanitize_receipt_no
+from records import Receipt
+
+BASELINE_FILE = "bench_baseline.json"
+DEFAULT_SIZES = [1, 1000, 100000]
+DEFAULT_THRESHOLD = 0.25      # 超過基準 25% 視為退步
+MIN_TIME = 0.1                # 每次測量至少執行這麼久（小規模時重複多次）
+MEMORY_SLACK_KB = 64          # 記憶體峰值差距在此以內不算退步（小規模的雜訊）
+N_FOREIGN = 200               # match：外幣收據張數上限
+
+# ════════════════════════════════════════════════════════════
+#  合成資料
+# ════════════════════════════════════════════════════════════
+
+ITEM_NAMES = [
+    "水泥電阻 500Ω/50W", "電解電容 10μF ±5%", "溫度感測器 -40~125°C", "三相整流橋",
+    "Arduino™ Uno R3", "「測試」治具 × 2", "銲錫絲 0.8mm—無鉛", "ＵＳＢ 傳輸線",
+    "散熱膏 ≥ 5 W/m·K", "I²C 轉接板", "影印紙 A4", "碳粉匣 “HP 26A”",
+    "O'Reilly 技術書", "網路線 Cat.6 \\ 5m", "營業稅",
+]
+VENDORS = ["宸暐有限公司", "廣華電子材料有限公司", "全家便利商店", "露天拍賣", "Anthropic",
+           "Google Cloud", "OpenAI"]
+CARD_NAMES = ["ANTHROPIC* CLAUDE.AI SUBSCR", "GOOGLE*CLOUD", "OPENAI *CHATGPT SUBSCR",
+              "MICROSOFT*AZURE", "AMAZON WEB SERVICES", "GITHUB INC", "ZOOM.US"]
+
+
+def make_receipt_docs(n: int, rng: random.Random) -> list:
+    """n 張台幣收據（OCR dict）：1~6 個品項，約三成含稅額列。"""
+    start = date(2026, 1, 1)
+    docs = []
+    for i in range(n):
+        items = []
+        for _ in range(rng.randint(1, 6)):
+            qty = rng.randint(1, 3)
+            price = rng.randint(10, 2000)
+            items.append({"name": rng.choice(ITEM_NAMES[:-1]), "quantity": qty,
+                          "price": price, "amount": qty * price})
+        amount = sum(it["amount"] for it in items)
+        if rng.random() < 0.3:
+            tax = round(amount * 0.05)
+            items.append({"name": "營業稅", "quantity": 1, "price": tax, "amount": tax})
+            amount += tax
+        docs.append({
+            "date": (start + timedelta(days=rng.randint(0, 364))).isoformat(),
+            "vendor": rng.choice(VENDORS[:4]),
+            "invoice_no": f"{rng.choice('ABCDEFGH')}{rng.choice('KLMNPQ')}{i % 10**8:08d}",
+            "amount": amount,
+            "items": items,
+            "_source_image": f"r{i}.jpg",
+        })
+    return docs
+
+
+def make_card_docs(n_txn: int, rng: random.Random) -> list:
+    """n_txn 筆刷卡交易（每天一張刷卡紀錄）+ 從中抽樣的 min(n_txn, N_FOREIGN) 張外幣收據。"""
+    start = date(2026, 1, 1)
+    per_day = max(1, n_txn // 365)
+    statements, made, day = [], 0, 0
+    while made < n_txn:
+        items = []
+        for _ in range(min(per_day, n_txn - made)):
+            orig = round(rng.uniform(1, 500), 2)
+            items.append({"name": rng.choice(CARD_NAMES), "quantity": 1,
+                          "price": int(orig * 31), "original_currency": "USD",
+                          "original_price": orig})
+        made += len(items)
+        statements.append({"doc_type": "credit_card_statement",
+                           "date": (start + timedelta(days=day % 365)).isoformat(),
+                           "items": items})
+        day += 1
+    receipts = []
+    for _ in range(min(n_txn, N_FOREIGN)):
+        stmt = rng.choice(statements)
+        item = rng.choice(stmt["items"])
+        d = date.fromisoformat(stmt["date"]) + timedelta(days=rng.randint(-2, 2))
+        receipts.append({"vendor": item["name"].split("*")[0].title(), "date": d.isoformat(),
+                         "currency": "USD", "amount": item["original_price"],
+                         "original_amount": item["original_price"],
+                         "items": [{"name": "subscription", "quantity": 1,
+                                    "price": item["original_price"]}]})
+    return statements + receipts
+
+
+def make_names(n: int, rng: random.Random) -> list:
+    return [f"{rng.choice(ITEM_NAMES)} #{i}" for i in range(n)]
+
+
+def make_invoice_nos(n: int, rng: random.Random) -> list:
+    forms = ["AB-12345678", " CD12345678 ", "EF_1234567890", "收據11502260", "XY1234", ""]
+    return [rng.choice(forms) for _ in range(n)]
+
+
+# ════════════════════════════════════════════════════════════
+#  測量項目：名稱 → (產生輸入, 執行, 是否會改寫輸入)
+# ════════════════════════════════════════════════════════════
+
+def _tax(receipts):
+    for r in receipts:
+        main._process_receipt_tax(r)
+
+
+def _names(fn):
+    def run(names):
+        for s in names:
+            fn(s)
+    return run
+
+
+BENCHMARKS = {
+    "tax": (lambda n, rng: [Receipt.from_dict(d) for d in make_receipt_docs(n, rng)],
+            _tax, False),
+    "merge": (lambda n, rng: [Receipt.from_dict(d) for d in make_receipt_docs(n, rng)],
+              main.merge_receipts, False),
+    "match": (make_card_docs,
+              lambda docs: main.match_foreign_receipts_to_statements(docs, mode="greedy"),
+              True),
+    "big5": (make_names, _names(_sanitize_big5), False),
+    "js_escape": (make_names, _names(_js_escape), False),
+    "receipt_no": (make_invoice_nos, _names(_sanitize_receipt_no), False),
+}
+
+
+def measure(name: str, n: int, repeat: int) -> dict:
+    """測一個項目在規模 n 的每單位耗時（最快一次）、處理量與記憶體峰值。"""
+    make, run, mutates = BENCHMARKS[name]
+    data = make(n, random.Random(n))
+
+    def _copies(k):
+        # 會改寫輸入的函式每次都用新副本（複製不計入耗時）
+        return [copy.deepcopy(data) for _ in range(k)] if mutates else [data] * k
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        t0 = time.perf_counter()
+        run(_copies(1)[0])
+        once = time.perf_counter() - t0
+        number = max(1, int(MIN_TIME / max(once, 1e-9)))
+        best = once / number if number == 1 else float("inf")
+        for _ in range(repeat):
+            inputs = _copies(number)
+            t0 = time.perf_counter()
+            for x in inputs:
+                run(x)
+            best = min(best, (time.perf_counter() - t0) / number)
+
+        fresh = _copies(1)[0]
+        tracemalloc.start()
+        run(fresh)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return {"per_item_us": best / n * 1e6, "per_sec": n / best if best else 0.0,
+            "peak_kb": peak / 1024}
+
+
+def compare(result: dict, base: dict, threshold: float) -> list:
+    """回傳超過基準的指標說明（空列表表示沒有退步）。"""
+    regressions = []
+    for metric, label, slack in (("per_item_us", "耗時", 0), ("peak_kb", "記憶體", MEMORY_SLACK_KB)):
+        if base.get(metric) and result[metric] > base[metric] * (1 + threshold) + slack:
+            regressions.append(f"{label} +{(result[metric] / base[metric] - 1) * 100:.0f}%")
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="純資料處理函式的效能基準")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS),
+                        help="只測這些項目")
+    parser.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES,
+                        help=f"資料規模（預設 {' '.join(map(str, DEFAULT_SIZES))}）")
+    parser.add_argument("--repeat", type=int, default=5, help="每項重複次數，取最快（預設 5）")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"超過基準多少比例算退步（預設 {DEFAULT_THRESHOLD}）")
+    parser.add_argument("--baseline", type=str, default=BASELINE_FILE,
+                        help=f"基準檔（預設 {BASELINE_FILE}）")
+    parser.add_argument("--save-baseline", action="store_true", help="把這次結果存為基準")
+    args = parser.parse_args()
+
+    baseline = {}
+    if Path(args.baseline).exists() and not args.save_baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    # match 會讀取並記住學到的廠商別名：讀空的暫存檔、寫入改為不動作，
+    # 每次測量看到的別名表相同，耗時也不含寫檔
+    tmp = tempfile.TemporaryDirectory()
+    main.VENDOR_ALIASES_FILE = str(Path(tmp.name) / "vendor_aliases.json")
+    main.remember_aliases = lambda path, learned: 0
+
+    results, failed = {}, []
+    print(f"  {'項目':<12} {'規模':>7} {'µs/單位':>10} {'每秒':>12} {'峰值 KB':>10}  基準")
+    for name in args.only:
+        for n in args.sizes:
+            key = f"{name}/{n}"
+            r = results[key] = measure(name, n, args.repeat)
+            note = "-"
+            if key in baseline:
+                regressions = compare(r, baseline[key], args.threshold)
+                delta = (r["per_item_us"] / baseline[key]["per_item_us"] - 1) * 100
+                note = f"{delta:+.0f}%"
+                if regressions:
+                    failed.append(key)
+                    note += f"  [退步] {', '.join(regressions)}"
+            print(f"  {name:<12} {n:>7} {r['per_item_us']:>10.2f} {r['per_sec']:>12,.0f} "
+                  f"{r['peak_kb']:>10.1f}  {note}")
+    tmp.cleanup()
+
+    if args.save_baseline:
+        baseline = {}
+        if Path(args.baseline).exists():
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2)
+        print(f"\n基準已存到 {args.baseline}（{len(results)} 項）")
+    elif failed:
+        print(f"\n{len(failed)} 項超過基準 {args.threshold:.0%}: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
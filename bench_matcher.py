@@ -0,0 +1,158 @@
+"""效能測試：外幣收據比對（全掃描 vs 交易索引），交易數 1k ~ 100k。
+
+用法：
+    python bench_matcher.py              # 預設 1000 / 10000 / 100000 筆交易
+    python bench_matcher.py 5000 50000   # 自訂交易數
+
+執行前先跑回歸案例（REGRESSIONS）：全掃描能配對、索引曾經漏掉的組合。
+"""
+
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+from matcher import MATCH_THRESHOLD, TransactionIndex, score
+
+VENDORS = ["ANTHROPIC* CLAUDE.AI SUBSCR", "GOOGLE*CLOUD", "OPENAI *CHATGPT SUBSCR",
+           "MICROSOFT*AZURE", "AMAZON WEB SERVICES", "GITHUB INC", "NOTION LABS",
+           "DIGITALOCEAN.COM", "ZOOM.US", "DROPBOX"]
+CURRENCIES = ["USD", "USD", "USD", "EUR", "JPY"]
+N_RECEIPTS = 200
+
+# 回歸案例：(說明, 刷卡紀錄, 收據)；全掃描與索引都應配對到該筆交易
+REGRESSIONS = [
+    ("只有廠商相符（日期差 50 天、幣別寫法 US$）",
+     {"date": "2025-01-01",
+      "items": [{"name": "GITHUB INC", "price": 330,
+                 "original_currency": "US$", "original_price": 10.5}]},
+     {"vendor": "GitHub", "date": "2025-02-20", "currency": "USD", "original_amount": 10.5}),
+    ("只有廠商相符（金額不同、日期差 45 天）",
+     {"date": "2025-03-01",
+      "items": [{"name": "NOTION LABS", "price": 250,
+                 "original_currency": "USD", "original_price": 8}]},
+     {"vendor": "Notion", "date": "2025-04-15", "currency": "USD", "original_amount": 10}),
+    ("只有原幣金額相符（US$ vs USD、日期差 40 天）",
+     {"date": "2025-05-01",
+      "items": [{"name": "ZOOM.US", "price": 500,
+                 "original_currency": "US$", "original_price": 15.99}]},
+     {"vendor": "Video Meetings", "date": "2025-06-10", "currency": "USD",
+      "original_amount": 15.99}),
+]
+
+
+def make_statements(n_txn: int, rng: random.Random) -> list:
+    """產生 n_txn 筆交易，分散在一年內每天一張刷卡紀錄。"""
+    start = date(2025, 1, 1)
+    per_day = max(1, n_txn // 365)
+    statements = []
+    made = 0
+    day = 0
+    while made < n_txn:
+        items = []
+        for _ in range(min(per_day, n_txn - made)):
+            orig = round(rng.uniform(1, 500), 2)
+            items.append({
+                "name": rng.choice(VENDORS),
+                "quantity": 1,
+                "price": int(orig * 31),
+                "original_currency": rng.choice(CURRENCIES),
+                "original_price": orig,
+            })
+        made += len(items)
+        statements.append({
+            "doc_type": "credit_card_statement",
+            "date": (start + timedelta(days=day % 365)).isoformat(),
+            "items": items,
+        })
+        day += 1
+    return statements
+
+
+def make_receipts(statements: list, rng: random.Random) -> list:
+    """從交易中抽樣產生外幣收據（日期前後差 0~2 天，模擬時區差異）。"""
+    receipts = []
+    for _ in range(N_RECEIPTS):
+        stmt = rng.choice(statements)
+        item = rng.choice(stmt["items"])
+        d = date.fromisoformat(stmt["date"]) + timedelta(days=rng.randint(-2, 2))
+        receipts.append({
+            "vendor": item["name"].split("*")[0].title(),
+            "date": d.isoformat(),
+            "currency": item["original_currency"],
+            "original_amount": item["original_price"],
+        })
+    return receipts
+
+
+def full_scan(index: TransactionIndex, receipts: list) -> list:
+    """原本的做法：每張收據對所有交易評分。"""
+    results = []
+    for r in receipts:
+        key = index.key(r)
+        best, best_score = None, 0
+        for txn in index.transactions:
+            if txn.used:
+                continue
+            s = score(key, txn)
+            if s > best_score:
+                best, best_score = txn, s
+        results.append((best.idx if best else None, best_score))
+    return results
+
+
+def indexed(index: TransactionIndex, receipts: list) -> list:
+    results = []
+    for r in receipts:
+        best, best_score = index.best_match(r)
+        results.append((best.idx if best else None, best_score))
+    return results
+
+
+def run(n_txn: int) -> None:
+    rng = random.Random(n_txn)
+    statements = make_statements(n_txn, rng)
+    receipts = make_receipts(statements, rng)
+
+    t0 = time.perf_counter()
+    index = TransactionIndex(statements)
+    t_build = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    fast = indexed(index, receipts)
+    t_index = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    slow = full_scan(index, receipts)
+    t_scan = time.perf_counter() - t0
+
+    # 索引只略過「原幣金額不符、日期超過 ±7 天且名稱不相符」的交易，達門檻的結果應一致
+    same = sum(1 for a, b in zip(fast, slow) if a == b)
+    print(f"  {n_txn:>7} 筆交易 | 建索引 {t_build*1000:8.1f} ms | "
+          f"索引比對 {t_index*1000:8.1f} ms | 全掃描 {t_scan*1000:9.1f} ms | "
+          f"x{t_scan / max(t_index, 1e-9):6.1f} | 結果一致 {same}/{len(receipts)}")
+
+
+def check_regressions() -> bool:
+    """回歸案例：每個案例混入一千筆其他交易，索引與全掃描都要配對到同一筆。"""
+    ok = True
+    rng = random.Random(0)
+    for label, statement, receipt in REGRESSIONS:
+        statements = [statement] + make_statements(1000, rng)
+        index = TransactionIndex(statements)
+        fast = indexed(index, [receipt])[0]
+        slow = full_scan(index, [receipt])[0]
+        passed = fast == slow and fast[0] == 0 and fast[1] >= MATCH_THRESHOLD
+        ok = ok and passed
+        print(f"  {'✓' if passed else '✗'} {label}：索引 {fast}、全掃描 {slow}")
+    return ok
+
+
+if __name__ == "__main__":
+    sizes = [int(a) for a in sys.argv[1:]] or [1000, 10000, 100000]
+    print("回歸案例")
+    if not check_regressions():
+        sys.exit(1)
+    print(f"外幣收據比對效能（{N_RECEIPTS} 張收據）")
+    for n in sizes:
+        run(n)
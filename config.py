@@ -143,6 +143,91 @@ BANK_KEYWORD = "一銀竹北"  # 銀行帳戶彈窗中要選的選項
 #   110704-8022 教學研究及訓輔費用-服務費用
 DEFAULT_SUBJECT = "110704-8012"  # 材料及用品費（一般辦公/文具支出）
 
+# ── 外幣收據 ↔ 刷卡紀錄比對模式 ──────────────────────
+#   "optimal": 全域最佳指派（結果與檔案順序無關，需 numpy + scipy）
+#   "greedy":  逐張比對，先比對的收據優先取得交易
+MATCH_MODE = "optimal"
+
+# 成功比對後學到的「刷卡名稱 → 收據廠商」別名（下次比對時視為同一廠商）
+VENDOR_ALIASES_FILE = f"{OUTPUT_DIR}/vendor_aliases.json"
+
+# ── 本地匯率表（外幣收據找不到刷卡紀錄時的暫定台幣金額）──
+# CSV 欄位: date,currency,rate（TWD / 1 單位外幣），用 `python fx_rates.py import` 匯入
+FX_RATES_FILE = "fx_rates.csv"
+FX_RECONCILE_FILE = f"{OUTPUT_DIR}/fx_reconcile.json"   # 暫定金額待對帳清單
+FX_CARD_FEE_RATE = 0.015      # 信用卡國外交易手續費（刷卡台幣金額通常已含）
+FX_MAX_RATE_AGE_DAYS = 7      # 匯率日期與收據日期最多相差幾天
+
+# ── 執行狀態目錄（每次執行的各階段結果，供 --resume 接續）──
+# runs/<年>/<月>/<執行ID>/：各階段結果、manifest、截圖與 OCR 結果（見 artifacts.py）
+RUNS_DIR = f"{OUTPUT_DIR}/runs"
+MISC_DIR = f"{OUTPUT_DIR}/misc"   # 不屬於任何執行的產出（misc/<年>/<月>/）
+
+# ── 執行產出的格式與保存期限（artifacts.py，0 表示不限制）──
+SCREENSHOT_TYPE = "jpeg"          # 截圖格式：jpeg（壓縮）或 png（無損）
+SCREENSHOT_QUALITY = 70           # JPEG 品質（1~100）
+ARTIFACT_KEEP_DAYS = 90           # 截圖保存天數，之後只留 JSON 紀錄與 PDF
+RUN_KEEP_DAYS = 730               # 執行目錄（含 manifest、PDF）保存天數
+RUNS_MAX_MB = 2048                # runs/ 總大小上限，超過時從最舊的執行整個刪除
+
+# ── 收據流水號帳本（SQLite，跨執行/跨程序共用，避免同日收據號碼重複）──
+LEDGER_DB = f"{OUTPUT_DIR}/ledger.sqlite3"
+
+# ── 請購單列數上限（超過時自動拆成多張請購單）──────────
+# APPP 品名表單共 15 列，保留 1 列給「其他差額」
+APPP_MAX_ROWS = 14
+APPA_MAX_ROWS = 20            # 受款人（每張收據一列）
+# 規劃請購單：收據不超過 PLAN_EXACT_MAX 張時用分支定界找最少張數，
+# 搜尋超過 PLAN_EXACT_NODES 個節點或收據更多時改用 First-Fit Decreasing
+PLAN_EXACT_MAX = 40
+PLAN_EXACT_NODES = 50_000
+
+# ── 請購單分組規則（廠商 → 科目、關鍵字 → 計畫、依月份分開）──
+# JSON 格式見 planner.py；檔案不存在時全部收據合併（僅依列數上限拆單）
+BATCH_RULES_FILE = "batch_rules.json"
+
+# ── 執行政策（提示預設答案、中止條件；--unattended 時不等待輸入）──
+# JSON 格式見 policy.py；檔案不存在時全部使用各提示的預設值
+POLICY_FILE = "policy.json"
+
+# ── 監看資料夾（watcher.py）──────────────────────────────
+WATCH_DEBOUNCE_SEC = 2.0          # 檔案停止變動多久後才辨識（避免讀到寫一半的檔案）
+WATCH_POLL_SEC = 2.0              # 沒有 inotify 時的輪詢間隔
+WATCH_OCR_WORKERS = 2             # 背景 OCR 執行緒數
+WATCH_THRESHOLD = 5               # 待送收據達到此數量即送出
+WATCH_INTERVAL_MIN = 30           # 每隔幾分鐘送出一次待送收據（0=只看數量）
+WATCH_SESSION_MAX_AGE_MIN = 20    # 登入工作階段超過幾分鐘未使用就重新登入
+WATCH_POOL_FILE = f"{OUTPUT_DIR}/watch_pool.json"   # 待送池（重啟後不必重新 OCR）
+
+# ── 本機工作 API（jobserver.py）──────────────────────────
+API_HOST = "127.0.0.1"            # 只在內網開放時改為 "0.0.0.0"
+API_PORT = 8765
+API_TOKEN = os.getenv("API_TOKEN", "")   # 設定後需帶 Authorization: Bearer <token>
+API_OCR_WORKERS = 2               # OCR 工作執行緒數
+API_BROWSER_WORKERS = 1           # 瀏覽器工作執行緒數（每個各自登入一個工作階段）
+API_MAX_UPLOAD_MB = 20            # 單一工作上傳大小上限
+JOBS_DIR = f"{OUTPUT_DIR}/jobs"   # 每個工作的上傳檔與狀態（jobs/<工作ID>/）
+
+# ── 工作佇列（jobqueue.py，SQLite）─────────────────────────
+QUEUE_DB = f"{OUTPUT_DIR}/queue.sqlite3"
+QUEUE_VISIBILITY_SEC = 600        # 取走的工作多久沒有回報就視為中斷，可被重新取走
+QUEUE_MAX_ATTEMPTS = 4            # 超過此次數仍失敗 → dead letter
+QUEUE_BACKOFF_BASE_SEC = 30       # 重試等待：30 秒、60 秒、120 秒…
+QUEUE_BACKOFF_MAX_SEC = 1800
+QUEUE_POLL_SEC = 1.0              # 佇列為空時工作執行緒的輪詢間隔
+
+# ── 多位使用者（multiuser.py）─────────────────────────────
+# 每位同仁一個資料夾 profiles/<名稱>/：credentials.env、receipts/、ledger.sqlite3（見 profiles.py）
+PROFILES_DIR = "profiles"
+MULTIUSER_WORKERS = 4             # 同時處理的使用者數（各自一個瀏覽器與登入工作階段）
+FOLDER_WORKERS = 4                # folders.py：receipts/ 子資料夾的平行工作程序數
+
+# ── Prometheus 指標（metrics.py）──────────────────────────
+# 每次執行結束（watcher / jobserver 每次送出後）更新 .prom 檔；
+# 指向 node_exporter 的 textfile collector 目錄即可被收集
+METRICS_FILE = f"{OUTPUT_DIR}/metrics.prom"
+METRICS_DB = f"{OUTPUT_DIR}/metrics.sqlite3"   # 計數器跨執行累計
+
 # ── OCR 結果到表單的欄位對映 ──────────────────────────
 # OCR 回傳 dict 的 key → 表單欄位名稱
 FIELD_MAPPING = {
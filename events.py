@@ -0,0 +1,138 @@
+"""結構化事件紀錄：每個步驟寫成一行 JSON，存到 output/runs/<年>/<月>/<run-id>/events.jsonl。
+
+兩種事件：
+    step   profiling.span() / @profiling.timed 包住的階段與瀏覽器子步驟結束時自動寫入
+           {"event": "step", "stage": "fill", "step": "fill/form/appy", "action": "appy",
+            "duration_ms": 5230.4, "cpu_ms": 41.0, "outcome": "ok"}（失敗時 outcome 為
+            "error"，另有 "error" 欄位）
+    log    debug() / info() / warn() / error() 取代診斷用的 print
+           {"event": "log", "level": "debug", "msg": "[PRE-CYCLE] ...", 其他欄位}
+每行另有 ts、run_id，以及 bind() 綁定在目前執行緒的識別欄位（batch、file...）。
+
+終端機只顯示 verbosity 以上的訊息：
+    quiet    警告與錯誤
+    normal   加上填單進度（預設）
+    verbose  加上 [PRE-CYCLE]、品項明細等診斷
+紀錄檔不受 verbosity 影響，一律完整寫入，可跨多次執行彙總各步驟耗時。
+add_listener() 註冊的函式也會收到每個事件（metrics.py 據此累計指標），
+沒有開啟紀錄檔時（watcher.py、jobserver.py）同樣有效。
+
+用法：
+    python main.py -v             # 終端機顯示診斷訊息
+    python main.py -q             # 只顯示警告與錯誤
+    cat output/runs/*/*/*/events.jsonl | jq -r 'select(.event == "step") | [.step, .duration_ms] | @tsv'
+"""
+
+import json
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import profiling
+
+LOG_NAME = "events.jsonl"
+LEVELS = {"debug": 10, "info": 20, "warn": 30, "error": 40}
+VERBOSITY = {"quiet": "warn", "normal": "info", "verbose": "debug"}
+
+_console = LEVELS["info"]
+_file = None
+_fields: dict = {}      # 每行都有的欄位（run_id）
+_lock = threading.Lock()
+_local = threading.local()
+_listeners: list = []   # fn(事件 dict)
+
+
+def set_verbosity(name: str) -> None:
+    """終端機顯示的最低層級：quiet / normal / verbose。"""
+    global _console
+    _console = LEVELS[VERBOSITY[name]]
+
+
+def open_log(directory, **fields) -> Path:
+    """開始寫入 directory/events.jsonl（附加，接續執行時沿用同一檔）；fields 寫在每一行。"""
+    global _file, _fields
+    close()
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / LOG_NAME
+    _file = open(path, "a", encoding="utf-8")
+    _fields = fields
+    profiling.add_listener(_on_step)
+    return path
+
+
+def close() -> None:
+    global _file
+    if not _listeners:
+        profiling.remove_listener(_on_step)
+    with _lock:
+        if _file is not None:
+            _file.close()
+            _file = None
+
+
+def add_listener(fn) -> None:
+    """每個事件寫出時呼叫 fn(事件 dict)（與紀錄檔是否開啟無關）。"""
+    if fn not in _listeners:
+        _listeners.append(fn)
+    profiling.add_listener(_on_step)
+
+
+@contextmanager
+def bind(**ids):
+    """with 區塊內，目前執行緒寫出的事件都帶上 ids（如 batch=2）。"""
+    previous = getattr(_local, "ids", {})
+    _local.ids = {**previous, **ids}
+    try:
+        yield
+    finally:
+        _local.ids = previous
+
+
+def emit(event: str, **fields) -> None:
+    """寫入一行事件並通知監聽者（兩者皆無時不做任何事）。"""
+    if _file is None and not _listeners:
+        return
+    record = {"ts": datetime.now().isoformat(timespec="milliseconds"), "event": event,
+              **_fields, **getattr(_local, "ids", {}), **fields}
+    for fn in list(_listeners):
+        fn(record)
+    if _file is None:
+        return
+    line = json.dumps(record, ensure_ascii=False, default=str)
+    with _lock:
+        if _file is not None:
+            _file.write(line + "\n")
+            _file.flush()
+
+
+def _log(level: str, msg: str, fields: dict) -> None:
+    if LEVELS[level] >= _console:
+        print(msg)
+    emit("log", level=level, msg=msg.strip(), **fields)
+
+
+def debug(msg: str, **fields) -> None:
+    _log("debug", msg, fields)
+
+
+def info(msg: str, **fields) -> None:
+    _log("info", msg, fields)
+
+
+def warn(msg: str, **fields) -> None:
+    _log("warn", msg, fields)
+
+
+def error(msg: str, **fields) -> None:
+    _log("error", msg, fields)
+
+
+def _on_step(path: str, wall: float, cpu: float, err: str, ids: dict) -> None:
+    fields = {"stage": path.split("/", 1)[0], "step": path, "action": path.rsplit("/", 1)[-1],
+              "duration_ms": round(wall * 1000, 1), "cpu_ms": round(cpu * 1000, 1),
+              "outcome": "error" if err else "ok", **ids}
+    if err:
+        fields["error"] = err
+    emit("step", **fields)
@@ -0,0 +1,160 @@
+"""依子資料夾分批：receipts/ 下每個子資料夾（一趟出差、一個專案）各自成為請購單，
+由多個工作程序平行處理。
+
+    receipts/
+      2026-02-台中出差/   → 一張請購單（超過 APPP/APPA 列數上限時才拆單）
+      國科會-材料/         → 一張請購單
+
+每個子資料夾在獨立的工作程序中執行 multiuser.process_user() 的流程：
+    OCR（同時啟動瀏覽器並登入）→ 外幣比對 / 正規化 → 略過已送出的收據
+    → 依列數上限規劃 → 填入系統
+各程序有自己的 Playwright 與瀏覽器，OCR 後處理與瀏覽器自動化都能分散到多核心。
+刷卡紀錄只和同一個資料夾內的外幣收據比對，請放在對應的子資料夾。
+
+協調程序收集各程序的輸出（每行前面標示資料夾名稱）與結果，最後列出摘要。
+帳密、流水號帳本與送出紀錄沿用預設使用者（SQLite 帳本可跨程序共用）；
+學到的廠商別名與待對帳清單以檔案鎖讀改寫（jsonfile.py），各程序同時更新也不會互相覆蓋；
+各程序同時登入時驗證碼各用自己的暫存檔（form_filler.solve_captcha），不共用 misc/ 的檔案；
+失敗的資料夾可用 python main.py --resume <執行ID> 接續。
+receipts/ 最上層的檔案不在此模式處理（請用 main.py）。
+
+用法：
+    python folders.py --headless
+    python folders.py --workers 2 --only 2026-02-台中出差
+"""
+
+import argparse
+import multiprocessing
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from config import RECEIPTS_DIR, FOLDER_WORKERS, MATCH_MODE, POLICY_FILE, RUNS_DIR
+from main import SUPPORTED_EXTENSIONS, choose_plan
+from multiuser import _LabeledOutput, process_user, print_summary
+from planner import BatchRules
+from runstate import RunState
+import artifacts
+import policy
+import profiles
+from policy import Policy
+
+
+def find_folders(root=RECEIPTS_DIR, only=None) -> list:
+    """列出 root 下含收據檔案的子資料夾（依名稱排序）；only 指定時只取這些名稱。"""
+    root = Path(root)
+    if not root.exists():
+        return []
+    folders = [d for d in sorted(root.iterdir())
+               if d.is_dir() and any(f.suffix.lower() in SUPPORTED_EXTENSIONS
+                                     for f in d.iterdir())]
+    if only:
+        folders = [d for d in folders if d.name in only]
+    return folders
+
+
+class _QueueStream:
+    """工作程序的 stdout：輸出交給協調程序統一印出。"""
+
+    def __init__(self, queue):
+        self.queue = queue
+
+    def write(self, text: str) -> int:
+        self.queue.put(text)
+        return len(text)
+
+    def flush(self) -> None:
+        pass
+
+
+def _init_worker(log_queue, policy_path: str) -> None:
+    """工作程序啟動時：輸出導向協調程序、載入無人值守政策。"""
+    sys.stdout = _LabeledOutput(_QueueStream(log_queue))
+    policy.use(Policy.load(policy_path, unattended=True))
+
+
+def _run_folder(folder: str, args, plan_name: str, use_project: bool) -> dict:
+    """在工作程序中處理一個子資料夾（預設使用者的帳密與帳本，收據來自該資料夾）。"""
+    base = profiles.current()
+    shard = profiles.Profile(Path(folder).name, base.username, base.password,
+                             base.payee_code, receipts_dir=folder, ledger_db=base.ledger_db)
+    # 不套用分組規則：整個資料夾合成一張（僅依列數上限拆單）
+    return process_user(shard, args, BatchRules(), plan_name, use_project, sys.stdout)
+
+
+def _print_logs(log_queue) -> None:
+    """協調程序：依到達順序印出各工作程序的輸出，收到 None 結束。"""
+    while True:
+        text = log_queue.get()
+        if text is None:
+            return
+        sys.stdout.write(text)
+        sys.stdout.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=f"{RECEIPTS_DIR}/ 每個子資料夾各成一張請購單，多程序平行處理"
+    )
+    parser.add_argument("--workers", type=int, default=FOLDER_WORKERS,
+                        help=f"工作程序數（預設 {FOLDER_WORKERS}）")
+    parser.add_argument("--only", nargs="+", default=[], metavar="NAME",
+                        help="只處理這些子資料夾")
+    parser.add_argument("--plan", type=str, default="", help="計畫名稱關鍵字（同 main.py）")
+    parser.add_argument("--project", action="store_true", help="使用「計畫請購」路徑")
+    parser.add_argument("--match-mode", choices=["optimal", "greedy"], default=MATCH_MODE,
+                        help=f"外幣收據與刷卡紀錄的比對方式（預設 {MATCH_MODE}）")
+    parser.add_argument("--policy", type=str, default=POLICY_FILE,
+                        help=f"執行政策檔（預設 {POLICY_FILE}）")
+    parser.add_argument("--headless", action="store_true", help="不顯示瀏覽器視窗")
+    args = parser.parse_args()
+
+    try:
+        run_policy = policy.use(Policy.load(args.policy, unattended=True))
+    except (ValueError, OSError) as e:
+        print(f"[ERROR] 政策檔 {args.policy} 無法讀取: {e}")
+        sys.exit(1)
+    folders = find_folders(only=args.only)
+    if not folders:
+        print(f"{RECEIPTS_DIR}/ 中沒有含收據的子資料夾")
+        sys.exit(0)
+
+    plan_name, need_project = choose_plan(preset=args.plan or run_policy.plan,
+                                          mode=run_policy.mode)
+    use_project = args.project or need_project
+    workers = max(1, min(args.workers, len(folders)))
+    print(f"\n處理 {len(folders)} 個資料夾（{workers} 個工作程序）: "
+          f"{', '.join(d.name for d in folders)}")
+
+    ctx = multiprocessing.get_context("spawn")   # 各程序乾淨啟動自己的 Playwright
+    log_queue = ctx.Queue()
+    printer = threading.Thread(target=_print_logs, args=(log_queue,), daemon=True)
+    printer.start()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                                 initializer=_init_worker,
+                                 initargs=(log_queue, args.policy)) as pool:
+            futures = [pool.submit(_run_folder, str(d), args, plan_name, use_project)
+                       for d in folders]
+            summaries = []
+            for d, future in zip(folders, futures):
+                try:
+                    summaries.append(future.result())
+                except Exception as e:   # 工作程序異常結束
+                    summaries.append({"user": d.name, "receipts": 0, "requisitions": 0,
+                                      "ok": 0, "failed": 0, "record_nos": [],
+                                      "error": f"工作程序失敗: {e}", "run_id": ""})
+    finally:
+        log_queue.put(None)
+        printer.join()
+
+    artifacts.prune_after_run(keep=[RunState.path(RUNS_DIR, s["run_id"])
+                                    for s in summaries if s["run_id"]])
+    print_summary(summaries, "資料夾", lambda s: f"python main.py --resume {s['run_id']}")
+    if any(s["error"] or s["failed"] for s in summaries):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,8 +2,8 @@
 
 import os
 import json
+import tempfile
 import time
-import threading
 import urllib.parse
 
 from playwright.sync_api import sync_playwright, Page, BrowserContext, Frame
@@ -11,55 +11,41 @@ from google import genai
 from PIL import Image
 
 from config import (
-    SYSTEM_URL, USERNAME, PASSWORD,
-    LOGIN_SELECTORS, MENU_URL, OUTPUT_DIR,
+    SYSTEM_URL,
+    LOGIN_SELECTORS, MENU_URL,
     EXPENSE_CATEGORY, APPP_FIELDS, APPY_FIELDS, APPA_FIELDS,
-    DEFAULT_SUBJECT, RECEIPT_PREFIX, PAYEE_CODE, BANK_KEYWORD,
+    DEFAULT_SUBJECT, RECEIPT_PREFIX, BANK_KEYWORD,
 )
-
-
-# ────────────────────────────────────────────────────────
-# Timed input (超時自動選預設)
-# ────────────────────────────────────────────────────────
-
-def _timed_input(prompt: str, timeout: int = 10, default: str = "") -> str:
-    """
-    帶超時的 input()。超過 timeout 秒未輸入則自動回傳 default。
-    Windows 相容（使用 threading）。
-    """
-    result = [default]
-
-    def _ask():
-        try:
-            result[0] = input(prompt)
-        except EOFError:
-            result[0] = default
-
-    t = threading.Thread(target=_ask, daemon=True)
-    t.start()
-    t.join(timeout)
-    if t.is_alive():
-        print(f"\n    (超過 {timeout} 秒未選擇，自動使用預設值)")
-        return default
-    return result[0]
+import artifacts
+import events
+import policy
+import profiles
+import profiling
 
 
 # ────────────────────────────────────────────────────────
 # Captcha OCR
 # ────────────────────────────────────────────────────────
 
+@profiling.timed("captcha")
 def solve_captcha(page: Page) -> str:
     """截圖驗證碼圖片，用 Gemini 辨識回傳數字字串。"""
     captcha_img = page.query_selector(LOGIN_SELECTORS["captcha_image"])
     if not captcha_img:
         raise RuntimeError("找不到驗證碼圖片")
 
-    captcha_path = f"{OUTPUT_DIR}/captcha_tmp.png"
-    captcha_img.screenshot(path=captcha_path)
+    # 驗證碼保持無損 PNG（辨識用），不套用截圖壓縮；每次登入用自己的暫存檔，
+    # 多位使用者、多個瀏覽器執行緒或程序同時登入時才不會讀到別人的驗證碼
+    fd, captcha_path = tempfile.mkstemp(prefix="captcha_", suffix=".png")
+    os.close(fd)
+    try:
+        captcha_img.screenshot(path=captcha_path)
+        with Image.open(captcha_path) as im:
+            image = im.copy()
+    finally:
+        os.remove(captcha_path)
 
     client = genai.Client(api_key=os.environ["GEMINI_API_KEY"])
-    image = Image.open(captcha_path)
-
     response = client.models.generate_content(
         model="gemini-2.5-flash",
         contents=[
@@ -69,7 +55,7 @@ def solve_captcha(page: Page) -> str:
         ],
     )
     code = response.text.strip()
-    print(f"  驗證碼辨識結果: {code}")
+    events.info(f"  驗證碼辨識結果: {code}", code=code)
     return code
 
 
@@ -77,25 +63,27 @@ def solve_captcha(page: Page) -> str:
 # Login
 # ────────────────────────────────────────────────────────
 
+@profiling.timed("login")
 def login(context: BrowserContext, max_retries: int = 5) -> Page:
     """
-    登入核銷系統，處理驗證碼和新視窗彈出。
+    登入核銷系統，處理驗證碼和新視窗彈出（帳密取自 profiles.current()）。
 
     Returns:
         登入後的新視窗 Page 物件（主選單頁面）
     """
     page = context.pages[0]
     page.on("dialog", lambda d: d.accept())
+    user = profiles.current()
 
     for attempt in range(1, max_retries + 1):
-        print(f"  登入嘗試 {attempt}/{max_retries}...")
+        events.info(f"  登入嘗試 {attempt}/{max_retries}...", attempt=attempt)
 
         page.goto(SYSTEM_URL)
         page.wait_for_load_state("networkidle")
 
         # 填入帳號密碼
-        page.fill(LOGIN_SELECTORS["user_id"], USERNAME)
-        page.fill(LOGIN_SELECTORS["password"], PASSWORD)
+        page.fill(LOGIN_SELECTORS["user_id"], user.username)
+        page.fill(LOGIN_SELECTORS["password"], user.password)
 
         # 辨識並填入驗證碼
         captcha_code = solve_captcha(page)
@@ -108,22 +96,26 @@ def login(context: BrowserContext, max_retries: int = 5) -> Page:
 
             new_page = new_page_info.value
             new_page.wait_for_load_state("networkidle", timeout=15000)
-            print(f"  登入成功！新視窗: {new_page.url}")
+            events.info(f"  登入成功！新視窗: {new_page.url}", action="login", outcome="ok",
+                        attempt=attempt)
             return new_page
 
         except Exception:
             time.sleep(1)
             body = page.content()
             if "帳號密碼錯誤" in body:
-                print(f"  帳號密碼錯誤（第 {attempt} 次）")
+                events.warn(f"  帳號密碼錯誤（第 {attempt} 次）", action="login",
+                            outcome="bad_password", attempt=attempt)
             elif "驗證碼" in body:
-                print(f"  驗證碼錯誤（第 {attempt} 次）")
+                events.warn(f"  驗證碼錯誤（第 {attempt} 次）", action="login",
+                            outcome="bad_captcha", attempt=attempt)
             else:
-                print(f"  登入失敗，未知原因（第 {attempt} 次）")
+                events.warn(f"  登入失敗，未知原因（第 {attempt} 次）", action="login",
+                            outcome="unknown", attempt=attempt)
 
             if attempt == max_retries:
                 raise RuntimeError(f"登入失敗，已嘗試 {max_retries} 次")
-            print("  重新嘗試...")
+            events.info("  重新嘗試...")
 
     raise RuntimeError("登入失敗")
 
@@ -132,6 +124,7 @@ def login(context: BrowserContext, max_retries: int = 5) -> Page:
 # Navigate to expense form
 # ────────────────────────────────────────────────────────
 
+@profiling.timed("navigate")
 def navigate_to_expense_form(menu_page: Page, use_project: bool = False,
                               plan_name: str = "") -> dict:
     """
@@ -153,13 +146,13 @@ def navigate_to_expense_form(menu_page: Page, use_project: bool = False,
         dict with frame references: {"appy": Frame, "appp": Frame, "appa": Frame}
     """
     mode = "計畫請購" if use_project else "部門請購"
-    print(f"  導航到核銷表單（{mode}）...")
+    events.info(f"  導航到核銷表單（{mode}）...")
 
     # 導航階段掛 dialog handler，避免意外 dialog 阻塞流程
     def _nav_dialog_handler(dialog):
         try:
             msg = dialog.message
-            print(f"    [NAV-DIALOG {dialog.type}] {msg}")
+            events.info(f"    [NAV-DIALOG {dialog.type}] {msg}")
             dialog.accept()
         except Exception:
             pass
@@ -269,7 +262,7 @@ def navigate_to_expense_form(menu_page: Page, use_project: bool = False,
         try:
             frame.wait_for_load_state("networkidle", timeout=10000)
         except Exception:
-            print(f"  警告: {name} frame 載入超時")
+            events.warn(f"  警告: {name} frame 載入超時")
 
     # 移除導航階段的 dialog handler，避免影響後續
     try:
@@ -277,7 +270,7 @@ def navigate_to_expense_form(menu_page: Page, use_project: bool = False,
     except Exception:
         pass
 
-    print(f"  核銷表單已開啟 (找到 {len(frames)} 個 frame)")
+    events.info(f"  核銷表單已開啟 (找到 {len(frames)} 個 frame)")
     return frames
 
 
@@ -375,14 +368,16 @@ def generate_receipt_no(iso_date: str, seq: int) -> str:
     產生收據號碼。
 
     格式: "收據11502261"  = 收據(2字) + 民國年(3) + 月(2) + 日(2) + 流水號(1) = 2字+8數字
+    同日超過 9 張時流水號改為 2 位: "收據115022612" = 2字+9數字
 
     Args:
         iso_date: ISO 日期 (YYYY-MM-DD)
-        seq: 當天流水號 (1~9)
+        seq: 當天流水號 (1~99，由收據流水號帳本配發)
     """
     y, m, d = _roc_date(iso_date)
-    # 流水號限 1 位（1~9），符合 2字+8數字規則
-    s = min(max(seq, 1), 9)
+    s = max(seq, 1)
+    if s > 99:
+        raise ValueError(f"收據流水號超過上限 99: {iso_date} #{s}")
     return f"{RECEIPT_PREFIX}{y}{m}{d}{s}"
 
 
@@ -408,6 +403,7 @@ def _sanitize_receipt_no(invoice_no: str) -> str:
     return ""
 
 
+@profiling.timed("appy")
 def fill_appy_frame(appy_frame: Frame, menu_page: Page,
                      amount: int, subject_code: str = "",
                      plan_name: str = ""):
@@ -434,7 +430,7 @@ def fill_appy_frame(appy_frame: Frame, menu_page: Page,
     chosen_plan_text = ""   # 計畫全名（下拉選單文字）
     chosen_plan_code = ""   # 計畫代碼（BUGETNO 值）
 
-    print("  填寫 APPY（表頭/計畫經費）...")
+    events.info("  填寫 APPY（表頭/計畫經費）...")
 
     # ── Step 1: 選擇計畫編號（依 plan_name 搜尋或選預設）
     # 重要：必須確保 BUGETNO_1 有值，否則 SUM_ALERT 會跳過此行
@@ -450,7 +446,7 @@ def fill_appy_frame(appy_frame: Frame, menu_page: Page,
 
     # 若第一次讀取為空，等待 5 秒後重試（選單可能還在非同步載入）
     if not valid_options:
-        print("    BUGETNO_1 選項為空，等待 5 秒後重試...")
+        events.info("    BUGETNO_1 選項為空，等待 5 秒後重試...")
         time.sleep(5)
         valid_options = _read_bugetno_options()
     
@@ -463,11 +459,14 @@ def fill_appy_frame(appy_frame: Frame, menu_page: Page,
                     selected_idx = opt['index']
                     chosen_plan_text = opt['text']
                     chosen_plan_code = opt['value']
-                    print(f"    自動匹配計畫: {opt['text']}")
+                    events.info(f"    自動匹配計畫: {opt['text']}")
                     break
         
         # 找不到或未指定，列出選項讓使用者挑
         if selected_idx == -1:
+            if plan_name and policy.current().plan_not_found:
+                # 政策指定找不到計畫時中止（避免無人值守時扣錯經費）
+                raise RuntimeError(f"找不到包含「{plan_name}」的計畫（政策 abort.plan_not_found）")
             if plan_name:
                 print(f"    ⚠️ 找不到包含「{plan_name}」的計畫！請從可用計畫中選擇：")
             else:
@@ -478,7 +477,7 @@ def fill_appy_frame(appy_frame: Frame, menu_page: Page,
             print(f"      0. 預設選第一個 ({valid_options[0]['text']})")
             
             try:
-                choice = _timed_input("    > ", timeout=10, default="0").strip()
+                choice = policy.current().ask("bugetno", "    > ", timeout=10, default="0").strip()
                 if not choice or choice == "0":
                     selected_idx = valid_options[0]['index']
                 else:
@@ -497,7 +496,7 @@ def fill_appy_frame(appy_frame: Frame, menu_page: Page,
             if chosen_opt:
                 chosen_plan_text = chosen_opt['text']
                 chosen_plan_code = chosen_opt['value']
-            print(f"    -> 最終選擇計畫: {chosen_plan_text}")
+            events.info(f"    -> 最終選擇計畫: {chosen_plan_text}")
             
         # 設定下拉選單的值
         appy_frame.evaluate(f"""() => {{
@@ -505,16 +504,16 @@ def fill_appy_frame(appy_frame: Frame, menu_page: Page,
         }}""")
         time.sleep(0.5)
     else:
-        print("    [FAIL] BUGETNO_1 無可用計畫選項！")
+        events.error("    [FAIL] BUGETNO_1 無可用計畫選項！")
 
     # ── Step 1.5: 觸發 BN_1() 載入 BUGCODE 下拉選單
     # 必須透過 BN_1() 觸發，光 dispatch change event 可能不夠
     try:
         appy_frame.evaluate("if (typeof BN_1 === 'function') BN_1();")
         time.sleep(2)  # 等待 BUGCODE 下拉選單載入
-        print("    BN_1() 已觸發（載入經費用途選單）")
+        events.debug("    BN_1() 已觸發（載入經費用途選單）")
     except Exception as e:
-        print(f"    警告: BN_1() 失敗 ({e})")
+        events.warn(f"    警告: BN_1() 失敗 ({e})")
 
     # ── Step 2: 選擇經費用途（搜尋「業務」或選預設）
     selected_code = appy_frame.evaluate("""() => {
@@ -543,19 +542,19 @@ def fill_appy_frame(appy_frame: Frame, menu_page: Page,
 
     if selected_code.get("found"):
         fb = " (備案)" if selected_code.get("fallback") else ""
-        print(f"    經費用途{fb}: {selected_code.get('text', '(預設)')}")
+        events.info(f"    經費用途{fb}: {selected_code.get('text', '(預設)')}")
     else:
-        print(f"    [WARN] BUGCODE_1 選擇失敗: {selected_code.get('reason', '預設')}")
+        events.warn(f"    [WARN] BUGCODE_1 選擇失敗: {selected_code.get('reason', '預設')}")
         if selected_code.get("options"):
-            print(f"    可用選項: {selected_code['options']}")
+            events.debug(f"    可用選項: {selected_code['options']}")
 
     # ── Step 3: 觸發 BC_1() 取得經費餘額（透過 LA_AM frame 提交）
     try:
         appy_frame.evaluate("if (typeof BC_1 === 'function') BC_1();")
         time.sleep(2)  # 等 LA_AM frame 回傳
-        print("    BC_1() 已觸發（查詢經費餘額）")
+        events.debug("    BC_1() 已觸發（查詢經費餘額）")
     except Exception as e:
-        print(f"    警告: BC_1() 失敗 ({e})")
+        events.warn(f"    警告: BC_1() 失敗 ({e})")
 
     # ── Step 4: 填入金額 (D_AMOUNT_1) 與 會計科目 (SUBJECTNO_1)
     appy_frame.evaluate(f"""() => {{
@@ -586,7 +585,7 @@ def fill_appy_frame(appy_frame: Frame, menu_page: Page,
         
         if (typeof SUM_SUM === 'function') SUM_SUM();
     }}""")
-    print(f"    金額: {amount}, 預設科目: {subject_code}")
+    events.info(f"    金額: {amount}, 預設科目: {subject_code}")
 
     # ── Step 5: 驗證 BUGETNO_1、BUGCODE_1、D_AMOUNT_1 三個必填欄位
     # SUM_ALERT 要求三者都有值，否則 T_BUG_AMT=0
@@ -601,7 +600,7 @@ def fill_appy_frame(appy_frame: Frame, menu_page: Page,
     amount_ok = bool(verify.get("amount"))
 
     if bugetno_ok and bugcode_ok and amount_ok:
-        print(f"    [OK] BUGETNO={verify['bugetno']}, BUGCODE={verify['bugcode']}, AMOUNT={verify['amount']}")
+        events.info(f"    [OK] BUGETNO={verify['bugetno']}, BUGCODE={verify['bugcode']}, AMOUNT={verify['amount']}")
     else:
         missing = []
         if not bugetno_ok:
@@ -610,16 +609,18 @@ def fill_appy_frame(appy_frame: Frame, menu_page: Page,
             missing.append("BUGCODE_1")
         if not amount_ok:
             missing.append("D_AMOUNT_1")
-        print(f"    [FAIL] 必填欄位為空: {', '.join(missing)}")
-        print(f"      BUGETNO={verify.get('bugetno', '')}, BUGCODE={verify.get('bugcode', '')}, AMOUNT={verify.get('amount', '')}")
-        print(f"      SUM_ALERT 將無法計算請購金額（T_BUG_AMT=0）！")
+        events.error(f"    [FAIL] 必填欄位為空: {', '.join(missing)}")
+        events.error(f"      BUGETNO={verify.get('bugetno', '')}, BUGCODE={verify.get('bugcode', '')}, AMOUNT={verify.get('amount', '')}")
+        events.error(f"      SUM_ALERT 將無法計算請購金額（T_BUG_AMT=0）！")
 
-    print("  APPY 填寫完成")
+    events.info("  APPY 填寫完成")
     return chosen_plan_text, chosen_plan_code
 
 
+@profiling.timed("appa")
 def fill_appa_frame(appa_frame: Frame, menu_page: Page, context,
-                     receipt_data: dict, receipt_seq: int = 1):
+                     receipt_data: dict, receipt_seq: int = 1,
+                     receipt_seqs: dict = None):
     """
     填寫 APPA frame（受款人）：代墊、收據號碼、日期、受款人代碼、銀行帳戶、金額。
 
@@ -637,8 +638,17 @@ def fill_appa_frame(appa_frame: Frame, menu_page: Page, context,
         context: BrowserContext（用於偵測彈窗）
         receipt_data: OCR 辨識結果
         receipt_seq: 當天收據流水號 (1, 2, ...)
+        receipt_seqs: {收據日期: 帳本保留的第一個流水號}；多行模式各列依自己的日期
+            取號（沒有日期的用請購單日期）。未提供時各日期都從 receipt_seq 起算。
     """
-    print("  填寫 APPA（受款人）...")
+    events.info("  填寫 APPA（受款人）...")
+
+    next_seq = dict(receipt_seqs or {})
+
+    def _take_seq(iso_date: str) -> int:
+        seq = next_seq.get(iso_date, receipt_seq)
+        next_seq[iso_date] = seq + 1
+        return seq
 
     # 偵測多行模式（合併了多張收據時，每張一行）
     _receipts_list = receipt_data.get("_receipts", [])
@@ -653,7 +663,7 @@ def fill_appa_frame(appa_frame: Frame, menu_page: Page, context,
             amount = int(float(_r0.get("amount", 0))) or receipt_data.get("amount", 0)
         except (ValueError, TypeError):
             amount = receipt_data.get("amount", 0)
-        print(f"  （多行模式：{len(_receipts_list)} 張收據 → {len(_receipts_list)} 行）")
+        events.info(f"  （多行模式：{len(_receipts_list)} 張收據 → {len(_receipts_list)} 行）")
     else:
         date_str = receipt_data.get("date", "")
         amount = receipt_data.get("amount", 0)
@@ -668,7 +678,7 @@ def fill_appa_frame(appa_frame: Frame, menu_page: Page, context,
         }
     }""")
     time.sleep(0.3)
-    print("    代墊: 已勾選")
+    events.info("    代墊: 已勾選")
 
     # ── Step 2: 填入收據/發票號碼 ────────────────
     # 格式: 2個文字 + 8個數字（如 "收據11502261" 或 "AB12345678"）
@@ -677,11 +687,11 @@ def fill_appa_frame(appa_frame: Frame, menu_page: Page, context,
     if sanitized:
         receipt_no = sanitized
         if sanitized != invoice_no:
-            print(f"    [sanitize] 收據號碼: '{invoice_no}' -> '{sanitized}'")
+            events.debug(f"    [sanitize] 收據號碼: '{invoice_no}' -> '{sanitized}'")
     elif date_str:
-        receipt_no = generate_receipt_no(date_str, receipt_seq)
+        receipt_no = generate_receipt_no(date_str, _take_seq(date_str))
     else:
-        receipt_no = f"{RECEIPT_PREFIX}000000{receipt_seq:02d}"
+        receipt_no = f"{RECEIPT_PREFIX}000000{_take_seq(''):02d}"
 
     receipt_no_esc = _js_escape(receipt_no)
     appa_frame.evaluate(f"""() => {{
@@ -692,7 +702,7 @@ def fill_appa_frame(appa_frame: Frame, menu_page: Page, context,
             el.dispatchEvent(new Event('blur', {{bubbles:true}}));
         }}
     }}""")
-    print(f"    收據號碼: {receipt_no}")
+    events.info(f"    收據號碼: {receipt_no}")
 
     # ── Step 3: 填入日期 ─────────────────────────
     if date_str:
@@ -705,10 +715,10 @@ def fill_appa_frame(appa_frame: Frame, menu_page: Page, context,
                 el.dispatchEvent(new Event('blur', {{bubbles:true}}));
             }}
         }}""")
-        print(f"    日期: {idate}")
+        events.info(f"    日期: {idate}")
 
     # ── Step 4: 填入受款人代碼（代墊者帳號）──────
-    payee = PAYEE_CODE
+    payee = profiles.current().payee_code
     payee_esc = _js_escape(payee)
     # 只設值，不 fire blur（避免觸發 CHK_P_1 清除資料）。
     # VENDORID_1 使用 CharToAsc 編碼；Step 5 會透過 CHK_P_1 開彈窗取銀行資料。
@@ -719,7 +729,7 @@ def fill_appa_frame(appa_frame: Frame, menu_page: Page, context,
         }}
     }}""")
     time.sleep(0.3)
-    print(f"    受款人代碼: {payee}")
+    events.info(f"    受款人代碼: {payee}")
 
     # ── Step 5: 觸發 CHK_P_1() → 銀行帳戶選擇彈窗 ─
     # CHK_P_1() 提交到 CK_VN frame → 彈出 SELECT_VEN_Q.asp 視窗
@@ -733,7 +743,7 @@ def fill_appa_frame(appa_frame: Frame, menu_page: Page, context,
 
         popup = popup_info.value
         popup.wait_for_load_state("networkidle", timeout=10000)
-        print("    銀行選擇彈窗已開啟")
+        events.debug("    銀行選擇彈窗已開啟")
 
         # 找到包含「一銀竹北」的行，從其按鈕的 onclick 提取回填值
         bank_kw = _js_escape(BANK_KEYWORD)
@@ -794,11 +804,11 @@ def fill_appa_frame(appa_frame: Frame, menu_page: Page, context,
                 "an": result.get("accountnam", ""),
                 "vs": result.get("vendorid_s", payee),
             }
-            print(f"    銀行帳戶: {result.get('text', '')[:60]}")
-            print(f"    受款人: {vn}, 銀行: {an} ({bk})")
+            events.info(f"    銀行帳戶: {result.get('text', '')[:60]}")
+            events.info(f"    受款人: {vn}, 銀行: {an} ({bk})")
         else:
-            print(f"    警告: 未找到「{BANK_KEYWORD}」")
-            print(f"    彈窗內容: {result.get('body', '')[:200]}")
+            events.warn(f"    警告: 未找到「{BANK_KEYWORD}」")
+            events.debug(f"    彈窗內容: {result.get('body', '')[:200]}")
 
         # 關閉彈窗 — 必須確實關閉，否則可能影響後續操作
         try:
@@ -807,7 +817,7 @@ def fill_appa_frame(appa_frame: Frame, menu_page: Page, context,
                 time.sleep(0.5)
             # 二次確認是否關閉
             if not popup.is_closed():
-                print("    警告: 彈窗未關閉，嘗試強制關閉")
+                events.warn("    警告: 彈窗未關閉，嘗試強制關閉")
                 popup.evaluate("window.close()")
                 time.sleep(0.5)
         except Exception:
@@ -817,23 +827,23 @@ def fill_appa_frame(appa_frame: Frame, menu_page: Page, context,
         try:
             closed = popup.is_closed()
             if not closed:
-                print("    警告: 銀行帳戶彈窗仍未關閉！")
+                events.warn("    警告: 銀行帳戶彈窗仍未關閉！")
             else:
-                print("    銀行帳戶彈窗已關閉")
+                events.debug("    銀行帳戶彈窗已關閉")
         except Exception:
             pass
         time.sleep(1)
 
     except Exception as e:
         # 沒有彈窗 = CK_VN 直接回填（只有一個帳戶的情況）
-        print(f"    銀行帳戶: CK_VN 直接回填（無彈窗）")
+        events.info(f"    銀行帳戶: CK_VN 直接回填（無彈窗）")
         time.sleep(3)
 
     # 確保所有殘留的彈窗都被關閉
     try:
         for p in context.pages:
             if p != menu_page and "SELECT_VEN" in p.url:
-                print(f"    清理殘留彈窗: {p.url[-50:]}")
+                events.debug(f"    清理殘留彈窗: {p.url[-50:]}")
                 p.close()
                 time.sleep(0.3)
     except Exception:
@@ -849,9 +859,9 @@ def fill_appa_frame(appa_frame: Frame, menu_page: Page, context,
         accountnam: FORM1.ACCOUNTNAM_1.value,
     })""")
     if ven_info.get("venname"):
-        print(f"    [OK] 受款人: {ven_info['venname']}, 銀行: {ven_info.get('accountnam', '')} ({ven_info.get('bankno', '')})")
+        events.info(f"    [OK] 受款人: {ven_info['venname']}, 銀行: {ven_info.get('accountnam', '')} ({ven_info.get('bankno', '')})")
     else:
-        print(f"    [WARN] 受款人姓名未填入！venname={ven_info.get('venname')}, bankno={ven_info.get('bankno')}")
+        events.warn(f"    [WARN] 受款人姓名未填入！venname={ven_info.get('venname')}, bankno={ven_info.get('bankno')}")
 
     # ── Step 5.5: 確保 VENDORID_1 有值 ────────────
     # SUM_ALERT 的條件是 VENNAME_1 != "" && VENDORID_1 != ""
@@ -880,11 +890,11 @@ def fill_appa_frame(appa_frame: Frame, menu_page: Page, context,
         }};
     }}""")
     if vendorid_check.get("vendorid"):
-        print(f"    [OK] VENDORID_1: {vendorid_check['vendorid'][:30]}...")
+        events.info(f"    [OK] VENDORID_1: {vendorid_check['vendorid'][:30]}...")
     else:
-        print(f"    [FAIL] VENDORID_1 仍為空，SUM_ALERT 將跳過此 APPA 行！")
-        print(f"      VENDORID_S_1={vendorid_check.get('vendorid_s')}")
-        print(f"      VENNAME_1={vendorid_check.get('venname')}")
+        events.error(f"    [FAIL] VENDORID_1 仍為空，SUM_ALERT 將跳過此 APPA 行！")
+        events.error(f"      VENDORID_S_1={vendorid_check.get('vendorid_s')}")
+        events.error(f"      VENNAME_1={vendorid_check.get('venname')}")
 
     # ── Step 5.5: 重新填入收據號碼和日期 ──────────
     # CHK_P_1() 觸發查受款人時會清除 INVOICENO_1 和 IDATE_1，必須重填
@@ -905,13 +915,13 @@ def fill_appa_frame(appa_frame: Frame, menu_page: Page, context,
     # 驗證收據號碼確實有值
     inv_check = appa_frame.evaluate("() => FORM1.INVOICENO_1 ? FORM1.INVOICENO_1.value : ''")
     if inv_check:
-        print(f"    [OK] 收據號碼確認: {inv_check}")
+        events.info(f"    [OK] 收據號碼確認: {inv_check}")
     else:
         # 強制重填（不檢查是否為空，直接覆蓋）
         appa_frame.evaluate(f"""() => {{
             if (FORM1.INVOICENO_1) FORM1.INVOICENO_1.value = '{receipt_no_esc}';
         }}""")
-        print(f"    [REFILL] 收據號碼被清除，已強制重填: {receipt_no}")
+        events.info(f"    [REFILL] 收據號碼被清除，已強制重填: {receipt_no}")
 
     # ── Step 6: 填入含稅金額 ─────────────────────
     appa_frame.evaluate(f"""() => {{
@@ -919,12 +929,11 @@ def fill_appa_frame(appa_frame: Frame, menu_page: Page, context,
         // 觸發 SUM_SUM() 更新加總
         if (typeof SUM_SUM === 'function') SUM_SUM();
     }}""")
-    print(f"    含稅金額: {amount}")
+    events.info(f"    含稅金額: {amount}")
 
     # ── Step 7: 多張收據 → 填入 APPA 行 2..N ──────────
     if _is_multi and bank_details:
-        print(f"  填寫 APPA 行 2~{len(_receipts_list)}...")
-        seq_offset = 0
+        events.info(f"  填寫 APPA 行 2~{len(_receipts_list)}...")
         for i, extra_r in enumerate(_receipts_list[1:], start=2):
             extra_invoice = extra_r.get("invoice_no", "")
             extra_date = extra_r.get("date", "")
@@ -937,13 +946,12 @@ def fill_appa_frame(appa_frame: Frame, menu_page: Page, context,
             extra_sanitized = _sanitize_receipt_no(extra_invoice) if extra_invoice else ""
             if extra_sanitized:
                 extra_no = extra_sanitized
-            elif extra_date:
-                seq_offset += 1
-                extra_no = generate_receipt_no(extra_date, receipt_seq + seq_offset)
+            elif extra_date or receipt_data.get("date"):
+                no_date = extra_date or receipt_data["date"]
+                extra_no = generate_receipt_no(no_date, _take_seq(no_date))
             else:
-                seq_offset += 1
-                s = min(max(receipt_seq + seq_offset, 1), 9)
-                extra_no = f"{RECEIPT_PREFIX}000000{s}"
+                s = max(_take_seq(""), 1)
+                extra_no = f"{RECEIPT_PREFIX}000000{s:02d}"
 
             extra_no_esc = _js_escape(extra_no)
             extra_idate = _idate_format(extra_date) if extra_date else ""
@@ -991,7 +999,7 @@ def fill_appa_frame(appa_frame: Frame, menu_page: Page, context,
                 if (am) am.value = '{extra_amount}';
             }}""")
             time.sleep(0.3)
-            print(f"    行{i}: {extra_no} | {extra_idate} | NT${extra_amount}")
+            events.debug(f"    行{i}: {extra_no} | {extra_idate} | NT${extra_amount}")
 
         appa_frame.evaluate("if (typeof SUM_SUM === 'function') SUM_SUM();")
         
@@ -1002,13 +1010,15 @@ def fill_appa_frame(appa_frame: Frame, menu_page: Page, context,
             try { v_name = FORM1.VENNAME_1 ? FORM1.VENNAME_1.value : 'missing_element'; } catch(e) { v_name = 'error'; }
             return { vendor_id: v_id, vendor_name: v_name };
         }""")
-        print(f"    [DIAG-APPA] VENDORID_1='{diag.get('vendor_id', '')}' VENNAME_1='{diag.get('vendor_name', '')}'")
+        events.debug(f"    [DIAG-APPA] VENDORID_1='{diag.get('vendor_id', '')}' VENNAME_1='{diag.get('vendor_name', '')}'")
 
-        print(f"  APPA 填寫完成（共 {len(_receipts_list)} 行）")
+        events.info(f"  APPA 填寫完成（共 {len(_receipts_list)} 行）")
     else:
-        print("  APPA 填寫完成")
+        events.info("  APPA 填寫完成")
 
-def verify_and_save(appy_frame: Frame, menu_page: Page, auto_save: bool = True):
+@profiling.timed("save")
+def verify_and_save(appy_frame: Frame, menu_page: Page, auto_save: bool = True,
+                    outcome: dict = None):
     """
     驗證三個區塊的金額一致後，自動點擊存入。
 
@@ -1025,10 +1035,17 @@ def verify_and_save(appy_frame: Frame, menu_page: Page, auto_save: bool = True):
         - 若 APPA 為空 → confirm("受款人尚未編輯") → dismiss = 不編輯，繼續存
         - 驗證金額一致 → submit PS frame
 
+    Args:
+        outcome: 若提供，會填入 {"confirmed": 是否由 dialog 確認存入成功,
+                 "record_no": 請購單號（dialog 中解析到時）}
+
     Returns:
         bool: True if saved successfully
     """
-    print("  驗證金額並存入...")
+    if outcome is None:
+        outcome = {}
+    outcome.update(confirmed=False, record_no="")
+    events.info("  驗證金額並存入...")
 
     # ── Step 0: 來回點選編輯按鈕，確認資料存在 ──
     # 模擬使用者操作：點選「編輯經費」→「編輯品名」→「編輯受款人」來回切換
@@ -1037,7 +1054,7 @@ def verify_and_save(appy_frame: Frame, menu_page: Page, auto_save: bool = True):
     #   編輯經費:  parent.DD.rows="*,0";   parent.QQ.cols="*,0,0";
     #   編輯品名:  parent.DD.rows="160,*"; parent.QQ.cols="*,0,0";
     #   編輯受款人: parent.DD.rows="160,*"; parent.QQ.cols="0,*,0";
-    print("    切換編輯按鈕，驗證資料...")
+    events.info("    切換編輯按鈕，驗證資料...")
 
     # ── PRE-CYCLE: 切換前先確認 APPP/APPA 的實際值 ──
     pre_check = appy_frame.evaluate("""() => {
@@ -1047,9 +1064,9 @@ def verify_and_save(appy_frame: Frame, menu_page: Page, auto_save: bool = True):
         try { appa_inv= parent.APPA.FORM1.INVOICENO_1? parent.APPA.FORM1.INVOICENO_1.value: ''; } catch(e) {}
         return { appp: appp_v, appa: appa_v, inv: appa_inv };
     }""")
-    print(f"    [PRE-CYCLE]  APPP.PRODUCT_1 = {pre_check.get('appp', '')[:40]!r}")
-    print(f"    [PRE-CYCLE]  APPA.VENNAME_1 = {pre_check.get('appa', '')!r}")
-    print(f"    [PRE-CYCLE]  APPA.INVOICENO_1 = {pre_check.get('inv', '')!r}")
+    events.debug(f"    [PRE-CYCLE]  APPP.PRODUCT_1 = {pre_check.get('appp', '')[:40]!r}")
+    events.debug(f"    [PRE-CYCLE]  APPA.VENNAME_1 = {pre_check.get('appa', '')!r}")
+    events.debug(f"    [PRE-CYCLE]  APPA.INVOICENO_1 = {pre_check.get('inv', '')!r}")
 
     button_cycle = [
         ("編輯品名",   'parent.DD.rows="160,*"; parent.QQ.cols="*,0,0";'),
@@ -1064,7 +1081,7 @@ def verify_and_save(appy_frame: Frame, menu_page: Page, auto_save: bool = True):
     for i, (label, js_code) in enumerate(button_cycle, 1):
         appy_frame.evaluate(f"() => {{ {js_code} }}")
         menu_page.wait_for_timeout(500)
-        print(f"      ({i}/{len(button_cycle)}) {label}")
+        events.debug(f"      ({i}/{len(button_cycle)}) {label}")
 
     # 驗證資料仍然存在
     data_check = appy_frame.evaluate("""() => {
@@ -1088,9 +1105,9 @@ def verify_and_save(appy_frame: Frame, menu_page: Page, auto_save: bool = True):
     appy_ok = data_check.get("appy", False)
     appp_ok = data_check.get("appp", False)
     appa_ok = data_check.get("appa", False)
-    print(f"    切換後驗證: APPY={'V' if appy_ok else 'X'} "
-          f"APPP={'V' if appp_ok else 'X'} APPA={'V' if appa_ok else 'X'} "
-          f"(金額={data_check.get('amount', '')})")
+    events.debug(f"    切換後驗證: APPY={'V' if appy_ok else 'X'} "
+                 f"APPP={'V' if appp_ok else 'X'} APPA={'V' if appa_ok else 'X'} "
+                 f"(金額={data_check.get('amount', '')})")
 
     # ── POST-CYCLE: 印出 APPP/APPA 實際值（幫助診斷）──
     post_check = appy_frame.evaluate("""() => {
@@ -1100,12 +1117,12 @@ def verify_and_save(appy_frame: Frame, menu_page: Page, auto_save: bool = True):
         try { appa_inv= parent.APPA.FORM1.INVOICENO_1? parent.APPA.FORM1.INVOICENO_1.value: ''; } catch(e) {}
         return { appp: appp_v, appa: appa_v, inv: appa_inv };
     }""")
-    print(f"    [POST-CYCLE] APPP.PRODUCT_1  = {post_check.get('appp', '')[:40]!r}")
-    print(f"    [POST-CYCLE] APPA.VENNAME_1  = {post_check.get('appa', '')!r}")
-    print(f"    [POST-CYCLE] APPA.INVOICENO_1 = {post_check.get('inv', '')!r}")
+    events.debug(f"    [POST-CYCLE] APPP.PRODUCT_1  = {post_check.get('appp', '')[:40]!r}")
+    events.debug(f"    [POST-CYCLE] APPA.VENNAME_1  = {post_check.get('appa', '')!r}")
+    events.debug(f"    [POST-CYCLE] APPA.INVOICENO_1 = {post_check.get('inv', '')!r}")
 
     if not appy_ok:
-        print("    [FAIL] APPY 經費資料遺失！跳過存入。")
+        events.error("    [FAIL] APPY 經費資料遺失！跳過存入。")
         return False
 
     # ── Step 1: 更新各區塊加總 ──
@@ -1160,19 +1177,19 @@ def verify_and_save(appy_frame: Frame, menu_page: Page, auto_save: bool = True):
     items_amt = sums.get("items", 0)
     payee_amt = sums.get("payee", 0)
 
-    print(f"    經費加總: {sums.get('budget_raw', '')} ({budget_amt})")
-    print(f"    品名加總: {sums.get('items_raw', '')} ({items_amt})")
-    print(f"    受款人加總: {sums.get('payee_raw', '')} ({payee_amt})")
+    events.debug(f"    經費加總: {sums.get('budget_raw', '')} ({budget_amt})")
+    events.debug(f"    品名加總: {sums.get('items_raw', '')} ({items_amt})")
+    events.debug(f"    受款人加總: {sums.get('payee_raw', '')} ({payee_amt})")
 
     # ── Step 3: 驗證一致，自動調整小差額 ──
     if budget_amt == items_amt == payee_amt and budget_amt > 0:
-        print(f"    V 三個金額一致 ({budget_amt})，執行存入...")
+        events.info(f"    V 三個金額一致 ({budget_amt})，執行存入...", amount=budget_amt)
     elif budget_amt > 0 and budget_amt == items_amt and payee_amt > 0:
         diff = budget_amt - payee_amt
         if abs(diff) <= 5:
             # 小差額（通常因稅額四捨五入），自動調整 APPA 第 1 行金額
-            print(f"    ~ 經費和品名一致 ({budget_amt})，受款人加總={payee_amt}，差額={diff}")
-            print(f"    自動調整 APPA 行1 金額以消除差額...")
+            events.info(f"    ~ 經費和品名一致 ({budget_amt})，受款人加總={payee_amt}，差額={diff}")
+            events.info(f"    自動調整 APPA 行1 金額以消除差額...")
 
             # Step 3a: 修改 APPA Row 1 的 AMOUNT_1
             adj_result = appy_frame.evaluate(f"""() => {{
@@ -1188,9 +1205,9 @@ def verify_and_save(appy_frame: Frame, menu_page: Page, auto_save: bool = True):
                 }}
             }}""")
             if adj_result.get("ok"):
-                print(f"      AMOUNT_1: {adj_result['old_val']} -> {adj_result['new_val']}")
+                events.debug(f"      AMOUNT_1: {adj_result['old_val']} -> {adj_result['new_val']}")
             else:
-                print(f"      [WARN] 無法調整 AMOUNT_1: {adj_result.get('reason', '?')}")
+                events.warn(f"      [WARN] 無法調整 AMOUNT_1: {adj_result.get('reason', '?')}")
 
             # Step 3b: 重新計算 APPA 加總
             appy_frame.evaluate("""() => {
@@ -1220,10 +1237,10 @@ def verify_and_save(appy_frame: Frame, menu_page: Page, auto_save: bool = True):
                 return parseInt((el.value || '').replace(/[^0-9]/g, '')) || 0;
             }""")
             if new_payee == budget_amt:
-                print(f"    V 調整成功！三個金額現在一致 ({budget_amt})")
+                events.info(f"    V 調整成功！三個金額現在一致 ({budget_amt})")
             else:
                 # 嘗試備用方式：直接設定 SUM_APPA 和 SUM_LIST
-                print(f"    [WARN] SUM_SUM 後受款人={new_payee}，嘗試直接設定加總值...")
+                events.warn(f"    [WARN] SUM_SUM 後受款人={new_payee}，嘗試直接設定加總值...")
                 appy_frame.evaluate(f"""() => {{
                     try {{
                         // 直接把 APPA 的 SUM_LIST 設為正確值
@@ -1240,16 +1257,17 @@ def verify_and_save(appy_frame: Frame, menu_page: Page, auto_save: bool = True):
                     return parseInt((el.value || '').replace(/[^0-9]/g, '')) || 0;
                 }""")
                 if final_payee == budget_amt:
-                    print(f"    V 備用方式成功！三個金額現在一致 ({budget_amt})")
+                    events.info(f"    V 備用方式成功！三個金額現在一致 ({budget_amt})")
                 else:
-                    print(f"    [WARN] 調整後受款人加總={final_payee}，仍不一致，嘗試繼續存入...")
+                    events.warn(f"    [WARN] 調整後受款人加總={final_payee}，仍不一致，嘗試繼續存入...")
         else:
-            print(f"    X 差額過大 ({diff})！經費={budget_amt}, 受款人={payee_amt}")
-            print("    跳過存入，請手動確認。")
+            events.error(f"    X 差額過大 ({diff})！經費={budget_amt}, 受款人={payee_amt}")
+            events.error("    跳過存入，請手動確認。")
             return False
     else:
-        print(f"    X 金額不一致！經費={budget_amt}, 品名={items_amt}, 受款人={payee_amt}")
-        print("    跳過存入，請手動確認。")
+        events.error(f"    X 金額不一致！經費={budget_amt}, 品名={items_amt}, 受款人={payee_amt}",
+                     budget=budget_amt, items=items_amt, payee=payee_amt)
+        events.error("    跳過存入，請手動確認。")
         return False
 
     # ── Step 4: 設定 dialog handler ──
@@ -1267,7 +1285,7 @@ def verify_and_save(appy_frame: Frame, menu_page: Page, auto_save: bool = True):
             msg = dialog.message
             dtype = dialog.type
             dialog_messages.append({"type": dtype, "message": msg})
-            print(f"    [DIALOG {dtype}] {msg}")
+            events.info(f"    [DIALOG {dtype}] {msg}")
 
             if dtype == "confirm" and "受款人尚未編輯" in msg:
                 # dismiss = 選「否」= 不需編輯受款人，繼續存入
@@ -1277,11 +1295,11 @@ def verify_and_save(appy_frame: Frame, menu_page: Page, auto_save: bool = True):
             elif dtype == "confirm" and ("成功" in msg and "印表" in msg):
                 # 「存入請購單號:AXXXXXXXXXX-成功,直接印表嗎?」
                 # accept = 確定 → 產生 PDF 核銷文件
-                print("    [DIALOG] 存入成功 → 確定（產生PDF）")
+                events.info("    [DIALOG] 存入成功 → 確定（產生PDF）")
                 dialog.accept()
             elif dtype == "confirm" and "直接核銷" in msg:
                 # 「直接核銷」確認 → 也按確定產生 PDF
-                print("    [DIALOG] 直接核銷確認 → 確定（產生PDF）")
+                events.info("    [DIALOG] 直接核銷確認 → 確定（產生PDF）")
                 dialog.accept()
             else:
                 dialog.accept()
@@ -1308,7 +1326,7 @@ def verify_and_save(appy_frame: Frame, menu_page: Page, auto_save: bool = True):
         """攔截 PDF 新視窗：儲存截圖/PDF → 關閉頁面"""
         try:
             pdf_url = new_page.url or ""
-            print(f"    [PDF] 偵測到新頁面: {pdf_url[:80]}")
+            events.debug(f"    [PDF] 偵測到新頁面: {pdf_url[:80]}")
             # 等待頁面載入
             try:
                 new_page.wait_for_load_state("networkidle", timeout=15000)
@@ -1328,21 +1346,21 @@ def verify_and_save(appy_frame: Frame, menu_page: Page, auto_save: bool = True):
             ts = time.strftime('%Y%m%d_%H%M%S')
             try:
                 # page.pdf() 僅 headless 模式可用
-                pdf_path = f"{OUTPUT_DIR}/expense_report_{ts}.pdf"
+                pdf_path = str(artifacts.path(f"expense_report_{ts}.pdf"))
                 new_page.pdf(path=pdf_path)
                 pdf_saved_path[0] = pdf_path
-                print(f"    [PDF] 核銷文件已儲存: {pdf_path}")
+                events.info(f"    [PDF] 核銷文件已儲存: {pdf_path}")
             except Exception:
                 # headed 模式 → 改用截圖
-                ss_path = f"{OUTPUT_DIR}/expense_report_{ts}.png"
-                new_page.screenshot(path=ss_path, full_page=True)
+                ss_path = str(artifacts.screenshot(new_page, f"expense_report_{ts}",
+                                                   full_page=True))
                 pdf_saved_path[0] = ss_path
-                print(f"    [PDF] 核銷文件截圖已儲存: {ss_path}")
+                events.info(f"    [PDF] 核銷文件截圖已儲存: {ss_path}")
             # 關閉 PDF 頁面
             new_page.close()
-            print(f"    [PDF] 已關閉 PDF 頁面")
+            events.debug(f"    [PDF] 已關閉 PDF 頁面")
         except Exception as e:
-            print(f"    [PDF] 處理錯誤: {e}")
+            events.warn(f"    [PDF] 處理錯誤: {e}")
             try:
                 new_page.close()
             except Exception:
@@ -1359,9 +1377,9 @@ def verify_and_save(appy_frame: Frame, menu_page: Page, auto_save: bool = True):
         try { appa_inv= parent.APPA.FORM1.INVOICENO_1? parent.APPA.FORM1.INVOICENO_1.value: ''; } catch(e) {}
         return { appp: appp_v, appa: appa_v, inv: appa_inv };
     }""")
-    print(f"    [PRE-ALERT]  APPP.PRODUCT_1  = {final_check.get('appp', '')[:40]!r}")
-    print(f"    [PRE-ALERT]  APPA.VENNAME_1  = {final_check.get('appa', '')!r}")
-    print(f"    [PRE-ALERT]  APPA.INVOICENO_1 = {final_check.get('inv', '')!r}")
+    events.debug(f"    [PRE-ALERT]  APPP.PRODUCT_1  = {final_check.get('appp', '')[:40]!r}")
+    events.debug(f"    [PRE-ALERT]  APPA.VENNAME_1  = {final_check.get('appa', '')!r}")
+    events.debug(f"    [PRE-ALERT]  APPA.INVOICENO_1 = {final_check.get('inv', '')!r}")
 
     try:
         # 存入前：確保在「編輯經費」視圖（APPY 可見）
@@ -1374,9 +1392,9 @@ def verify_and_save(appy_frame: Frame, menu_page: Page, auto_save: bool = True):
         if auto_save:
             appy_frame.evaluate("SUM_ALERT();")
         else:
-            print("    [手動模式] 準備就緒，您可以切換視窗檢查或按下「存檔」。")
+            events.info("    [手動模式] 準備就緒，您可以切換視窗檢查或按下「存檔」。")
     except Exception as e:
-        print(f"    SUM_ALERT/準備 錯誤: {e}")
+        events.warn(f"    SUM_ALERT/準備 錯誤: {e}")
 
     # ── Step 7: 等待 submit 完成 + 處理所有 dialog ──
     # 等待足夠長的時間以處理：
@@ -1385,27 +1403,28 @@ def verify_and_save(appy_frame: Frame, menu_page: Page, auto_save: bool = True):
     #   - 任何後續 dialog（PDF、確認、錯誤等、直接核銷確認）
     #   - 成功時會收到「成功,直接印表嗎?」confirm → accept 後產生 PDF
     if auto_save:
-        print("    等待存入完成...")
+        events.info("    等待存入完成...")
         save_confirmed = False
-        for sec in range(45):
-            # 重要：用 Playwright 的 wait_for_timeout 而非 time.sleep
-            # time.sleep 會阻塞 Python 線程，導致 Playwright 無法即時處理 dialog 事件
-            # wait_for_timeout 在等待的同時仍會處理瀏覽器事件（dialog、popup 等）
-            menu_page.wait_for_timeout(1000)
-            # 檢查是否已收到成功 dialog → 可提早結束等待
-            for d in dialog_messages:
-                if "成功" in d["message"] and "印表" in d["message"]:
-                    save_confirmed = True
-            if save_confirmed:
-                # 成功確認後，給 PDF popup 多幾秒處理
-                print(f"    [OK] 已確認存入成功並觸發 PDF 列印 ({sec + 1}s)")
-                menu_page.wait_for_timeout(3000)  # 等待 PDF popup 處理
-                break
-            if (sec + 1) % 5 == 0:
-                print(f"    ... 已等待 {sec + 1} 秒 (dialog: {len(dialog_messages)} 個)")
+        with profiling.span("submit_wait"):
+            for sec in range(45):
+                # 重要：用 Playwright 的 wait_for_timeout 而非 time.sleep
+                # time.sleep 會阻塞 Python 線程，導致 Playwright 無法即時處理 dialog 事件
+                # wait_for_timeout 在等待的同時仍會處理瀏覽器事件（dialog、popup 等）
+                menu_page.wait_for_timeout(1000)
+                # 檢查是否已收到成功 dialog → 可提早結束等待
+                for d in dialog_messages:
+                    if "成功" in d["message"] and "印表" in d["message"]:
+                        save_confirmed = True
+                if save_confirmed:
+                    # 成功確認後，給 PDF popup 多幾秒處理
+                    events.info(f"    [OK] 已確認存入成功並觸發 PDF 列印 ({sec + 1}s)")
+                    menu_page.wait_for_timeout(3000)  # 等待 PDF popup 處理
+                    break
+                if (sec + 1) % 5 == 0:
+                    events.debug(f"    ... 已等待 {sec + 1} 秒 (dialog: {len(dialog_messages)} 個)")
     else:
         # 手動模式：移除 dialog handler 和 PDF popup handler，交由外層 process_batch 暫停
-        print("    [手動模式] 跳過自動等待與自動檢查。")
+        events.info("    [手動模式] 跳過自動等待與自動檢查。")
         try:
             menu_page.remove_listener("dialog", _handle_dialog)
         except Exception:
@@ -1430,8 +1449,8 @@ def verify_and_save(appy_frame: Frame, menu_page: Page, auto_save: bool = True):
                         "document.body ? document.body.innerText.substring(0, 500) : ''"
                     )
                     if ps_body and ps_body.strip():
-                        print(f"    [PS回應] frame={fname!r} url={furl[:60]}")
-                        print(f"    [PS回應] body: {ps_body[:300]}")
+                        events.debug(f"    [PS回應] frame={fname!r} url={furl[:60]}")
+                        events.debug(f"    [PS回應] body: {ps_body[:300]}")
                 except Exception:
                     pass
     except Exception:
@@ -1454,7 +1473,7 @@ def verify_and_save(appy_frame: Frame, menu_page: Page, auto_save: bool = True):
     for d in dialog_messages:
         if "不得為0" in d["message"] or "不相符合" in d["message"]:
             has_error = True
-            print(f"    存入失敗: {d['message']}")
+            events.error(f"    存入失敗: {d['message']}")
         if "成功" in d["message"] and "印表" in d["message"]:
             save_success_confirmed = True
             # 嘗試提取請購單號（格式: 存入請購單號:AXXXXXXXXXX-成功）
@@ -1464,18 +1483,21 @@ def verify_and_save(appy_frame: Frame, menu_page: Page, auto_save: bool = True):
                 record_no_from_dialog = m.group(1)
 
     if has_error:
-        print("  [FAIL] 存入失敗，請手動確認")
+        events.error("  [FAIL] 存入失敗，請手動確認", action="save", outcome="failed")
         return False
 
+    outcome.update(confirmed=save_success_confirmed, record_no=record_no_from_dialog)
     if save_success_confirmed:
-        print(f"  存入成功！請購單號: {record_no_from_dialog or '(已確認)'}  已觸發 PDF 列印")
+        events.info(f"  存入成功！請購單號: {record_no_from_dialog or '(已確認)'}  已觸發 PDF 列印",
+                    action="save", outcome="ok", record_no=record_no_from_dialog)
         if pdf_saved_path[0]:
-            print(f"  PDF 文件: {pdf_saved_path[0]}")
+            events.info(f"  PDF 文件: {pdf_saved_path[0]}")
     else:
-        print(f"  存入完成！（dialog: {len(dialog_messages)} 個）")
+        events.info(f"  存入完成！（dialog: {len(dialog_messages)} 個）")
     return True
 
 
+@profiling.timed("verify_record")
 def verify_saved_record(menu_page: Page, expected_amount: int = 0,
                         use_project: bool = False):
     """
@@ -1497,7 +1519,7 @@ def verify_saved_record(menu_page: Page, expected_amount: int = 0,
     Returns:
         dict: 驗證結果 {ok: bool, record_no: str, appy: {}, appp: {}, appa: {}}
     """
-    print("  驗證存入結果...")
+    events.info("  驗證存入結果...")
 
     # ── Step 0: PDF 產生後頁面可能已導航，先等待穩定 ──
     time.sleep(2)
@@ -1507,17 +1529,17 @@ def verify_saved_record(menu_page: Page, expected_amount: int = 0,
     title_frame = menu_page.frame("TITLE")
     if not title_frame:
         # PDF 產生後可能導致 frame 結構改變，嘗試等待重新取得
-        print("    [INFO] TITLE frame 不存在，等待 3 秒後重試...")
+        events.info("    [INFO] TITLE frame 不存在，等待 3 秒後重試...")
         time.sleep(3)
         title_frame = menu_page.frame("TITLE")
     if not title_frame:
-        print("    [WARN] 找不到 TITLE frame（可能因 PDF 產生導致頁面導航）")
-        print("    [INFO] 存入已由 dialog 確認成功，跳過清單驗證")
+        events.warn("    [WARN] 找不到 TITLE frame（可能因 PDF 產生導致頁面導航）")
+        events.info("    [INFO] 存入已由 dialog 確認成功，跳過清單驗證")
         return {"ok": True, "record_no": "N/A",
                 "note": "驗證跳過（TITLE frame 不存在），存入已由 dialog 確認"}
 
     lis_mode = "計畫請購(LIS4)" if use_project else "部門請購(LIS2)"
-    print(f"    回到 {lis_mode} 查詢列表...")
+    events.info(f"    回到 {lis_mode} 查詢列表...")
     try:
         if use_project:
             title_frame.evaluate("""() => {
@@ -1540,7 +1562,7 @@ def verify_saved_record(menu_page: Page, expected_amount: int = 0,
                 }
             }""")
     except Exception as e:
-        print(f"    {lis_mode} 失敗: {e}")
+        events.warn(f"    {lis_mode} 失敗: {e}")
         return {"ok": False, "error": str(e)}
 
     time.sleep(3)
@@ -1548,13 +1570,13 @@ def verify_saved_record(menu_page: Page, expected_amount: int = 0,
     # 重新取得 TITLE frame（可能已經 reload）
     title_frame = menu_page.frame("TITLE")
     if not title_frame:
-        print("    [FAIL] TITLE frame 消失")
+        events.error("    [FAIL] TITLE frame 消失")
         return {"ok": False, "error": "TITLE frame lost"}
     try:
         title_frame.wait_for_load_state("networkidle", timeout=15000)
     except Exception as e:
-        print(f"    [WARN] TITLE frame 載入等待逾時: {e}")
-        print(f"    [INFO] 繼續嘗試...")
+        events.warn(f"    [WARN] TITLE frame 載入等待逾時: {e}")
+        events.info(f"    [INFO] 繼續嘗試...")
     time.sleep(1)
 
     # ── Step 2: 點擊「購案管理」(aBT1) ──
@@ -1566,7 +1588,7 @@ def verify_saved_record(menu_page: Page, expected_amount: int = 0,
     except Exception as e:
         if "Execution context was destroyed" in str(e):
             # 存入後系統自動導航，frame context 被重置 → 等待後重試
-            print(f"    [INFO] frame 導航中，等待 4 秒後重試...")
+            events.info(f"    [INFO] frame 導航中，等待 4 秒後重試...")
             time.sleep(4)
             try:
                 title_frame = menu_page.frame("TITLE")
@@ -1577,16 +1599,14 @@ def verify_saved_record(menu_page: Page, expected_amount: int = 0,
                         if (btn) btn.click();
                     }""")
             except Exception as e2:
-                print(f"    [WARN] 購案管理重試失敗: {e2}")
-                print(f"    [INFO] 存入已由 dialog 確認，跳過清單驗證")
-                menu_page.screenshot(
-                    path=f"{OUTPUT_DIR}/verify_skipped.png", full_page=True
-                )
-                print(f"    截圖: {OUTPUT_DIR}/verify_skipped.png")
+                events.warn(f"    [WARN] 購案管理重試失敗: {e2}")
+                events.info(f"    [INFO] 存入已由 dialog 確認，跳過清單驗證")
+                shot = artifacts.screenshot(menu_page, "verify_skipped", full_page=True)
+                events.info(f"    截圖: {shot}")
                 return {"ok": True, "record_no": "N/A",
                         "note": "驗證被跳過（frame 導航），存入已由 dialog 確認"}
         else:
-            print(f"    購案管理按鈕失敗: {e}")
+            events.warn(f"    購案管理按鈕失敗: {e}")
             return {"ok": False, "error": str(e)}
 
     time.sleep(3)
@@ -1603,16 +1623,16 @@ def verify_saved_record(menu_page: Page, expected_amount: int = 0,
         main_frame = menu_page.frame("MAIN")
 
     if not main_frame:
-        print("    [WARN] 找不到 MAIN frame（PDF 產生後頁面可能已導航）")
-        print("    [INFO] 存入已由 dialog 確認成功，跳過清單驗證")
+        events.warn("    [WARN] 找不到 MAIN frame（PDF 產生後頁面可能已導航）")
+        events.info("    [INFO] 存入已由 dialog 確認成功，跳過清單驗證")
         return {"ok": True, "record_no": "N/A",
                 "note": "驗證跳過（MAIN frame 不存在），存入已由 dialog 確認"}
 
     try:
         main_frame.wait_for_load_state("networkidle", timeout=15000)
     except Exception as e:
-        print(f"    [WARN] MAIN frame 載入等待逾時: {e}")
-        print(f"    [INFO] 繼續嘗試...")
+        events.warn(f"    [WARN] MAIN frame 載入等待逾時: {e}")
+        events.info(f"    [INFO] 繼續嘗試...")
     time.sleep(1)
 
     # 選擇「直接核銷(零用金)」下拉
@@ -1631,9 +1651,9 @@ def verify_saved_record(menu_page: Page, expected_amount: int = 0,
     }""")
 
     if select_result.get("found"):
-        print(f"    篩選: {select_result.get('text', '')}")
+        events.info(f"    篩選: {select_result.get('text', '')}")
     else:
-        print("    警告: 找不到「直接核銷」選項")
+        events.warn("    警告: 找不到「直接核銷」選項")
 
     time.sleep(1)
 
@@ -1655,7 +1675,7 @@ def verify_saved_record(menu_page: Page, expected_amount: int = 0,
         try:
             main_frame.wait_for_load_state("networkidle", timeout=15000)
         except Exception as e:
-            print(f"    [WARN] MAIN frame 重載等待逾時: {e}")
+            events.warn(f"    [WARN] MAIN frame 重載等待逾時: {e}")
     time.sleep(1)
 
     # ── Step 4: 找到最新記錄 ──
@@ -1693,15 +1713,15 @@ def verify_saved_record(menu_page: Page, expected_amount: int = 0,
     }""")
 
     if not records:
-        print("    [WARN] 找不到請購單記錄")
+        events.warn("    [WARN] 找不到請購單記錄")
         # 截圖
-        menu_page.screenshot(path=f"{OUTPUT_DIR}/verify_no_records.png", full_page=True)
+        artifacts.screenshot(menu_page, "verify_no_records", full_page=True)
         return {"ok": False, "error": "no records found"}
 
     # 取最新的（通常是第一筆）
     latest = records[0]
-    print(f"    最新記錄: {latest.get('recordNo', '')} 金額={latest.get('amount', 0)}")
-    print(f"    記錄內容: {latest.get('text', '')[:80]}")
+    events.debug(f"    最新記錄: {latest.get('recordNo', '')} 金額={latest.get('amount', 0)}")
+    events.debug(f"    記錄內容: {latest.get('text', '')[:80]}")
 
     # ── Step 5: 點擊進入修改/檢視 ──
     # 嘗試點擊記錄的 radio button 然後點「修改」按鈕
@@ -1733,7 +1753,7 @@ def verify_saved_record(menu_page: Page, expected_amount: int = 0,
         }""")
         time.sleep(8)  # 等待表單與所有子 frame 載入
     else:
-        print("    [WARN] 無法點擊記錄")
+        events.warn("    [WARN] 無法點擊記錄")
 
     # ── Step 6: 檢查 APPY / APPP / APPA 內容 ──
     # 重新尋找 frames（最多重試 5 次，每次等 2 秒）
@@ -1757,10 +1777,10 @@ def verify_saved_record(menu_page: Page, expected_amount: int = 0,
 
         if attempt == 0:
             # 第一次找不到時印出所有 frame URL 供診斷
-            print(f"    [DEBUG] 找不到全部 frames，目前所有 frames ({len(menu_page.frames)}):")
+            events.debug(f"    [DEBUG] 找不到全部 frames，目前所有 frames ({len(menu_page.frames)}):")
             for f in menu_page.frames:
                 if f.url and f.url != "about:blank":
-                    print(f"      [{f.name or '-'}] {f.url[:100]}")
+                    events.debug(f"      [{f.name or '-'}] {f.url[:100]}")
 
         if "appy" in frames_check and "appp" not in frames_check:
             # 嘗試點擊「編輯品名」讓 APPP frame 可見並載入
@@ -1785,8 +1805,8 @@ def verify_saved_record(menu_page: Page, expected_amount: int = 0,
 
     frames_found = bool(frames_check)
     if not frames_found:
-        print("    [INFO] 無法開啟詳細編輯 frames（學校系統導航方式不同）")
-        print("    [INFO] 改以清單金額作為主要驗證依據，詳情請查看截圖")
+        events.info("    [INFO] 無法開啟詳細編輯 frames（學校系統導航方式不同）")
+        events.info("    [INFO] 改以清單金額作為主要驗證依據，詳情請查看截圖")
 
     # ── 嘗試從查詢頁（DA_SerSTART_Q.asp）讀取記錄詳情 ──
     # 系統點修改後載入 DA_SerSTART_Q.asp，以 table 形式顯示全部資料
@@ -1799,8 +1819,8 @@ def verify_saved_record(menu_page: Page, expected_amount: int = 0,
                     "document.body ? document.body.innerText.substring(0, 3000) : ''"
                 )
                 if body_text and body_text.strip():
-                    print(f"    [查詢頁] url={furl[:80]}")
-                    print(f"    [查詢頁] 內容（前500字）: {body_text[:500]}")
+                    events.debug(f"    [查詢頁] url={furl[:80]}")
+                    events.debug(f"    [查詢頁] 內容（前500字）: {body_text[:500]}")
                 break
             # 也嘗試 MAIN frame（可能是 DA_APY_Q 或 DA_Ser* 之類）
             if "DA_APY" in furl_up or "APPQ" in furl_up:
@@ -1817,12 +1837,12 @@ def verify_saved_record(menu_page: Page, expected_amount: int = 0,
     list_amount = latest.get("amount", 0)
     if expected_amount > 0:
         if list_amount == expected_amount:
-            print(f"    [主要驗證] 清單金額 {list_amount} == 預期金額 {expected_amount} V")
+            events.info(f"    [主要驗證] 清單金額 {list_amount} == 預期金額 {expected_amount} V")
         else:
-            print(f"    [主要驗證] 清單金額 {list_amount} != 預期金額 {expected_amount} X")
+            events.info(f"    [主要驗證] 清單金額 {list_amount} != 預期金額 {expected_amount} X")
             result["ok"] = False
     else:
-        print(f"    [主要驗證] 清單金額: {list_amount}（未指定預期金額，略過比對）")
+        events.info(f"    [主要驗證] 清單金額: {list_amount}（未指定預期金額，略過比對）")
 
     # ── 次要驗證：APPY frame 內容（best-effort，找不到不算失敗）──
     if "appy" in frames_check:
@@ -1833,11 +1853,11 @@ def verify_saved_record(menu_page: Page, expected_amount: int = 0,
         })""")
         result["appy"] = appy_data
         appy_ok = bool(appy_data.get("bugetno") and appy_data.get("amount"))
-        print(f"    APPY: bugetno={appy_data.get('bugetno','')}, "
-              f"amount={appy_data.get('amount','')} "
-              f"{'V' if appy_ok else 'X'}")
+        events.info(f"    APPY: bugetno={appy_data.get('bugetno','')}, "
+                    f"amount={appy_data.get('amount','')} "
+                    f"{'V' if appy_ok else 'X'}")
     else:
-        print("    [INFO] 未找到 APPY frame，略過詳細驗證（不影響結果判定）")
+        events.info("    [INFO] 未找到 APPY frame，略過詳細驗證（不影響結果判定）")
         result["appy"] = {}
 
     # ── 次要驗證：APPP frame 內容（best-effort，找不到不算失敗）──
@@ -1862,15 +1882,15 @@ def verify_saved_record(menu_page: Page, expected_amount: int = 0,
         }""")
         result["appp"] = appp_data
         appp_ok = len(appp_data.get("items", [])) > 0
-        print(f"    APPP: {len(appp_data.get('items', []))} 項品名 "
-              f"{'V' if appp_ok else 'X -- 品名遺失！'}")
+        events.info(f"    APPP: {len(appp_data.get('items', []))} 項品名 "
+                    f"{'V' if appp_ok else 'X -- 品名遺失！'}")
         if appp_ok:
             for item in appp_data["items"]:
-                print(f"      品項{item['row']}: {item['product']} = ${item['amount']}")
+                events.debug(f"      品項{item['row']}: {item['product']} = ${item['amount']}")
         if not appp_ok:
             result["ok"] = False  # Frame 找到但品名是空的 → 資料真的遺失
     else:
-        print("    [INFO] 未找到 APPP frame，略過詳細驗證（不影響結果判定）")
+        events.info("    [INFO] 未找到 APPP frame，略過詳細驗證（不影響結果判定）")
         result["appp"] = {}
 
     # ── 次要驗證：APPA frame 內容（best-effort，找不到不算失敗）──
@@ -1885,39 +1905,39 @@ def verify_saved_record(menu_page: Page, expected_amount: int = 0,
         result["appa"] = appa_data
         appa_ok = bool(appa_data.get("venname") and appa_data.get("amount")
                        and appa_data.get("amount") != "0")
-        print(f"    APPA: venname={appa_data.get('venname','')}, "
-              f"amount={appa_data.get('amount','')}, "
-              f"bankno={appa_data.get('bankno','')} "
-              f"{'V' if appa_ok else 'X -- 受款人遺失！'}")
+        events.info(f"    APPA: venname={appa_data.get('venname','')}, "
+                    f"amount={appa_data.get('amount','')}, "
+                    f"bankno={appa_data.get('bankno','')} "
+                    f"{'V' if appa_ok else 'X -- 受款人遺失！'}")
         if not appa_ok:
             result["ok"] = False  # Frame 找到但受款人是空的 → 資料真的遺失
     else:
-        print("    [INFO] 未找到 APPA frame，略過詳細驗證（不影響結果判定）")
+        events.info("    [INFO] 未找到 APPA frame，略過詳細驗證（不影響結果判定）")
         result["appa"] = {}
 
     # 截圖
-    menu_page.screenshot(
-        path=f"{OUTPUT_DIR}/verify_{result['record_no']}.png", full_page=True
-    )
-    print(f"    截圖: {OUTPUT_DIR}/verify_{result['record_no']}.png")
+    shot = artifacts.screenshot(menu_page, f"verify_{result['record_no']}", full_page=True)
+    events.info(f"    截圖: {shot}")
 
     if result["ok"]:
         if frames_found:
-            print(f"  [OK] 記錄 {result['record_no']} 驗證通過！金額與 frame 內容均正確。")
+            events.info(f"  [OK] 記錄 {result['record_no']} 驗證通過！金額與 frame 內容均正確。")
         else:
-            print(f"  [OK] 記錄 {result['record_no']} 驗證通過！清單金額 {list_amount} 正確。")
-            print(f"       （詳細 frames 無法開啟，建議查看截圖確認品名與受款人）")
+            events.info(f"  [OK] 記錄 {result['record_no']} 驗證通過！清單金額 {list_amount} 正確。")
+            events.info(f"       （詳細 frames 無法開啟，建議查看截圖確認品名與受款人）")
     else:
-        print(f"  [FAIL] 記錄 {result['record_no']} 驗證失敗！請查看截圖確認問題。")
+        events.error(f"  [FAIL] 記錄 {result['record_no']} 驗證失敗！請查看截圖確認問題。")
 
     return result
 
 
+@profiling.timed("form")
 def fill_expense_form(frames: dict, receipt_data: dict,
                       menu_page: Page = None, context=None,
                       plan_name: str = "", receipt_seq: int = 1,
                       auto_save: bool = True,
-                      use_project: bool = False):
+                      use_project: bool = False,
+                      receipt_seqs: dict = None):
     """
     將 OCR 辨識結果填入核銷表單。
 
@@ -1934,6 +1954,12 @@ def fill_expense_form(frames: dict, receipt_data: dict,
                 "subject_code": "110704-8012"  # 選填，會計科目
             }
         menu_page: 主選單 Page（用於 APPY frame 跨 frame 操作）
+        receipt_seqs: {收據日期: 第一個流水號}，見 fill_appa_frame
+
+    Returns:
+        dict: {"saved": True/False（自動存入結果，手動模式為 None）,
+               "confirmed": 存入成功 dialog 是否出現（未出現時 saved 仍可能為 True）,
+               "record_no": 請購單號（取得時）}
     """
     appp_frame = frames.get("appp")
     appy_frame = frames.get("appy")
@@ -1941,7 +1967,7 @@ def fill_expense_form(frames: dict, receipt_data: dict,
     if not appp_frame:
         raise RuntimeError("找不到 APPP frame（品項明細）")
 
-    print("  填寫核銷表單...")
+    events.info("  填寫核銷表單...")
 
     # ── 1. 先填寫 APPY frame（計畫/經費/科目/金額）──取得計畫資訊
     plan_full_name = ""
@@ -1958,7 +1984,7 @@ def fill_expense_form(frames: dict, receipt_data: dict,
             appy_frame, menu_page, total_amount, subject_code,
             plan_name=plan_name)
     elif not appy_frame:
-        print("  警告: 找不到 APPY frame，跳過計畫/經費填寫")
+        events.warn("  警告: 找不到 APPY frame，跳過計畫/經費填寫")
 
     # ── 2. 生成用途說明（使用實際計畫名稱 + 代碼）──────
     # 格式: {計畫名稱}({計畫代碼})-{品項摘要}
@@ -2009,9 +2035,9 @@ def fill_expense_form(frames: dict, receipt_data: dict,
         return null;
     }}""")
     if filled_ok:
-        print(f"    用途說明: {content_text}  (via {filled_ok})")
+        events.info(f"    用途說明: {content_text}  (via {filled_ok})")
     else:
-        print(f"    [WARN] 用途說明欄位未找到 (name={content_field})，嘗試其他 frame..."  )
+        events.warn(f"    [WARN] 用途說明欄位未找到 (name={content_field})，嘗試其他 frame..."  )
         # Fallback: 在所有 frame 中搜尋 CONTENT 欄位
         for f in menu_page.frames:
             try:
@@ -2027,12 +2053,12 @@ def fill_expense_form(frames: dict, receipt_data: dict,
                     return null;
                 }}""")
                 if fallback_ok:
-                    print(f"    用途說明: {content_text}  (via {fallback_ok} in frame: {f.name or f.url})")
+                    events.info(f"    用途說明: {content_text}  (via {fallback_ok} in frame: {f.name or f.url})")
                     break
             except Exception:
                 continue
         else:
-            print(f"    [WARN] 所有 frame 都找不到用途說明欄位 (name={content_field})")
+            events.warn(f"    [WARN] 所有 frame 都找不到用途說明欄位 (name={content_field})")
 
     # ── 3. 填寫憑證日期 ─────────────────────────
     date_str = receipt_data.get("date", "")
@@ -2053,7 +2079,7 @@ def fill_expense_form(frames: dict, receipt_data: dict,
             }});
         }}""")
         time.sleep(0.5)
-        print(f"    憑證日期: 民國{roc_y}/{roc_m}/{roc_d}")
+        events.info(f"    憑證日期: 民國{roc_y}/{roc_m}/{roc_d}")
 
     # ── 4. 填寫品項明細 ──────────────────────────
     # 稅額處理已在 main.py 的 merge_receipts → _process_receipt_tax 完成
@@ -2101,8 +2127,8 @@ def fill_expense_form(frames: dict, receipt_data: dict,
             parsed_items[-1]["total"] += diff
     elif diff < 0 and abs(diff) > 1:
         # 品項合計 > 總金額（OCR 有誤），但仍保留個別品項（不壓縮）
-        print(f"    [WARN] OCR 明細加總 ({current_sum}) > 總金額 ({total_amount})，差額 {diff}")
-        print(f"    [INFO] 保留個別品項，金額以品項合計為準")
+        events.warn(f"    [WARN] OCR 明細加總 ({current_sum}) > 總金額 ({total_amount})，差額 {diff}")
+        events.info(f"    [INFO] 保留個別品項，金額以品項合計為準")
     elif not parsed_items and total_amount > 0:
         parsed_items = [{
             "name": "核銷明細",
@@ -2111,14 +2137,14 @@ def fill_expense_form(frames: dict, receipt_data: dict,
             "total": total_amount
         }]
 
-    print(f"    品項數: {len(parsed_items)}, 品項合計: {current_sum}, 收據總金額: {total_amount}")
+    events.info(f"    品項數: {len(parsed_items)}, 品項合計: {current_sum}, 收據總金額: {total_amount}")
 
     for i, item_data in enumerate(parsed_items, start=1):
         # 先過濾 Big5 不支援字元（如 Ω），避免 POST 時亂碼導致伺服器解析失敗
         raw_name = _sanitize_big5(item_data["name"])
         raw_spec = _sanitize_big5(item_data["spec"])
         if raw_name != item_data["name"]:
-            print(f"    [sanitize] 品名: '{item_data['name']}' → '{raw_name}'")
+            events.debug(f"    [sanitize] 品名: '{item_data['name']}' → '{raw_name}'")
         item_name = _js_escape(raw_name)
         item_spec = _js_escape(raw_spec)
         item_qty = item_data["qty"]
@@ -2140,7 +2166,7 @@ def fill_expense_form(frames: dict, receipt_data: dict,
             setVal('AMOUNT_{i}',   '{item_price}');    // 總價
             if (typeof SUM_SUM === 'function') SUM_SUM();
         }}""")
-        print(f"    品項{i}: {item_data['name']} x{item_qty} 總價: {item_price}")
+        events.debug(f"    品項{i}: {item_data['name']} x{item_qty} 總價: {item_price}")
 
     # 確認 APPP 填寫後的實際值
     if parsed_items:
@@ -2148,17 +2174,17 @@ def fill_expense_form(frames: dict, receipt_data: dict,
             const el = document.querySelector('input[name="PRODUCT_1"]');
             return el ? el.value : '(not found)';
         }""")
-        print(f"    [確認 APPP] PRODUCT_1 = {appp_conf!r}")
+        events.debug(f"    [確認 APPP] PRODUCT_1 = {appp_conf!r}")
 
     # ── 5. 填寫 APPA frame（受款人）──────────────────
     appa_frame = frames.get("appa")
     if appa_frame and menu_page and context:
         fill_appa_frame(appa_frame, menu_page, context,
-                        receipt_data, receipt_seq)
+                        receipt_data, receipt_seq, receipt_seqs)
     elif not appa_frame:
-        print("  警告: 找不到 APPA frame，跳過受款人填寫")
+        events.warn("  警告: 找不到 APPA frame，跳過受款人填寫")
     elif not context:
-        print("  警告: 未提供 BrowserContext，跳過受款人填寫")
+        events.warn("  警告: 未提供 BrowserContext，跳過受款人填寫")
 
     # 確認 APPA 填寫後的實際值
     if appa_frame:
@@ -2167,16 +2193,22 @@ def fill_expense_form(frames: dict, receipt_data: dict,
             invoiceno: FORM1.INVOICENO_1 ? FORM1.INVOICENO_1.value : '',
             amount:    FORM1.AMOUNT_1    ? FORM1.AMOUNT_1.value    : '',
         })""")
-        print(f"    [確認 APPA] row1: venname={appa_conf.get('venname')!r} "
-              f"invoice={appa_conf.get('invoiceno')!r} "
-              f"amount={appa_conf.get('amount')!r}")
+        events.debug(f"    [確認 APPA] row1: venname={appa_conf.get('venname')!r} "
+                     f"invoice={appa_conf.get('invoiceno')!r} "
+                     f"amount={appa_conf.get('amount')!r}")
 
     # ── 6. 驗證三金額一致 → 自動/手動存入 ────────────────
+    result = {"saved": None, "confirmed": False, "record_no": ""}
     if appy_frame and menu_page:
-        saved = verify_and_save(appy_frame, menu_page, auto_save=auto_save)
+        outcome = {}
+        saved = verify_and_save(appy_frame, menu_page, auto_save=auto_save,
+                                outcome=outcome)
         if auto_save:
+            result["saved"] = saved
+            result["confirmed"] = saved and outcome.get("confirmed", False)
+            result["record_no"] = outcome.get("record_no", "")
             if saved:
-                print("  [OK] 表單已自動存入")
+                events.info("  [OK] 表單已自動存入")
                 # ── 7. 回到購案管理驗證存入內容 ────────────
                 try:
                     verify_result = verify_saved_record(
@@ -2186,26 +2218,30 @@ def fill_expense_form(frames: dict, receipt_data: dict,
                         note = verify_result.get("note", "")
                         rec = verify_result.get("record_no", "")
                         if note:
-                            print(f"  [OK] {note}")
+                            events.info(f"  [OK] {note}")
                         else:
-                            print(f"  [OK] 驗證通過！記錄 {rec}")
+                            events.info(f"  [OK] 驗證通過！記錄 {rec}")
+                        if not result["record_no"] and rec and rec != "N/A":
+                            result["record_no"] = rec
                     else:
-                        print(f"  [WARN] 驗證未通過，請手動確認")
+                        events.warn(f"  [WARN] 驗證未通過，請手動確認")
                 except Exception as e:
-                    print(f"  [WARN] 驗證過程發生錯誤: {e}")
-                    print(f"  [INFO] 存入已由 dialog 確認成功，驗證可忽略")
+                    events.warn(f"  [WARN] 驗證過程發生錯誤: {e}")
+                    events.info(f"  [INFO] 存入已由 dialog 確認成功，驗證可忽略")
             else:
-                print("  [FAIL] 自動存入失敗，請手動確認")
+                events.error("  [FAIL] 自動存入失敗，請手動確認")
         else:
-            print("  表單填寫完成（未啟用自動存入，請手動點擊「存入」）")
+            events.info("  表單填寫完成（未啟用自動存入，請手動點擊「存入」）")
     else:
-        print("  警告: 找不到 APPY frame，無法進行存檔準備")
+        events.warn("  警告: 找不到 APPY frame，無法進行存檔準備")
+    return result
 
 
 # ────────────────────────────────────────────────────────
 # Main entry point
 # ────────────────────────────────────────────────────────
 
+@profiling.timed("browser_start")
 def start_browser(headless: bool = True):
     """
     啟動 Playwright 瀏覽器，回傳 (playwright, browser, context)。
@@ -2224,6 +2260,54 @@ def start_browser(headless: bool = True):
     return pw, browser, context
 
 
+class BrowserSession:
+    """
+    常駐的瀏覽器與登入工作階段（watcher.py / jobserver.py 用）。
+
+    Playwright sync API 只能在建立它的執行緒使用：每個執行緒各自建立一個
+    BrowserSession。閒置超過 max_idle 秒或呼叫 drop() 後，下次 page() 會重新登入。
+    """
+
+    def __init__(self, headless: bool = True, max_idle: float = 20 * 60):
+        self.headless = headless
+        self.max_idle = max_idle
+        self._pw = self._browser = self._context = self._menu_page = None
+        self._used = 0.0
+
+    def page(self):
+        """回傳已登入的 (menu_page, context)。"""
+        idle = time.monotonic() - self._used
+        if self._menu_page is not None and idle > self.max_idle:
+            events.info(f"  工作階段閒置 {idle / 60:.0f} 分鐘，重新登入")
+            self.drop()
+        if self._pw is None:
+            self._pw, self._browser, self._context = start_browser(headless=self.headless)
+        if self._menu_page is None:
+            self._menu_page = login(self._context)
+        self._used = time.monotonic()
+        return self._menu_page, self._context
+
+    def touch(self) -> None:
+        """記錄工作階段剛使用過（填完一批後呼叫）。"""
+        self._used = time.monotonic()
+
+    def drop(self) -> None:
+        """關閉主選單頁（工作階段可能已失效時呼叫），下次 page() 重新登入。"""
+        if self._menu_page is not None:
+            try:
+                self._menu_page.close()
+            except Exception:
+                pass
+        self._menu_page = None
+
+    def close(self) -> None:
+        self.drop()
+        if self._pw is not None:
+            self._browser.close()
+            self._pw.stop()
+            self._pw = None
+
+
 def run_form_fill(receipt_data: dict, headless: bool = True,
                    plan_name: str = "", receipt_seq: int = 1,
                    auto_save: bool = True, use_project: bool = False):
@@ -2241,8 +2325,6 @@ def run_form_fill(receipt_data: dict, headless: bool = True,
         (menu_page, frames, browser, pw) 以便後續操作。
         呼叫者負責 browser.close() 和 pw.stop()。
     """
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-
     pw, browser, context = start_browser(headless=headless)
 
     try:
@@ -2265,10 +2347,8 @@ def run_form_fill(receipt_data: dict, headless: bool = True,
         )
 
         # 截圖
-        menu_page.screenshot(
-            path=f"{OUTPUT_DIR}/filled_form.png", full_page=True
-        )
-        print(f"  截圖已存: {OUTPUT_DIR}/filled_form.png")
+        shot = artifacts.screenshot(menu_page, "filled_form", full_page=True)
+        print(f"  截圖已存: {shot}")
 
         return menu_page, frames, browser, pw
 
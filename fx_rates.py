@@ -0,0 +1,189 @@
+"""本地匯率表：外幣收據找不到刷卡紀錄時，先以歷史匯率估算暫定台幣金額。
+
+匯率表為 CSV（每日一筆，TWD / 1 單位外幣）：
+    date,currency,rate
+    2026-02-02,USD,32.51
+    2026-02-02,JPY,0.2135
+
+用暫定匯率填單、確認存入的收據會記錄在待對帳清單（config.FX_RECONCILE_FILE，
+含請購單號），等信用卡帳單出來後再人工核對實際台幣金額。
+
+用法：
+    python fx_rates.py import rates.csv     # 匯入（合併）匯率到本地匯率表
+    python fx_rates.py show USD 2026-02-10  # 查詢某日適用的匯率
+    python fx_rates.py pending              # 列出待對帳的暫定金額收據
+"""
+
+import bisect
+import csv
+import os
+import sys
+from datetime import date, datetime
+from pathlib import Path
+
+import jsonfile
+from records import normalize_currency
+
+
+def _parse_day(text: str) -> int:
+    return datetime.strptime(text.strip(), "%Y-%m-%d").toordinal()
+
+
+class RateTable:
+    """依 (幣別, 日期) 索引的每日匯率表。"""
+
+    def __init__(self):
+        self._days = {}    # currency → [日序數]（已排序）
+        self._rates = {}   # currency → [匯率]（與 _days 對齊）
+
+    def __len__(self):
+        return sum(len(v) for v in self._days.values())
+
+    @classmethod
+    def load(cls, path) -> "RateTable":
+        """讀取 CSV 匯率表；檔案不存在回傳空表。格式錯誤的行會略過。"""
+        table = cls()
+        if not path or not Path(path).exists():
+            return table
+        rows = {}
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            for row in csv.DictReader(f):
+                try:
+                    day = _parse_day(row["date"])
+                    cur = normalize_currency(row["currency"])
+                    rate = float(row["rate"])
+                except (KeyError, ValueError, AttributeError):
+                    continue
+                if rate > 0:
+                    rows[(cur, day)] = rate
+        for (cur, day), rate in sorted(rows.items()):
+            table._days.setdefault(cur, []).append(day)
+            table._rates.setdefault(cur, []).append(rate)
+        return table
+
+    def rows(self):
+        """依幣別、日期排序回傳 (iso 日期, 幣別, 匯率)。"""
+        for cur in sorted(self._days):
+            for day, rate in zip(self._days[cur], self._rates[cur]):
+                yield date.fromordinal(day).isoformat(), cur, rate
+
+    def lookup(self, currency: str, iso_date: str, max_age_days: int = 7) -> tuple:
+        """
+        取得某日適用的匯率：優先用當日或之前最近的一筆，
+        若沒有則用之後最近的一筆；相差超過 max_age_days 天視為查無匯率。
+        收據日期無法解析時也視為查無匯率（不以今天的匯率代替）。
+
+        Returns:
+            (匯率, 匯率日期 iso) 或 (None, "")
+        """
+        cur = normalize_currency(currency)
+        days = self._days.get(cur)
+        if not days:
+            return None, ""
+        try:
+            target = _parse_day(iso_date)
+        except (ValueError, TypeError, AttributeError):
+            return None, ""
+
+        pos = bisect.bisect_right(days, target)
+        choices = []
+        if pos > 0:
+            choices.append(pos - 1)
+        if pos < len(days):
+            choices.append(pos)
+        best = min(choices, key=lambda i: (abs(days[i] - target), days[i] > target))
+        if abs(days[best] - target) > max_age_days:
+            return None, ""
+        return self._rates[cur][best], date.fromordinal(days[best]).isoformat()
+
+
+def import_csv(src, dest) -> int:
+    """將 src 的匯率合併進本地匯率表 dest（同日同幣別以新資料為準），回傳總筆數。"""
+    merged = {}
+    for table in (RateTable.load(dest), RateTable.load(src)):
+        for day, cur, rate in table.rows():
+            merged[(day, cur)] = rate
+    Path(dest).parent.mkdir(parents=True, exist_ok=True)
+    tmp = f"{dest}.tmp"
+    with open(tmp, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["date", "currency", "rate"])
+        for (day, cur), rate in sorted(merged.items()):
+            writer.writerow([day, cur, rate])
+    os.replace(tmp, dest)
+    return len(merged)
+
+
+def provisional_twd(amount: float, rate: float, card_fee_rate: float = 0.0) -> int:
+    """原幣金額 × 匯率 ×（1 + 國外交易手續費率），四捨五入為整數台幣。"""
+    return int(round(amount * rate * (1 + card_fee_rate)))
+
+
+# ════════════════════════════════════════════════════════════
+#  待對帳清單
+# ════════════════════════════════════════════════════════════
+
+def load_pending(path) -> list:
+    """
+    讀取待對帳清單，檔案不存在回傳空列表。
+
+    Raises:
+        ValueError: 檔案內容損毀（不當作空清單，否則下次寫入會清掉所有待對帳項目）
+    """
+    return jsonfile.read(path, [])
+
+
+def add_pending(path, receipt: dict, record_no: str = "") -> None:
+    """
+    記錄一筆以暫定匯率計價、已存入的收據（同來源同金額不重複記錄）。
+    經由 jsonfile.update() 讀改寫（鎖 + 原子取代）；既有清單損毀時拋出 ValueError，不寫入。
+    """
+    entry = {
+        "source": receipt.get("_source_image", ""),
+        "vendor": receipt.get("vendor", ""),
+        "date": receipt.get("date", ""),
+        "currency": receipt.get("_original_currency") or normalize_currency(receipt.get("currency")),
+        "original_amount": receipt.get("_original_amount"),
+        "fx_rate": receipt.get("_fx_rate"),
+        "fx_rate_date": receipt.get("_fx_rate_date", ""),
+        "provisional_twd": receipt.get("_provisional_twd"),
+        "record_no": record_no,
+        "recorded_at": datetime.now().isoformat(timespec="seconds"),
+    }
+
+    def _append(pending: list):
+        for p in pending:
+            if all(p.get(k) == entry[k] for k in ("source", "vendor", "date", "original_amount")):
+                return False
+        pending.append(entry)
+
+    jsonfile.update(path, _append, [])
+
+
+if __name__ == "__main__":
+    from config import FX_RATES_FILE, FX_RECONCILE_FILE
+
+    if len(sys.argv) >= 3 and sys.argv[1] == "import":
+        total = import_csv(sys.argv[2], FX_RATES_FILE)
+        print(f"已匯入 {sys.argv[2]} → {FX_RATES_FILE}（共 {total} 筆）")
+    elif len(sys.argv) >= 3 and sys.argv[1] == "show":
+        day = sys.argv[3] if len(sys.argv) >= 4 else date.today().isoformat()
+        rate, rate_day = RateTable.load(FX_RATES_FILE).lookup(sys.argv[2], day)
+        if rate:
+            print(f"{sys.argv[2].upper()} {day}: {rate}（匯率日期 {rate_day}）")
+        else:
+            print(f"{sys.argv[2].upper()} {day}: 查無匯率")
+    elif len(sys.argv) >= 2 and sys.argv[1] == "pending":
+        try:
+            pending = load_pending(FX_RECONCILE_FILE)
+        except ValueError as e:
+            print(f"待對帳清單無法讀取（{FX_RECONCILE_FILE}）: {e}")
+            sys.exit(1)
+        print(f"待對帳收據 {len(pending)} 筆：")
+        for p in pending:
+            print(f"  {p['date']} {p['vendor']} {p['currency']} {p['original_amount']}"
+                  f" × {p['fx_rate']} ({p['fx_rate_date']}) → 暫定 NT${p['provisional_twd']}"
+                  f"  [{p['source']}] {p.get('record_no', '')}")
+    else:
+        print(__doc__)
+        sys.exit(1)
@@ -0,0 +1,335 @@
+"""持久化工作佇列（SQLite）：OCR 與填單工作，支援優先度、租約逾時、重試與 dead letter。
+
+工作狀態：
+    ready    等待處理（available_at 之後才可被取走，重試時往後延）
+    running  已被某個工作執行緒取走，租約到 lease_until 為止
+    done     完成
+    dead     重試 max_attempts 次仍失敗，需人工處理（python jobqueue.py retry <id>）
+
+取工作（claim）以 BEGIN IMMEDIATE 交易進行，多個執行緒/程序不會取到同一筆。
+租約逾時（程式當掉、被 kill）的 running 工作會被重新取走；執行中應定期
+heartbeat() 延長租約。complete() / fail() 只接受目前持有租約的工作執行緒，
+過期租約的舊執行緒回報會被忽略，避免同一工作被記錄兩次。
+
+優先度越大越先處理；同優先度依可處理時間、建立順序。填單工作的優先度
+由 deadline_priority() 依收據月份的月底期限計算（越接近或已過月底越優先）。
+
+用法：
+    python jobqueue.py stats                 # 各狀態工作數
+    python jobqueue.py list [狀態]            # 列出工作（預設全部未完成）
+    python jobqueue.py show <id>             # 工作內容與最後錯誤
+    python jobqueue.py retry <id>            # dead / 失敗的工作重新排入
+    python jobqueue.py purge [天數]           # 刪除 N 天前完成的工作（預設 30）
+"""
+
+import calendar
+import json
+import os
+import random
+import socket
+import sys
+import time
+from contextlib import closing
+from datetime import date, datetime
+
+from ledger import _SqliteStore
+from records import parse_day
+
+_QUEUE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind         TEXT NOT NULL,             -- "ocr" / "submit"
+    payload      TEXT NOT NULL,             -- JSON
+    priority     INTEGER NOT NULL DEFAULT 0,
+    status       TEXT NOT NULL,             -- ready / running / done / dead
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    available_at REAL NOT NULL,
+    lease_until  REAL NOT NULL DEFAULT 0,
+    worker       TEXT NOT NULL DEFAULT '',
+    dedupe_key   TEXT UNIQUE,
+    last_error   TEXT NOT NULL DEFAULT '',
+    result       TEXT NOT NULL DEFAULT '',
+    created_at   TEXT NOT NULL,
+    updated_at   TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (kind, status, priority, available_at);
+"""
+
+STATUSES = ("ready", "running", "done", "dead")
+
+
+def worker_id(name: str = "") -> str:
+    """工作執行緒識別：主機:pid[:名稱]（用於租約與孤兒工作回收）。"""
+    wid = f"{socket.gethostname()}:{os.getpid()}"
+    return f"{wid}:{name}" if name else wid
+
+
+def deadline_priority(iso_dates, today: date = None) -> int:
+    """
+    月底期限優先度（0~100）：以最早的收據日期所屬月份的月底為期限，
+    剩餘天數越少越優先，已過期限者更優先。
+    """
+    today = today or date.today()
+    days = [d for d in (parse_day(x) for x in iso_dates) if d]
+    earliest = min(days) if days else today
+    month_end = date(earliest.year, earliest.month,
+                     calendar.monthrange(earliest.year, earliest.month)[1])
+    return max(0, min(100, 31 - (month_end - today).days))
+
+
+def _now_iso() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def _row_to_job(row) -> dict:
+    job = dict(row)
+    job["payload"] = json.loads(job["payload"])
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+
+class JobQueue(_SqliteStore):
+    """SQLite 工作佇列。每個方法各自開關連線，可跨執行緒、跨程序使用。"""
+
+    SCHEMA = _QUEUE_SCHEMA
+
+    def __init__(self, path, visibility: float = 600, max_attempts: int = 4,
+                 backoff_base: float = 30, backoff_max: float = 1800, timeout: float = 30.0):
+        super().__init__(path, timeout=timeout)
+        self.visibility = visibility
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    # ── 排入 ─────────────────────────────────────────
+    def enqueue(self, kind: str, payload: dict, priority: int = 0,
+                dedupe_key: str = None, max_attempts: int = None, conn=None) -> int:
+        """排入工作，回傳工作 id；dedupe_key 已存在時不重複排入，回傳既有工作的 id。"""
+        if conn is None:
+            with self._transaction() as conn:
+                return self.enqueue(kind, payload, priority, dedupe_key, max_attempts, conn)
+        if dedupe_key:
+            row = conn.execute("SELECT id FROM jobs WHERE dedupe_key = ?",
+                               (dedupe_key,)).fetchone()
+            if row:
+                return row[0]
+        now = _now_iso()
+        cur = conn.execute(
+            "INSERT INTO jobs (kind, payload, priority, status, max_attempts, available_at, "
+            "dedupe_key, created_at, updated_at) VALUES (?, ?, ?, 'ready', ?, ?, ?, ?, ?)",
+            (kind, json.dumps(payload, ensure_ascii=False), int(priority),
+             max_attempts or self.max_attempts, time.time(), dedupe_key, now, now))
+        return cur.lastrowid
+
+    # ── 取走 / 租約 ───────────────────────────────────
+    def claim(self, kind: str, worker: str) -> dict:
+        """
+        取走一筆可處理的工作（ready 且已到可處理時間，或租約已逾時的 running），
+        回傳工作 dict；沒有則回傳 None。逾時工作的嘗試次數已用完時改為 dead。
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            conn.row_factory = _dict_factory
+            while True:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE kind = ? AND ("
+                    "  (status = 'ready' AND available_at <= ?) OR"
+                    "  (status = 'running' AND lease_until < ?)) "
+                    "ORDER BY priority DESC, available_at, id LIMIT 1",
+                    (kind, now, now)).fetchone()
+                if row is None:
+                    return None
+                if row["status"] == "running" and row["attempts"] >= row["max_attempts"]:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'dead', worker = '', updated_at = ?, "
+                        "last_error = ? WHERE id = ?",
+                        (_now_iso(), row["last_error"] or f"租約逾時（{row['worker']}）",
+                         row["id"]))
+                    continue
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, "
+                    "lease_until = ?, worker = ?, updated_at = ? WHERE id = ?",
+                    (now + self.visibility, worker, _now_iso(), row["id"]))
+                row = conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+                return _row_to_job(row)
+
+    def heartbeat(self, job_id: int, worker: str) -> bool:
+        """延長租約；租約已被其他執行緒取走時回傳 False（應停止處理）。"""
+        with self._transaction() as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET lease_until = ?, updated_at = ? "
+                "WHERE id = ? AND status = 'running' AND worker = ?",
+                (time.time() + self.visibility, _now_iso(), job_id, worker))
+            return cur.rowcount == 1
+
+    def complete(self, job_id: int, worker: str, result=None, then: dict = None) -> bool:
+        """
+        標記完成；then 指定時在同一交易中排入後續工作
+        （{"kind", "payload", "priority", "dedupe_key"}），完成與排入不會只做一半。
+        """
+        with self._transaction() as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, lease_until = 0, updated_at = ? "
+                "WHERE id = ? AND status = 'running' AND worker = ?",
+                (json.dumps(result, ensure_ascii=False) if result is not None else "",
+                 _now_iso(), job_id, worker))
+            if cur.rowcount != 1:
+                return False
+            if then:
+                self.enqueue(then["kind"], then["payload"], then.get("priority", 0),
+                             then.get("dedupe_key"), conn=conn)
+            return True
+
+    def fail(self, job_id: int, worker: str, error: str, retry: bool = True) -> str:
+        """
+        回報失敗：還有嘗試次數且 retry=True 時延後重試（指數退避 + 抖動），
+        否則移到 dead。回傳新狀態（"ready" / "dead"），租約已不屬於 worker 時回傳 ""。
+        """
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT attempts, max_attempts FROM jobs "
+                "WHERE id = ? AND status = 'running' AND worker = ?",
+                (job_id, worker)).fetchone()
+            if row is None:
+                return ""
+            attempts, max_attempts = row
+            if retry and attempts < max_attempts:
+                delay = min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1))
+                delay *= random.uniform(0.8, 1.2)
+                status, available_at = "ready", time.time() + delay
+            else:
+                status, available_at = "dead", time.time()
+            conn.execute(
+                "UPDATE jobs SET status = ?, available_at = ?, lease_until = 0, worker = '', "
+                "last_error = ?, updated_at = ? WHERE id = ?",
+                (status, available_at, error, _now_iso(), job_id))
+            return status
+
+    def release_orphans(self) -> int:
+        """
+        本機上已結束的程序留下的 running 工作：租約立即到期，可馬上被重新取走
+        （不必等 visibility 逾時）。回傳回收筆數。
+        """
+        host = socket.gethostname()
+        orphans = []
+        with closing(self._connect()) as conn:
+            for job_id, worker in conn.execute(
+                    "SELECT id, worker FROM jobs WHERE status = 'running'"):
+                parts = worker.split(":")
+                if len(parts) < 2 or parts[0] != host or not parts[1].isdigit():
+                    continue
+                if int(parts[1]) == os.getpid() or _pid_alive(int(parts[1])):
+                    continue
+                orphans.append((job_id, worker))
+        with self._transaction() as conn:
+            for job_id, worker in orphans:
+                conn.execute(
+                    "UPDATE jobs SET lease_until = 0 WHERE id = ? AND worker = ? "
+                    "AND status = 'running'", (job_id, worker))
+        return len(orphans)
+
+    # ── 查詢與管理 ─────────────────────────────────────
+    def get(self, job_id: int) -> dict:
+        with closing(self._connect()) as conn:
+            conn.row_factory = _dict_factory
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            return _row_to_job(row) if row else None
+
+    def list(self, status: str = None) -> list:
+        """列出工作（不含 payload）；status 為 None 時列出未完成（ready/running/dead）。"""
+        with closing(self._connect()) as conn:
+            conn.row_factory = _dict_factory
+            if status:
+                rows = conn.execute("SELECT * FROM jobs WHERE status = ? ORDER BY id", (status,))
+            else:
+                rows = conn.execute("SELECT * FROM jobs WHERE status != 'done' ORDER BY id")
+            return [{k: v for k, v in row.items() if k not in ("payload", "result")}
+                    for row in rows]
+
+    def stats(self) -> dict:
+        """{kind: {status: 筆數}}"""
+        out = {}
+        with closing(self._connect()) as conn:
+            for kind, status, n in conn.execute(
+                    "SELECT kind, status, COUNT(*) FROM jobs GROUP BY kind, status"):
+                out.setdefault(kind, {})[status] = n
+        return out
+
+    def retry(self, job_id: int) -> bool:
+        """dead（或等待重試中）的工作立即重新排入，嘗試次數歸零。"""
+        with self._transaction() as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET status = 'ready', attempts = 0, available_at = ?, "
+                "updated_at = ? WHERE id = ? AND status IN ('dead', 'ready')",
+                (time.time(), _now_iso(), job_id))
+            return cur.rowcount == 1
+
+    def purge(self, older_than_days: float = 30) -> int:
+        """刪除完成超過 N 天的工作（dedupe_key 一併釋出），回傳刪除筆數。"""
+        cutoff = datetime.fromtimestamp(time.time() - older_than_days * 86400)
+        with self._transaction() as conn:
+            return conn.execute(
+                "DELETE FROM jobs WHERE status = 'done' AND updated_at < ?",
+                (cutoff.isoformat(timespec="seconds"),)).rowcount
+
+
+def _dict_factory(cursor, row) -> dict:
+    return {col[0]: value for col, value in zip(cursor.description, row)}
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+def open_queue() -> JobQueue:
+    """以 config 設定開啟工作佇列。"""
+    from config import (
+        QUEUE_DB, QUEUE_VISIBILITY_SEC, QUEUE_MAX_ATTEMPTS,
+        QUEUE_BACKOFF_BASE_SEC, QUEUE_BACKOFF_MAX_SEC,
+    )
+    return JobQueue(QUEUE_DB, visibility=QUEUE_VISIBILITY_SEC,
+                    max_attempts=QUEUE_MAX_ATTEMPTS,
+                    backoff_base=QUEUE_BACKOFF_BASE_SEC,
+                    backoff_max=QUEUE_BACKOFF_MAX_SEC)
+
+
+if __name__ == "__main__":
+    q = open_queue()
+    cmd = sys.argv[1] if len(sys.argv) >= 2 else ""
+    if cmd == "stats":
+        for kind, counts in sorted(q.stats().items()):
+            print(f"  {kind:<7} " + "  ".join(f"{s}={counts.get(s, 0)}" for s in STATUSES))
+    elif cmd == "list":
+        status = sys.argv[2] if len(sys.argv) >= 3 else None
+        if status and status not in STATUSES:
+            print(f"狀態必須是 {', '.join(STATUSES)} 之一")
+            sys.exit(1)
+        for job in q.list(status):
+            print(f"  #{job['id']:<5} {job['kind']:<7} {job['status']:<8} p={job['priority']:<3} "
+                  f"嘗試 {job['attempts']}/{job['max_attempts']}  {job['updated_at']}"
+                  + (f"  {job['last_error'][:60]}" if job['last_error'] else ""))
+    elif cmd == "show" and len(sys.argv) >= 3:
+        job = q.get(int(sys.argv[2]))
+        if not job:
+            print("找不到工作")
+            sys.exit(1)
+        print(json.dumps(job, ensure_ascii=False, indent=2))
+    elif cmd == "retry" and len(sys.argv) >= 3:
+        if q.retry(int(sys.argv[2])):
+            print(f"工作 #{sys.argv[2]} 已重新排入")
+        else:
+            print(f"工作 #{sys.argv[2]} 不是 dead / ready 狀態")
+            sys.exit(1)
+    elif cmd == "purge":
+        days = float(sys.argv[2]) if len(sys.argv) >= 3 else 30
+        print(f"已刪除 {q.purge(days)} 筆完成超過 {days:g} 天的工作")
+    else:
+        print(__doc__)
+        sys.exit(1)
@@ -0,0 +1,537 @@
+"""本機 HTTP 工作 API：多人上傳收據，由 OCR 與瀏覽器兩組工作執行緒處理。
+
+端點（皆為 JSON）：
+    POST /jobs                         建立工作
+        {"files": [{"name": "a.jpg", "data": "<base64>"}],
+         "plan": "國科會", "mode": "project", "auto_save": true}
+    GET  /jobs                         所有工作摘要
+    GET  /jobs/<工作ID>                 工作狀態、結果與產出檔清單
+    GET  /jobs/<工作ID>/artifacts/<檔名> 下載產出（上傳檔、截圖、合併 OCR JSON）
+    GET  /health                       工作執行緒與佇列狀態
+
+工作狀態：queued → ocr → waiting（等瀏覽器）→ filling → done / failed
+（失敗但還能重試時為 retrying，依退避時間自動重試）
+
+OCR 執行緒辨識、比對、規劃後，經持久化工作佇列（jobqueue.py）把請購單交給
+瀏覽器執行緒；每個瀏覽器執行緒各自持有一個登入工作階段（Playwright sync API
+只能在建立它的執行緒使用；同時登入時驗證碼各用自己的暫存檔，見 form_filler.solve_captcha）。
+伺服器當掉或重啟後，未完成的工作會接續處理；
+重試時依送出紀錄略過已存入的請購單，不會重複送出。POST 可帶 "priority"
+（整數，越大越先處理），填單工作另依收據月份的月底期限提高優先度。
+吞吐量由 --ocr-workers / --browser-workers 調整。一律以無人值守模式執行
+（依政策檔作答，見 policy.py）；config.API_TOKEN 設定後需帶 Bearer token。
+
+用法：
+    python jobserver.py --ocr-workers 2 --browser-workers 1
+    curl -s localhost:8765/jobs/<工作ID>
+"""
+
+import argparse
+import base64
+import binascii
+import json
+import os
+import secrets
+import sys
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from config import (
+    MATCH_MODE, BATCH_RULES_FILE, POLICY_FILE, WATCH_SESSION_MAX_AGE_MIN,
+    API_HOST, API_PORT, API_TOKEN, API_OCR_WORKERS, API_BROWSER_WORKERS,
+    API_MAX_UPLOAD_MB, JOBS_DIR, LEDGER_DB, QUEUE_POLL_SEC, METRICS_FILE,
+)
+from main import (
+    SUPPORTED_EXTENSIONS, iter_ocr_files, prepare_submission, filter_submitted,
+    build_batches, fill_batches, _item_rows, BrowserSession,
+)
+from planner import BatchRules, group_receipts
+from ledger import SubmissionLedger
+from jobqueue import JobQueue, open_queue, worker_id, deadline_priority
+import artifacts
+import events
+import metrics
+import policy
+from policy import Policy
+
+
+class _LeaseLost(Exception):
+    """佇列租約已失效（處理太久被視為中斷，工作已交給其他執行緒）。"""
+
+
+# ════════════════════════════════════════════════════════════
+#  工作紀錄
+# ════════════════════════════════════════════════════════════
+
+class JobStore:
+    """工作紀錄（記憶體 + jobs/<工作ID>/job.json），所有存取都經過同一把鎖。"""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        # 未完成的工作由工作佇列在重啟後接續，這裡只載入紀錄
+        for path in sorted(self.root.glob("*/job.json")):
+            with open(path, "r", encoding="utf-8") as f:
+                job = json.load(f)
+            self._jobs[job["id"]] = job
+
+    def _write(self, job: dict) -> None:
+        path = self.root / job["id"] / "job.json"
+        tmp = path.with_suffix(".json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(job, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+
+    def create(self, files: list, params: dict) -> dict:
+        """存下上傳檔並建立工作。files: [(檔名, bytes), ...]"""
+        job_id = f"{datetime.now():%Y%m%d-%H%M%S}-{secrets.token_hex(3)}"
+        uploads = self.root / job_id / "uploads"
+        uploads.mkdir(parents=True)
+        names = []
+        for name, data in files:
+            path = uploads / name
+            path.write_bytes(data)
+            names.append(name)
+        now = datetime.now().isoformat(timespec="seconds")
+        job = {
+            "id": job_id, "status": "queued", "created_at": now, "updated_at": now,
+            "params": params, "files": names, "error": "",
+            "receipts": 0, "held": 0, "skipped": 0, "requisitions": [],
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            self._write(job)
+        return dict(job)
+
+    def update(self, job_id: str, **fields) -> None:
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(fields)
+            job["updated_at"] = datetime.now().isoformat(timespec="seconds")
+            self._write(job)
+
+    def get(self, job_id: str) -> dict:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return json.loads(json.dumps(job)) if job else None
+
+    def list(self) -> list:
+        with self._lock:
+            return [{k: job[k] for k in ("id", "status", "created_at", "updated_at", "error")}
+                    for job in self._jobs.values()]
+
+    def uploads(self, job_id: str) -> list:
+        return sorted((self.root / job_id / "uploads").iterdir())
+
+    def artifacts(self, job_id: str) -> dict:
+        """{檔名: 路徑}：上傳檔 + 填單產出（jobs/<工作ID>/ 下的截圖、合併 OCR JSON）。"""
+        found = {p.name: p for p in self.uploads(job_id)}
+        for p in (self.root / job_id).iterdir():
+            if p.is_file() and not p.name.startswith("job.json"):
+                found[p.name] = p
+        return found
+
+
+# ════════════════════════════════════════════════════════════
+#  工作執行緒
+# ════════════════════════════════════════════════════════════
+
+class JobRunner:
+    """
+    OCR 與瀏覽器工作執行緒，透過持久化工作佇列（jobqueue.py）交接：
+    上傳 → "ocr" 工作 → 規劃完成後在同一交易排入 "submit" 工作 → 填單。
+    失敗時依退避時間重試，超過次數進 dead letter；伺服器重啟後未完成的工作會接續。
+    """
+
+    def __init__(self, store: JobStore, jobs: JobQueue, rules: BatchRules,
+                 ocr_workers: int, browser_workers: int, headless: bool = True):
+        self.store = store
+        self.jobs = jobs
+        self.rules = rules
+        self.headless = headless
+        self._stop = threading.Event()
+        # 處理中工作已認領的收據指紋：避免兩人同時上傳同一張收據而重複送出
+        self._claimed = {}
+        self._claim_lock = threading.Lock()
+        self.threads = [
+            threading.Thread(target=self._ocr_worker, name=f"ocr-{n}", daemon=True)
+            for n in range(1, ocr_workers + 1)
+        ] + [
+            threading.Thread(target=self._browser_worker, name=f"browser-{n}", daemon=True)
+            for n in range(1, browser_workers + 1)
+        ]
+        for t in self.threads:
+            t.start()
+
+    def submit(self, job_id: str, priority: int = 0) -> None:
+        self.jobs.enqueue("ocr", {"job_id": job_id}, priority=priority,
+                          dedupe_key=f"ocr:{job_id}")
+
+    def stats(self) -> dict:
+        return {
+            "ocr_workers": sum(t.name.startswith("ocr") for t in self.threads),
+            "browser_workers": sum(t.name.startswith("browser") for t in self.threads),
+            "queue": self.jobs.stats(),
+        }
+
+    def shutdown(self) -> None:
+        self._stop.set()
+        for t in self.threads:
+            t.join(timeout=10)      # 讓瀏覽器執行緒關閉自己的瀏覽器
+
+    def _poll(self, kind: str, worker: str):
+        """取下一筆工作；佇列為空時等待 QUEUE_POLL_SEC，停止時回傳 None。"""
+        while not self._stop.is_set():
+            job = self.jobs.claim(kind, worker)
+            if job:
+                return job
+            self._stop.wait(QUEUE_POLL_SEC)
+        return None
+
+    def _claim(self, job_id: str, receipts: list) -> list:
+        """認領收據指紋，回傳未被其他處理中工作認領的收據。"""
+        with self._claim_lock:
+            free = [r for r in receipts
+                    if self._claimed.get(r.fingerprint, job_id) == job_id]
+            for r in free:
+                self._claimed[r.fingerprint] = job_id
+        return free
+
+    def _release(self, job_id: str) -> None:
+        with self._claim_lock:
+            for fp in [fp for fp, owner in self._claimed.items() if owner == job_id]:
+                del self._claimed[fp]
+
+    def _failed(self, qjob: dict, worker: str, job_id: str, error: str) -> None:
+        """回報佇列失敗：還能重試 → retrying；進 dead letter → failed。"""
+        status = self.jobs.fail(qjob["id"], worker, error)
+        if status == "ready":
+            self.store.update(job_id, status="retrying",
+                              error=f"{error}（第 {qjob['attempts']} 次失敗，稍後重試）")
+        elif status == "dead":
+            self._finish(job_id, "failed",
+                         error=f"{error}（重試 {qjob['attempts']} 次仍失敗，"
+                               f"見 python jobqueue.py show {qjob['id']}）")
+
+    # ── OCR ──────────────────────────────────────────
+    def _ocr_worker(self) -> None:
+        worker = worker_id(threading.current_thread().name)
+        while True:
+            qjob = self._poll("ocr", worker)
+            if qjob is None:
+                return
+            job_id = qjob["payload"]["job_id"]
+            try:
+                then = self._ocr_job(job_id, qjob["priority"],
+                                     lambda: self.jobs.heartbeat(qjob["id"], worker))
+            except _LeaseLost:
+                print(f"  [WARN] 工作 {job_id} 的租約已被取走，停止辨識（由其他執行緒接手）")
+                continue
+            except Exception as e:
+                self._failed(qjob, worker, job_id, f"{type(e).__name__}: {e}")
+                continue
+            self.jobs.complete(qjob["id"], worker, then=then)
+
+    def _ocr_job(self, job_id: str, priority: int, heartbeat):
+        """
+        辨識 → 比對/正規化 → 略過已送出 → 規劃請購單；回傳要接著排入的 submit 工作。
+        每辨識完一個檔案呼叫 heartbeat() 延長租約；租約已失效時拋出 _LeaseLost。
+        """
+        self.store.update(job_id, status="ocr")
+        params = self.store.get(job_id)["params"]
+        docs = []
+        for _, receipts in iter_ocr_files(self.store.uploads(job_id)):
+            docs.extend(receipts)
+            if not heartbeat():
+                raise _LeaseLost(job_id)
+        ready, held = prepare_submission(docs, mode=MATCH_MODE)
+        receipts = [r for _, r in ready]
+        remaining = self._claim(job_id, filter_submitted(receipts))
+        self.store.update(job_id, receipts=len(receipts), held=len(held),
+                          skipped=len(receipts) - len(remaining))
+        if not remaining:
+            self._finish(job_id, "done" if receipts else "failed",
+                         error="" if receipts else "沒有可送出的收據")
+            return None
+
+        requisitions = group_receipts(remaining, self.rules, _item_rows)
+        batches = build_batches(requisitions)
+        reason = policy.current().check_requisitions(batches)
+        if reason:
+            self._finish(job_id, "failed", error=reason)
+            return None
+        self.store.update(job_id, status="waiting", requisitions=[
+            {"index": k, "receipts": len(req["receipts"]),
+             "amount": batch.get("amount", 0), "ok": None, "record_no": "", "error": ""}
+            for k, (req, batch) in enumerate(zip(requisitions, batches), 1)
+        ])
+        return {
+            "kind": "submit",
+            "payload": {"job_id": job_id, "batches": batches, "params": params},
+            "priority": priority + deadline_priority(r.iso_date for r in remaining),
+            "dedupe_key": f"submit:{job_id}",
+        }
+
+    # ── 填單 ─────────────────────────────────────────
+    def _browser_worker(self) -> None:
+        """瀏覽器執行緒：自己的登入工作階段，依序處理 submit 工作。"""
+        worker = worker_id(threading.current_thread().name)
+        session = BrowserSession(headless=self.headless,
+                                 max_idle=WATCH_SESSION_MAX_AGE_MIN * 60)
+        try:
+            while True:
+                qjob = self._poll("submit", worker)
+                if qjob is None:
+                    return
+                self._fill_job(session, qjob, worker)
+        finally:
+            session.close()
+
+    def _settled(self, batches: list, requisitions: list) -> set:
+        """
+        依送出紀錄決定哪些請購單不再填（重試或重啟後接續時）：
+        已成功、已存入 → 完成；上次填到一半（pending）→ 失敗，需人工到系統查詢。
+        """
+        settled = set()
+        found = SubmissionLedger(LEDGER_DB).lookup(
+            [r.get("_fingerprint", "") for b in batches for r in (b.get("_receipts") or [b])])
+        for k, batch in enumerate(batches, 1):
+            req = requisitions[k - 1]
+            if req["ok"]:
+                settled.add(k)
+                continue
+            states = [found.get(r.get("_fingerprint", ""), {})
+                      for r in (batch.get("_receipts") or [batch])]
+            if states and all(s.get("status") == "saved" for s in states):
+                req.update(ok=True, record_no=states[0].get("record_no", ""), error="")
+                settled.add(k)
+            elif any(s.get("status") for s in states):
+                req.update(ok=False, error="上次填單未確認完成，請到系統查詢後再重新上傳")
+                settled.add(k)
+        return settled
+
+    def _fill_job(self, session: BrowserSession, qjob: dict, worker: str) -> None:
+        """填一個工作的請購單；每次填單記為一次執行（Prometheus 指標見 metrics.py）。"""
+        outcome, started = "error", time.perf_counter()
+        try:
+            outcome = self._fill_requisitions(session, qjob, worker)
+        finally:
+            events.emit("run", outcome=outcome, job_id=qjob["payload"]["job_id"],
+                        duration_ms=round((time.perf_counter() - started) * 1000, 1))
+
+    def _fill_requisitions(self, session: BrowserSession, qjob: dict, worker: str) -> str:
+        payload = qjob["payload"]
+        job_id, batches, params = payload["job_id"], payload["batches"], payload["params"]
+        self.store.update(job_id, status="filling")
+        plan_name = params.get("plan", "")
+        use_project = bool(plan_name) or params.get("mode") == "project"
+        requisitions = self.store.get(job_id)["requisitions"]
+        skip = self._settled(batches, requisitions)
+        self.store.update(job_id, requisitions=requisitions)
+
+        def _on_result(result: dict) -> None:
+            requisitions[result["index"] - 1].update(
+                ok=result["ok"], record_no=result["record_no"], error=result["error"])
+            self.store.update(job_id, requisitions=requisitions)
+            self.jobs.heartbeat(qjob["id"], worker)
+
+        results = []
+        if len(skip) < len(batches):
+            try:
+                with artifacts.use(self.store.root / job_id):
+                    menu_page, context = session.page()
+                    results = fill_batches(
+                        menu_page, context, batches,
+                        plan_name=plan_name, auto_save=params.get("auto_save", True),
+                        use_project=use_project, source_stem=f"job_{job_id}",
+                        skip=skip, on_result=_on_result,
+                    )
+            except Exception as e:
+                session.drop()      # 工作階段可能已失效，下次重新登入
+                self._failed(qjob, worker, job_id, f"{type(e).__name__}: {e}")
+                return "failed"
+            session.touch()
+
+        if any(not r["ok"] for r in results) or len(skip) + len(results) < len(batches):
+            # 這次有失敗或被中止：重試時由 _settled() 依送出紀錄決定哪些要重填
+            session.drop()
+            failed = sum(not r["ok"] for r in results)
+            self._failed(qjob, worker, job_id, f"{failed} 張請購單失敗")
+            return "failed"
+        self.jobs.complete(qjob["id"], worker, result=requisitions)
+        failed = [r for r in requisitions if not r["ok"]]
+        self._finish(job_id, "failed" if failed else "done",
+                     error=f"{len(failed)} 張請購單需人工確認" if failed else "")
+        return "failed" if failed else "ok"
+
+    def _finish(self, job_id: str, status: str, error: str = "") -> None:
+        self._release(job_id)
+        self.store.update(job_id, status=status, error=error)
+
+
+# ════════════════════════════════════════════════════════════
+#  HTTP
+# ════════════════════════════════════════════════════════════
+
+def _parse_job_request(body: dict) -> tuple:
+    """驗證 POST /jobs 內容，回傳 ([(檔名, bytes)], params)；格式錯誤拋出 ValueError。"""
+    files = []
+    for f in body.get("files") or []:
+        name = Path(str(f.get("name", ""))).name
+        if Path(name).suffix.lower() not in SUPPORTED_EXTENSIONS:
+            raise ValueError(f"不支援的檔案類型: {name or '(未命名)'}")
+        try:
+            files.append((name, base64.b64decode(f.get("data", ""), validate=True)))
+        except (binascii.Error, TypeError):
+            raise ValueError(f"{name}: data 不是有效的 base64")
+    if not files:
+        raise ValueError("files 不可為空")
+    if len({name for name, _ in files}) < len(files):
+        raise ValueError("檔名重複")
+    mode = body.get("mode", "")
+    if mode not in ("", "project", "department"):
+        raise ValueError(f"mode 必須是 project / department: {mode!r}")
+    try:
+        priority = int(body.get("priority", 0) or 0)
+    except (ValueError, TypeError):
+        raise ValueError("priority 必須是整數")
+    params = {
+        "plan": str(body.get("plan", "") or ""),
+        "mode": mode,
+        "auto_save": bool(body.get("auto_save", True)),
+        "priority": priority,
+    }
+    return files, params
+
+
+class JobHandler(BaseHTTPRequestHandler):
+    store: JobStore = None
+    runner: JobRunner = None
+
+    def _send_json(self, status: int, data) -> None:
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self) -> bool:
+        if not API_TOKEN:
+            return True
+        if self.headers.get("Authorization", "") == f"Bearer {API_TOKEN}":
+            return True
+        self._send_json(401, {"error": "需要 Authorization: Bearer <token>"})
+        return False
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        parts = [p for p in self.path.split("?")[0].split("/") if p]
+        if parts == ["health"]:
+            self._send_json(200, {"ok": True, **self.runner.stats()})
+        elif parts == ["jobs"]:
+            self._send_json(200, self.store.list())
+        elif len(parts) == 2 and parts[0] == "jobs":
+            job = self.store.get(parts[1])
+            if not job:
+                self._send_json(404, {"error": "找不到工作"})
+                return
+            job["artifacts"] = sorted(self.store.artifacts(parts[1]))
+            self._send_json(200, job)
+        elif len(parts) == 4 and parts[0] == "jobs" and parts[2] == "artifacts":
+            path = (self.store.artifacts(parts[1]) if self.store.get(parts[1]) else {}).get(parts[3])
+            if not path:
+                self._send_json(404, {"error": "找不到檔案"})
+                return
+            data = path.read_bytes()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self._send_json(404, {"error": "未知的路徑"})
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        if self.path.split("?")[0].rstrip("/") != "/jobs":
+            self._send_json(404, {"error": "未知的路徑"})
+            return
+        length = int(self.headers.get("Content-Length", 0) or 0)
+        # base64 約多 1/3
+        if length > API_MAX_UPLOAD_MB * 1024 * 1024 * 4 // 3 + 4096:
+            self._send_json(413, {"error": f"上傳超過 {API_MAX_UPLOAD_MB} MB"})
+            return
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+            files, params = _parse_job_request(body)
+        except (ValueError, AttributeError) as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        job = self.store.create(files, params)
+        self.runner.submit(job["id"], priority=params["priority"])
+        self._send_json(202, {"id": job["id"], "status": job["status"]})
+
+    def log_message(self, fmt, *args):
+        print(f"  [HTTP] {self.address_string()} {fmt % args}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本機核銷工作 API（上傳收據 → OCR → 填單）")
+    parser.add_argument("--host", type=str, default=API_HOST, help=f"監聽位址（預設 {API_HOST}）")
+    parser.add_argument("--port", type=int, default=API_PORT, help=f"連接埠（預設 {API_PORT}）")
+    parser.add_argument("--ocr-workers", type=int, default=API_OCR_WORKERS,
+                        help=f"OCR 工作執行緒數（預設 {API_OCR_WORKERS}）")
+    parser.add_argument("--browser-workers", type=int, default=API_BROWSER_WORKERS,
+                        help=f"瀏覽器工作執行緒數（預設 {API_BROWSER_WORKERS}）")
+    parser.add_argument("--rules", type=str, default=BATCH_RULES_FILE,
+                        help=f"請購單分組規則檔（預設 {BATCH_RULES_FILE}）")
+    parser.add_argument("--policy", type=str, default=POLICY_FILE,
+                        help=f"執行政策檔（預設 {POLICY_FILE}）")
+    parser.add_argument("--metrics-file", type=str, default=METRICS_FILE,
+                        help=f"每次填單後更新的 Prometheus 指標檔（預設 {METRICS_FILE}，空字串停用）")
+    parser.add_argument("--show-browser", action="store_true", help="顯示瀏覽器視窗（除錯用）")
+    args = parser.parse_args()
+
+    metrics.enable(args.metrics_file)
+
+    try:
+        policy.use(Policy.load(args.policy, unattended=True))
+    except (ValueError, OSError) as e:
+        print(f"[ERROR] 政策檔 {args.policy} 無法讀取: {e}")
+        sys.exit(1)
+
+    store = JobStore(JOBS_DIR)
+    jobs = open_queue()
+    orphans = jobs.release_orphans()
+    if orphans:
+        print(f"  接續上次中斷的 {orphans} 筆工作")
+    runner = JobRunner(store, jobs, BatchRules.load(args.rules), args.ocr_workers,
+                       args.browser_workers, headless=not args.show_browser)
+    for job in store.list():
+        if job["status"] == "queued":
+            # 建立後尚未排入佇列就中斷的工作（已排入者不會重複）
+            runner.submit(job["id"], priority=store.get(job["id"])["params"].get("priority", 0))
+    JobHandler.store = store
+    JobHandler.runner = runner
+    server = ThreadingHTTPServer((args.host, args.port), JobHandler)
+    print(f"工作 API 已啟動: http://{args.host}:{args.port}/"
+          f"（OCR ×{args.ocr_workers}、瀏覽器 ×{args.browser_workers}，Ctrl+C 結束）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n停止服務。")
+    finally:
+        server.server_close()
+        runner.shutdown()
+
+
+if __name__ == "__main__":
+    main()
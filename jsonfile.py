@@ -0,0 +1,124 @@
+"""共用 JSON 檔的讀改寫：跨程序檔案鎖 + 暫存檔原子取代。
+
+學到的廠商別名（config.VENDOR_ALIASES_FILE）與待對帳清單（config.FX_RECONCILE_FILE）
+是給人看、也可以手動編輯的 JSON，但 multiuser.py 的多個執行緒、folders.py 的
+多個工作程序、watcher.py 與 main.py 可能同時更新同一個檔。
+update() 先在 <檔名>.lock 上取得排他鎖，再讀取、修改、以暫存檔 + os.replace 寫回：
+不會互相蓋掉對方新增的項目，讀取端也不會讀到寫到一半的檔案。
+
+檔案存在但內容無法解析時拋出 ValueError，不會當成空的再寫回去（那會清掉所有紀錄）。
+檔案鎖在 Windows 用 msvcrt.locking，其他平台用 fcntl.flock。
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+    import fcntl
+
+LOCK_TIMEOUT = 30.0     # 等待檔案鎖的秒數
+
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+
+def _thread_lock(lock_path: Path) -> threading.Lock:
+    # 同一程序內的執行緒先在這裡排隊，不必各自輪詢檔案鎖
+    key = str(lock_path.resolve())
+    with _thread_locks_guard:
+        return _thread_locks.setdefault(key, threading.Lock())
+
+
+def _try_lock(f) -> None:
+    if msvcrt is not None:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    else:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+
+def _unlock(f) -> None:
+    if msvcrt is not None:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+@contextmanager
+def locked(path, timeout: float = LOCK_TIMEOUT):
+    """with 區塊內持有 path 的排他鎖（其他執行緒與程序等待，最多 timeout 秒）。"""
+    lock_path = Path(f"{path}.lock")
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with _thread_lock(lock_path), open(lock_path, "a+b") as f:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                _try_lock(f)
+                break
+            except OSError:
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"等待檔案鎖逾時: {lock_path}")
+                time.sleep(0.05)
+        try:
+            yield
+        finally:
+            _unlock(f)
+
+
+def _read(path, default):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+
+def _write(path, data) -> None:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def read(path, default):
+    """
+    讀取 JSON（持有檔案鎖，不會讀到寫到一半的檔案）。
+
+    Returns:
+        檔案內容；檔案不存在回傳 default
+    Raises:
+        ValueError: 內容無法解析，或型別與 default 不同
+    """
+    with locked(path):
+        data = _read(path, default)
+    if not isinstance(data, type(default)):
+        raise ValueError(f"{path} 的內容不是 {type(default).__name__}")
+    return data
+
+
+def update(path, change, default) -> bool:
+    """
+    持有檔案鎖，讀取 → change(data) 就地修改 → 原子寫回。
+
+    change 回傳 False 表示沒有變更，不寫檔。
+    Raises:
+        ValueError: 既有內容無法解析（檔案保持原樣）
+    """
+    with locked(path):
+        data = _read(path, default)
+        if not isinstance(data, type(default)):
+            raise ValueError(f"{path} 的內容不是 {type(default).__name__}")
+        if change(data) is False:
+            return False
+        _write(path, data)
+    return True
@@ -0,0 +1,307 @@
+"""SQLite 帳本：收據流水號與送出紀錄，跨程序、跨執行共用。
+
+（一）收據流水號
+
+原本流水號只存在記憶體，每次執行都從 01 開始，同一天跑兩次就會產生
+重複的收據號碼。這裡改用 SQLite 記錄每天已發出的最大流水號，
+以 BEGIN IMMEDIATE 交易做原子遞增，多個程序同時執行也不會拿到同一號。
+
+第一次建立帳本時，會從 output/（含各次執行的目錄）既有的合併 OCR 檔（*_merged_ocr.json）
+與其中出現過的收據號碼推算各日已用到的流水號。
+
+（二）送出紀錄（避免重複核銷）
+每張收據以指紋（檔案雜湊 + 發票號碼 + 金額 + 日期）記錄送出狀態：
+    pending  已開始填單，尚未確認存入（程式中斷時會停在這個狀態）
+    saved    已確認存入，並記下請購單號
+再次執行時，main.py 會在開瀏覽器之前略過 saved、警告 pending 的收據。
+
+用法：
+    python ledger.py show                # 列出各日已發出的最大流水號
+    python ledger.py seed                # 重新從 output/ 既有紀錄補登流水號
+    python ledger.py set 2026-02-26 5    # 手動指定某日已用到的流水號
+    python ledger.py submissions         # 列出送出紀錄
+    python ledger.py forget <指紋前綴>    # 刪除送出紀錄（允許重新送出）
+"""
+
+import hashlib
+import json
+import re
+import sqlite3
+import sys
+from contextlib import closing, contextmanager
+from datetime import datetime
+from pathlib import Path
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS receipt_seq (
+    day      TEXT PRIMARY KEY,     -- "YYYYMMDD"
+    last_seq INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS submissions (
+    fingerprint TEXT PRIMARY KEY,
+    status      TEXT NOT NULL,     -- "pending" / "saved"
+    record_no   TEXT NOT NULL DEFAULT '',
+    source      TEXT NOT NULL DEFAULT '',
+    vendor      TEXT NOT NULL DEFAULT '',
+    amount      TEXT NOT NULL DEFAULT '',
+    date        TEXT NOT NULL DEFAULT '',
+    updated_at  TEXT NOT NULL
+);
+"""
+
+
+def day_key(iso_date: str) -> str:
+    """'2026-02-26' → '20260226'"""
+    return (iso_date or "").replace("-", "")[:8]
+
+
+class _SqliteStore:
+    """每個方法各自開關連線，可安全地跨程序使用。子類別可覆寫 SCHEMA。"""
+
+    SCHEMA = _SCHEMA
+
+    def __init__(self, path, timeout: float = 30.0):
+        self.path = str(path)
+        self.timeout = timeout
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.executescript(self.SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """BEGIN IMMEDIATE：立即取得寫入鎖，其他程序等待（最多 timeout 秒）。"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+
+class ReceiptLedger(_SqliteStore):
+    """每日收據流水號帳本。"""
+
+    def is_empty(self) -> bool:
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM receipt_seq").fetchone()[0] == 0
+
+    def reserve(self, iso_date: str, count: int = 1) -> int:
+        """原子地保留某日連續 count 個流水號，回傳第一個號碼。"""
+        key = day_key(iso_date)
+        count = max(1, count)
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT last_seq FROM receipt_seq WHERE day = ?", (key,)).fetchone()
+            first = (row[0] if row else 0) + 1
+            conn.execute(
+                "INSERT INTO receipt_seq (day, last_seq) VALUES (?, ?) "
+                "ON CONFLICT(day) DO UPDATE SET last_seq = excluded.last_seq",
+                (key, first + count - 1))
+        return first
+
+    def seed(self, iso_date: str, seq: int) -> None:
+        """登記某日已用到 seq（只會往上調，不會讓流水號倒退）。"""
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO receipt_seq (day, last_seq) VALUES (?, ?) "
+                "ON CONFLICT(day) DO UPDATE SET last_seq = MAX(last_seq, excluded.last_seq)",
+                (day_key(iso_date), seq))
+
+    def set(self, iso_date: str, seq: int) -> None:
+        """強制設定某日已用到的流水號（人工修正用）。"""
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO receipt_seq (day, last_seq) VALUES (?, ?) "
+                "ON CONFLICT(day) DO UPDATE SET last_seq = excluded.last_seq",
+                (day_key(iso_date), seq))
+
+    def counts(self) -> dict:
+        """{"YYYYMMDD": 已發出的最大流水號}"""
+        with closing(self._connect()) as conn:
+            return dict(conn.execute("SELECT day, last_seq FROM receipt_seq ORDER BY day"))
+
+    def seed_from_records(self, output_dir, prefix: str = "收據") -> int:
+        """
+        從 output_dir 的既有紀錄（含 runs/ 等子目錄）補登流水號，回傳補登的天數。
+
+        來源：
+          - *_merged_ocr.json 的 _receipt_seqs（各收據日期保留的流水號；
+            舊紀錄為 _receipt_seq / _receipt_seq_count / date）
+          - 所有 *.json 中出現的收據號碼（prefix + 民國 yyyMMdd + 流水號）
+        """
+        used = {}   # day_key → 最大流水號
+
+        def _bump(key, seq):
+            if key and seq > used.get(key, 0):
+                used[key] = seq
+
+        no_re = re.compile(re.escape(prefix) + r"(\d{3})(\d{2})(\d{2})(\d{1,2})(?!\d)")
+        for path in sorted(Path(output_dir).rglob("*.json")):
+            try:
+                text = path.read_text(encoding="utf-8")
+            except OSError:
+                continue
+            for m in no_re.finditer(text):
+                y, mo, d, seq = m.groups()
+                if int(y) == 0:      # 無日期的備用號碼（收據000000NN）
+                    continue
+                _bump(f"{int(y) + 1911:04d}{mo}{d}", int(seq))
+            if path.name.endswith("_merged_ocr.json"):
+                try:
+                    data = json.loads(text)
+                except ValueError:
+                    continue
+                if not isinstance(data, dict):
+                    continue
+                # 依收據日期保留的流水號 {日期: [第一個, 張數]}；舊紀錄只有請購單日期一組
+                seqs = data.get("_receipt_seqs") or {}
+                if not seqs and data.get("_receipt_seq"):
+                    seqs = {data.get("date", ""):
+                            [data["_receipt_seq"], data.get("_receipt_seq_count", 1)]}
+                for day, (first, count) in seqs.items():
+                    _bump(day_key(day), int(first) + int(count) - 1)
+
+        for key, seq in used.items():
+            self.seed(f"{key[:4]}-{key[4:6]}-{key[6:]}", seq)
+        return len(used)
+
+
+# ════════════════════════════════════════════════════════════
+#  送出紀錄（收據指紋 → 狀態 / 請購單號）
+# ════════════════════════════════════════════════════════════
+
+def file_sha256(path) -> str:
+    """檔案內容的 SHA-256；檔案不存在回傳空字串。"""
+    h = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    except OSError:
+        return ""
+    return h.hexdigest()
+
+
+def receipt_fingerprint(file_hash: str, invoice_no: str,
+                        amount_cents: int, iso_date: str, currency: str = "TWD") -> str:
+    """
+    收據指紋：來源檔案雜湊 + 發票號碼 + 金額 + 日期。
+    同一個檔案含多張收據時，以後三者區分。
+    外幣收據的金額為原幣金額並加上幣別（台幣收據的指紋與舊版相同）。
+    """
+    amount = f"{amount_cents / 100:.2f}"
+    if currency and currency != "TWD":
+        amount = f"{currency} {amount}"
+    parts = [
+        file_hash,
+        (invoice_no or "").strip().upper(),
+        amount,
+        (iso_date or "").strip(),
+    ]
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+
+class SubmissionLedger(_SqliteStore):
+    """收據送出紀錄，與流水號帳本共用同一個 SQLite 檔。"""
+
+    def lookup(self, fingerprints: list) -> dict:
+        """{指紋: {"status", "record_no", "updated_at", ...}}（只含有紀錄者）"""
+        found = {}
+        with closing(self._connect()) as conn:
+            conn.row_factory = sqlite3.Row
+            for fp in set(fingerprints):
+                row = conn.execute(
+                    "SELECT * FROM submissions WHERE fingerprint = ?", (fp,)).fetchone()
+                if row:
+                    found[fp] = dict(row)
+        return found
+
+    def mark_pending(self, receipts: list) -> None:
+        """開始填單前登記（已是 saved 的不會被降級）。"""
+        now = datetime.now().isoformat(timespec="seconds")
+        with self._transaction() as conn:
+            for r in receipts:
+                fp = r.get("_fingerprint")
+                if not fp:
+                    continue
+                conn.execute(
+                    "INSERT INTO submissions (fingerprint, status, source, vendor, amount, date, updated_at) "
+                    "VALUES (?, 'pending', ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(fingerprint) DO UPDATE SET updated_at = excluded.updated_at "
+                    "WHERE status != 'saved'",
+                    (fp, r.get("_source_image", ""), r.get("vendor", ""),
+                     str(r.get("amount", "")), r.get("date", ""), now))
+
+    def mark_saved(self, receipts: list, record_no: str = "") -> None:
+        """確認存入成功後登記請購單號。"""
+        now = datetime.now().isoformat(timespec="seconds")
+        with self._transaction() as conn:
+            for r in receipts:
+                fp = r.get("_fingerprint")
+                if not fp:
+                    continue
+                conn.execute(
+                    "INSERT INTO submissions (fingerprint, status, record_no, source, vendor, amount, date, updated_at) "
+                    "VALUES (?, 'saved', ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(fingerprint) DO UPDATE SET status = 'saved', "
+                    "record_no = excluded.record_no, updated_at = excluded.updated_at",
+                    (fp, record_no or "", r.get("_source_image", ""), r.get("vendor", ""),
+                     str(r.get("amount", "")), r.get("date", ""), now))
+
+    def forget(self, receipts_or_prefix) -> int:
+        """刪除 pending/saved 紀錄（確定沒存入、需重送時用），回傳刪除筆數。"""
+        with self._transaction() as conn:
+            if isinstance(receipts_or_prefix, str):
+                cur = conn.execute("DELETE FROM submissions WHERE fingerprint LIKE ?",
+                                   (receipts_or_prefix + "%",))
+                return cur.rowcount
+            n = 0
+            for r in receipts_or_prefix:
+                if r.get("_fingerprint"):
+                    n += conn.execute("DELETE FROM submissions WHERE fingerprint = ?",
+                                      (r["_fingerprint"],)).rowcount
+            return n
+
+    def rows(self) -> list:
+        with closing(self._connect()) as conn:
+            conn.row_factory = sqlite3.Row
+            return [dict(r) for r in conn.execute(
+                "SELECT * FROM submissions ORDER BY updated_at")]
+
+
+if __name__ == "__main__":
+    from config import LEDGER_DB, OUTPUT_DIR, RECEIPT_PREFIX
+
+    ledger = ReceiptLedger(LEDGER_DB)
+    if len(sys.argv) >= 2 and sys.argv[1] == "show":
+        for day, seq in ledger.counts().items():
+            print(f"  {day[:4]}/{day[4:6]}/{day[6:]}: 已發出至 {seq:02d}")
+    elif len(sys.argv) >= 2 and sys.argv[1] == "seed":
+        n = ledger.seed_from_records(OUTPUT_DIR, RECEIPT_PREFIX)
+        print(f"已從 {OUTPUT_DIR}/ 補登 {n} 天的流水號")
+    elif len(sys.argv) >= 4 and sys.argv[1] == "set":
+        ledger.set(sys.argv[2], int(sys.argv[3]))
+        print(f"{sys.argv[2]} 已用到 {int(sys.argv[3]):02d}")
+    elif len(sys.argv) >= 2 and sys.argv[1] == "submissions":
+        for row in SubmissionLedger(LEDGER_DB).rows():
+            print(f"  {row['fingerprint'][:12]}  {row['status']:<7} {row['record_no'] or '-':<14} "
+                  f"{row['date']} {row['vendor']} NT${row['amount']}  [{row['source']}]  {row['updated_at']}")
+    elif len(sys.argv) >= 3 and sys.argv[1] == "forget":
+        if len(sys.argv[2]) < 6:
+            print("指紋前綴至少 6 碼")
+            sys.exit(1)
+        n = SubmissionLedger(LEDGER_DB).forget(sys.argv[2])
+        print(f"已刪除 {n} 筆送出紀錄")
+    else:
+        print(__doc__)
+        sys.exit(1)
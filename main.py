@@ -6,65 +6,96 @@
     3. 顯示辨識摘要
     4. 使用者確認（一次確認全部）
     5. 選擇核銷類型（部門採購 / 計畫請購）
-    6. 合併所有收據 → 一份 receipt_data
-    7. 登入 → 導航 → 填品名 / 經費 / 受款人 → 驗證 → 存入
+    6. 規劃請購單（依規則檔分計畫/科目/月份，超過 APPP/APPA 列數上限時
+       自動拆成多張）→ 各自合併
+    7. 登入一次 → 逐張導航 → 填品名 / 經費 / 受款人 → 驗證 → 存入
+       （瀏覽器啟動與登入在步驟 2 OCR 進行時就先完成）
+
+各階段結果、OCR 結果與截圖存在 output/runs/<年>/<月>/<run-id>/（見 runstate.py、
+artifacts.py），中斷後可用 --resume <run-id> 從最後完成的階段接續，不需重新 OCR。
 """
 
 import argparse
-import os
 import sys
 import json
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date as date_cls
 from pathlib import Path
 
-from config import RECEIPTS_DIR, OUTPUT_DIR
-
-
-def _timed_input(prompt: str, timeout: int = 10, default: str = "") -> str:
-    """帶超時的 input()。超過 timeout 秒未輸入則自動回傳 default。"""
-    result = [default]
+from config import (
+    OUTPUT_DIR, MATCH_MODE, VENDOR_ALIASES_FILE,
+    FX_RATES_FILE, FX_RECONCILE_FILE, FX_CARD_FEE_RATE, FX_MAX_RATE_AGE_DAYS,
+    APPP_MAX_ROWS, BATCH_RULES_FILE, LEDGER_DB, RECEIPT_PREFIX, RUNS_DIR,
+    POLICY_FILE, PROFILES_DIR, METRICS_FILE,
+)
 
-    def _ask():
-        try:
-            result[0] = input(prompt)
-        except EOFError:
-            result[0] = default
-
-    t = threading.Thread(target=_ask, daemon=True)
-    t.start()
-    t.join(timeout)
-    if t.is_alive():
-        print(f"\n    (超過 {timeout} 秒未選擇，自動使用預設值)")
-        return default
-    return result[0]
 from ocr import extract_multiple_receipts, extract_receipt_data
 from form_filler import (
-    start_browser, login, navigate_to_expense_form, fill_expense_form,
-    _is_tax_item,
+    navigate_to_expense_form, fill_expense_form, BrowserSession,
+    _is_tax_item, _sanitize_receipt_no,
+)
+from matcher import (
+    TransactionIndex, IncrementalMatcher, MATCH_THRESHOLD, assign_optimal, vendor_points,
 )
+from vendors import VendorIndex, learned_alias_table, load_learned_aliases, remember_aliases
+from fx_rates import RateTable, provisional_twd, add_pending
+from planner import BatchRules, group_receipts, show_plan_table
+from ledger import ReceiptLedger, SubmissionLedger, file_sha256, receipt_fingerprint
+from runstate import RunState
+from records import Item, Receipt, normalize_currency, parse_day, to_cents
+import artifacts
+import events
+import metrics
+import policy
+import profiles
+import profiling
+from policy import Policy
 
 SUPPORTED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif", ".tiff", ".pdf"}
 
-# ── 收據流水號追蹤（每天重新從 01 開始）────────────
-_receipt_counter: dict = {}  # key: "YYYYMMDD" → next_seq
+# ── 收據流水號（每天重新從 01 開始，由 SQLite 帳本跨執行配發）────
+_receipt_counter: dict = {}  # key: "YYYYMMDD" → 本次執行發出的張數
+_ledgers: dict = {}          # 帳本路徑 → ReceiptLedger（每位使用者一本，見 profiles.py）
 
 
-def get_next_receipt_seq(iso_date: str) -> int:
+def _get_ledger() -> ReceiptLedger:
+    """
+    開啟目前使用者的流水號帳本；預設使用者的帳本第一次建立時
+    從 output/ 既有紀錄補登已用過的流水號。
+    """
+    user = profiles.current()
+    ledger = _ledgers.get(user.ledger_db)
+    if ledger is None:
+        ledger = _ledgers[user.ledger_db] = ReceiptLedger(user.ledger_db)
+        if user.ledger_db == LEDGER_DB and ledger.is_empty():
+            days = ledger.seed_from_records(OUTPUT_DIR, RECEIPT_PREFIX)
+            if days:
+                print(f"  [INFO] 流水號帳本已從 {OUTPUT_DIR}/ 既有紀錄補登 {days} 天")
+    return ledger
+
+
+def get_next_receipt_seq(iso_date: str, count: int = 1) -> int:
     """
     取得某日的下一個收據流水號。
     同天第 1 張=1、第 2 張=2，隔天重新從 1 開始。
+
+    流水號記錄在 SQLite 帳本（目前使用者的 ledger_db），同一天多次執行或
+    多個程序同時執行都不會重複。count > 1 時一次保留連續 count 個號碼
+    （一張請購單含多張收據時用），回傳第一個號碼。
     """
     key = iso_date.replace("-", "")[:8]  # "20260226"
-    _receipt_counter[key] = _receipt_counter.get(key, 0) + 1
-    return _receipt_counter[key]
+    first = _get_ledger().reserve(iso_date, count)
+    _receipt_counter[key] = _receipt_counter.get(key, 0) + max(1, count)
+    return first
 
 
 def get_receipt_files() -> list:
-    """取得 receipts/ 目錄中所有支援的收據檔案（圖片 + PDF）。"""
-    receipts_dir = Path(RECEIPTS_DIR)
+    """取得目前使用者 receipts/ 目錄中所有支援的收據檔案（圖片 + PDF）。"""
+    receipts_dir = Path(profiles.current().receipts_dir)
     if not receipts_dir.exists():
-        print(f"找不到目錄: {RECEIPTS_DIR}")
+        print(f"找不到目錄: {receipts_dir}")
         return []
     files = [
         f for f in sorted(receipts_dir.iterdir())
@@ -73,23 +104,30 @@ def get_receipt_files() -> list:
     return files
 
 
-def choose_plan(preset: str = "") -> tuple:
+def choose_plan(preset: str = "", mode: str = "") -> tuple:
     """
     讓使用者選擇核銷類型（部門採購或計畫請購）。
     實際計畫名稱（BUGETNO）會在登入後從系統下拉選單中選擇。
 
+    Args:
+        preset: 計畫關鍵字（--plan 或政策檔 plan），指定時直接走計畫請購
+        mode:   政策檔 mode（"project" / "department"），指定時不詢問
+
     Returns:
         (計畫關鍵字, 需要計畫請購 bool)
     """
     if preset:
         print(f"使用計畫關鍵字: {preset} (計畫請購路徑)")
         return preset, True
+    if mode:
+        print(f"核銷類型: {'計畫請購' if mode == 'project' else '部門採購'}（政策檔）")
+        return "", mode == "project"
 
     print("\n請選擇核銷類型：")
     print("  1. 部門採購（高教深耕等部門經費）")
     print("  2. 計畫請購（國科會 / 產學 / 教育部等計畫）")
 
-    choice = _timed_input("> ", timeout=10, default="2").strip()
+    choice = policy.current().ask("plan_type", "> ", timeout=10, default="2").strip()
 
     if choice == "2":
         print("  → 計畫請購（進入系統後請從下拉選單選擇計畫）")
@@ -133,26 +171,30 @@ def _validate_ocr_result(receipt: dict) -> bool:
     return (amt > 0 or has_priced_items) and (has_vendor or has_priced_items)
 
 
-def ocr_all_files(files: list, max_retries: int = 3) -> list:
+def iter_ocr_files(files: list, max_retries: int = 3, stop=None):
     """
-    OCR 所有檔案（圖片/PDF），每個檔案可能包含多張收據。
-    回傳所有收據的 flat list，每筆附加 _source_file 欄位。
+    逐一 OCR 檔案（圖片/PDF），每辨識完一個檔案就 yield (檔案, 收據列表)，
+    呼叫端不必等全部檔案辨識完才看到結果。每筆收據附加 _source_image 欄位；
+    完全失敗的檔案 yield 空列表。
 
     若 OCR 失敗或結果無效，會自動重試（最多 max_retries 次）。
     多張模式失敗時，會嘗試單張模式作為備案。
+    stop（threading.Event）被設定後不再辨識其餘檔案。
     """
-    all_receipts = []
     for f in files:
+        if stop is not None and stop.is_set():
+            return
         ext = f.suffix.lower()
         file_type = "PDF" if ext == ".pdf" else "圖片"
-        print(f"  辨識中: {f.name} ({file_type}) ...")
+        events.info(f"  辨識中: {f.name} ({file_type}) ...", file=f.name)
 
         receipts = None
 
         # ── 多張辨識模式（含重試）──
         for attempt in range(1, max_retries + 1):
             try:
-                result = extract_multiple_receipts(str(f))
+                with profiling.span("api", file=f.name, mode="multi", attempt=attempt):
+                    result = extract_multiple_receipts(str(f))
                 # 驗證結果
                 valid = [r for r in result if _validate_ocr_result(r)]
                 invalid_count = len(result) - len(valid)
@@ -160,13 +202,14 @@ def ocr_all_files(files: list, max_retries: int = 3) -> list:
                 if valid:
                     receipts = valid
                     if invalid_count > 0:
-                        print(f"    (第{attempt}次) 辨識到 {len(result)} 筆，"
-                              f"其中 {invalid_count} 筆無效已略過")
+                        events.warn(f"    (第{attempt}次) 辨識到 {len(result)} 筆，"
+                                    f"其中 {invalid_count} 筆無效已略過", file=f.name)
                     break
                 else:
-                    print(f"    (第{attempt}次) 辨識結果無效（amount=0 或無品項），重試...")
+                    events.warn(f"    (第{attempt}次) 辨識結果無效（amount=0 或無品項），重試...",
+                                file=f.name, attempt=attempt)
             except Exception as e:
-                print(f"    (第{attempt}次) OCR 錯誤: {e}")
+                events.warn(f"    (第{attempt}次) OCR 錯誤: {e}", file=f.name, attempt=attempt)
 
             if attempt < max_retries:
                 import time as _time
@@ -174,18 +217,20 @@ def ocr_all_files(files: list, max_retries: int = 3) -> list:
 
         # ── 備案：單張辨識模式 ──
         if not receipts:
-            print(f"    多張模式失敗，嘗試單張辨識模式...")
+            events.warn(f"    多張模式失敗，嘗試單張辨識模式...", file=f.name)
             for attempt in range(1, max_retries + 1):
                 try:
-                    single = extract_receipt_data(str(f))
+                    with profiling.span("api", file=f.name, mode="single", attempt=attempt):
+                        single = extract_receipt_data(str(f))
                     if _validate_ocr_result(single):
                         receipts = [single]
-                        print(f"    單張模式成功！")
+                        events.info(f"    單張模式成功！", file=f.name)
                         break
                     else:
-                        print(f"    (單張第{attempt}次) 結果無效，重試...")
+                        events.warn(f"    (單張第{attempt}次) 結果無效，重試...",
+                                    file=f.name, attempt=attempt)
                 except Exception as e:
-                    print(f"    (單張第{attempt}次) 錯誤: {e}")
+                    events.warn(f"    (單張第{attempt}次) 錯誤: {e}", file=f.name, attempt=attempt)
 
                 if attempt < max_retries:
                     import time as _time
@@ -195,53 +240,189 @@ def ocr_all_files(files: list, max_retries: int = 3) -> list:
         if receipts:
             n = len(receipts)
             label = "" if n == 1 else f"（含 {n} 張收據）"
-            print(f"    -> 完成{label}")
+            events.info(f"    -> 完成{label}", file=f.name, receipts=n)
             for r in receipts:
                 r["_source_image"] = f.name   # 保持欄位名稱相容
-            all_receipts.extend(receipts)
         else:
-            print(f"    [ERROR] {f.name} OCR 完全失敗（重試 {max_retries} 次仍無有效結果）")
-            print(f"    請檢查該檔案是否損毀，或嘗試重新擷取/拍照")
+            events.error(f"    [ERROR] {f.name} OCR 完全失敗（重試 {max_retries} 次仍無有效結果）",
+                         file=f.name)
+            events.error(f"    請檢查該檔案是否損毀，或嘗試重新擷取/拍照")
+        yield f, receipts or []
+
+
+@profiling.timed("ocr")
+def ocr_all_files(files: list, max_retries: int = 3) -> list:
+    """
+    OCR 所有檔案（圖片/PDF），每個檔案可能包含多張收據。
+    回傳所有收據的 flat list，每筆附加 _source_image 欄位。
+    """
+    all_receipts = []
+    for _, receipts in iter_ocr_files(files, max_retries=max_retries):
+        all_receipts.extend(receipts)
+    return all_receipts
 
+
+def check_ocr_receipt(doc: dict) -> list:
+    """
+    單張 OCR 結果辨識完立即做的檢查（不需等其他收據或刷卡紀錄）。
+
+    Returns:
+        list[str]: 警告訊息（空列表表示沒有發現問題）
+    """
+    if doc.get("doc_type") == "credit_card_statement":
+        return []
+    r = Receipt.from_dict(doc)
+    warnings = []
+    if not r.iso_date:
+        warnings.append(f"日期無法辨識（{doc.get('date') or '空白'}）")
+    regular = sum(i.total_cents for i in r.items if not _is_tax_item(i.name))
+    if r.items and regular > r.amount_cents:
+        warnings.append(f"品項合計 {regular / 100:g} 大於收據金額 {r.amount_cents / 100:g}")
+    else:
+        # 稅額處理後仍需補差額（不是營業稅）→ 可能漏辨識品項或金額錯誤
+        for item in _process_receipt_tax(r):
+            if item.name == "其他差額" and item.spec != "稅額":
+                warnings.append(f"品項合計 {regular / 100:g} 少於收據金額 "
+                                f"{r.amount_cents / 100:g}，將補「其他差額」{item.total_cents / 100:g}")
+    return warnings
+
+
+@profiling.timed("ocr")
+def ocr_with_feedback(files: list, stop=None, matcher: IncrementalMatcher = None) -> list:
+    """
+    OCR 所有檔案，每張收據辨識完就印出摘要並檢查（check_ocr_receipt），
+    有警告時詢問是否中止，讓操作者先修正該檔案，不必等整批辨識完。
+    選擇中止時設定 stop，回傳已辨識的結果。
+    matcher 不為 None 時同時做外幣收據 ↔ 刷卡紀錄的增量比對，配對成立即印出。
+    """
+    all_receipts = []
+    for f, receipts in iter_ocr_files(files, stop=stop):
+        for r in receipts:
+            all_receipts.append(r)
+            warnings = []
+            if r.get("doc_type") == "credit_card_statement":
+                n = len(r.get("items") or [])
+                events.info(f"      [{len(all_receipts)}] 刷卡紀錄（{n} 筆交易）", file=f.name)
+            else:
+                events.info(f"      [{len(all_receipts)}] {r.get('vendor') or '?'}  {r.get('date') or '?'}"
+                            f"  {r.get('currency') or 'TWD'} {r.get('amount', 0)}"
+                            f"（{len(r.get('items') or [])} 個品項）", file=f.name)
+                warnings = check_ocr_receipt(r)
+                for w in warnings:
+                    events.warn(f"          [WARN] {w}", file=f.name)
+            for event in (matcher.add(r) if matcher is not None else ()):
+                events.info(f"          ✓ 比對: {event.receipt.get('vendor', '?')} "
+                            f"{event.receipt.get('currency', '?')} "
+                            f"{event.receipt.get('original_amount', event.receipt.get('amount', 0))}"
+                            f" ↔ {event.txn.name} NT${event.txn.twd_cents // 100}"
+                            f" (分數: {event.score})", file=f.name, score=event.score)
+            if warnings and stop is not None and not stop.is_set():
+                answer = policy.current().ask(
+                    "ocr_abort", "          是否中止辨識，先修正這張？(y/n, 10秒後自動n): ",
+                    timeout=10, default="n")
+                if answer.strip().lower() == "y":
+                    stop.set()
     return all_receipts
 
 
+def save_ocr_results(docs: list) -> None:
+    """將各張 OCR 結果存為 <產出目錄>/<來源檔名>[_n]_ocr.json（產出目錄見 artifacts.py）。"""
+    saved_stems = {}
+    for r in docs:
+        src = r.get("_source_image", "receipt")
+        stem = Path(src).stem
+        # 同一張圖片可能有多張收據，加序號區分
+        saved_stems[stem] = saved_stems.get(stem, 0) + 1
+        suffix = f"_{saved_stems[stem]}" if saved_stems[stem] > 1 else ""
+        out = artifacts.path(f"{stem}{suffix}_ocr.json")
+        with open(out, "w", encoding="utf-8") as f:
+            json.dump(r, f, ensure_ascii=False, indent=2)
+
+
+def load_saved_ocr(paths: list) -> tuple:
+    """
+    讀取保存的 OCR 結果（--from-json，通常是某次執行的目錄），不呼叫 Gemini。
+
+    paths 可為檔案或目錄；目錄只讀取單張結果 *_ocr.json（不含 *_merged_ocr.json，
+    避免同一張收據被讀兩次）。單張結果與合併檔不可混用。
+
+    Returns:
+        (單張 OCR 結果列表, 合併後 receipt_data 列表, 來源檔名列表)
+        兩個列表只會有一個非空；讀取失敗時結束程式。
+    """
+    files = []
+    for p in map(Path, paths):
+        if p.is_dir():
+            files.extend(f for f in sorted(p.glob("*_ocr.json"))
+                         if not f.name.endswith("_merged_ocr.json"))
+        elif p.is_file():
+            files.append(p)
+        else:
+            print(f"[ERROR] 找不到 {p}")
+            sys.exit(1)
+    if not files:
+        print(f"[ERROR] {', '.join(map(str, paths))} 中沒有 *_ocr.json")
+        sys.exit(1)
+
+    docs, merged = [], []
+    for f in files:
+        try:
+            with open(f, "r", encoding="utf-8") as fp:
+                data = json.load(fp)
+        except (OSError, ValueError) as e:
+            print(f"[ERROR] 無法讀取 {f}: {e}")
+            sys.exit(1)
+        entries = data if isinstance(data, list) else [data]
+        if not all(isinstance(d, dict) for d in entries):
+            print(f"[ERROR] {f} 不是 OCR 結果（應為物件或物件陣列）")
+            sys.exit(1)
+        if f.name.endswith("_merged_ocr.json"):
+            for d in entries:
+                # 流水號在填單時重新配發
+                d.pop("_receipt_seq", None)
+                d.pop("_receipt_seq_count", None)
+                d.pop("_receipt_seqs", None)
+            merged.extend(entries)
+        else:
+            for d in entries:
+                d.setdefault("_source_image", f.name[:-len("_ocr.json")] or f.name)
+            docs.extend(entries)
+    if docs and merged:
+        print("[ERROR] --from-json 不能同時指定單張 OCR 結果與合併檔（*_merged_ocr.json）")
+        sys.exit(1)
+
+    names = []
+    for d in docs or [r for m in merged for r in (m.get("_receipts") or [m])]:
+        src = d.get("_source_image", "")
+        if src and src not in names:
+            names.append(src)
+    return docs, merged, names
+
+
 def show_ocr_summary(receipts: list) -> None:
-    """在終端顯示所有辨識到的收據摘要供使用者確認。"""
+    """在終端顯示所有辨識到的收據（Receipt）摘要供使用者確認。"""
     print(f"\n共辨識到 {len(receipts)} 張收據，將合併為一張請購單：")
     print(f"{'─'*50}")
     grand_total = 0
     for i, r in enumerate(receipts, 1):
-        try:
-            amt = int(float(r.get("amount", 0)))
-        except (ValueError, TypeError):
-            amt = 0
+        amt = r.amount_cents // 100
         grand_total += amt
-        src = r.get("_source_image", "")
-        src_label = f" [{src}]" if src else ""
-        inv = r.get("invoice_no", "")
-        inv_label = f" 發票:{inv}" if inv else " (收據)"
-        currency = r.get("currency", "TWD")
+        src_label = f" [{r.source}]" if r.source else ""
+        inv_label = f" 發票:{r.invoice_no}" if r.invoice_no else " (收據)"
         currency_label = ""
-        if currency != "TWD":
-            orig_amt = r.get("original_amount", "")
-            currency_label = f"  [原幣: {currency} {orig_amt}]"
-            if r.get("_matched_twd"):
-                currency_label += f" → 刷卡台幣: NT${r['_matched_twd']}"
+        if r.currency != "TWD":
+            currency_label = f"  [原幣: {r.currency} {r.original_cents / 100:g}]"
+            if r.extra.get("_matched_twd"):
+                currency_label += f" → 刷卡台幣: NT${r.extra['_matched_twd']}"
+            elif r.extra.get("_provisional_twd"):
+                currency_label += (f" → 暫定台幣: NT${r.extra['_provisional_twd']}"
+                                   f" (匯率 {r.extra.get('_fx_rate')}，待對帳)")
         print(f"  [{i}]{src_label}")
-        print(f"      廠商: {r.get('vendor', '?')}  日期: {r.get('date', '?')}"
+        print(f"      廠商: {r.vendor or '?'}  日期: {r.iso_date or '?'}"
               f"  金額: NT${amt}{inv_label}{currency_label}")
-        items = r.get("items", [])
-        if items:
-            for item in items:
-                try:
-                    qty = int(float(item.get("quantity", 1)))
-                    price = int(float(item.get("price", 0)))
-                    subtotal = qty * price
-                except (ValueError, TypeError):
-                    qty, price, subtotal = 1, 0, 0
-                print(f"      - {item.get('name', '?')} x{qty} "
-                      f"= NT${subtotal}")
+        for item in r.items:
+            print(f"      - {item.name or '?'} x{item.quantity} "
+                  f"= NT${item.total_cents // 100}")
     print(f"{'─'*50}")
     print(f"  合計總金額: NT${grand_total}")
 
@@ -250,7 +431,19 @@ def show_ocr_summary(receipts: list) -> None:
 #  外幣收據 ↔ 信用卡刷卡紀錄交叉比對
 # ════════════════════════════════════════════════════════════
 
-def match_foreign_receipts_to_statements(all_docs: list) -> list:
+def _match_aliases() -> dict:
+    """廠商別名：AI 服務品名表 + 過去成功比對學到的「刷卡名稱 ↔ 收據廠商」。"""
+    aliases = dict(_AI_SERVICE_NAMES)
+    try:
+        aliases.update(learned_alias_table(load_learned_aliases(VENDOR_ALIASES_FILE)))
+    except ValueError as e:
+        events.warn(f"  [WARN] 學到的廠商別名無法讀取，本次不使用: {e}")
+    return aliases
+
+
+def match_foreign_receipts_to_statements(all_docs: list,
+                                         mode: str = MATCH_MODE,
+                                         matcher: IncrementalMatcher = None) -> list:
     """
     將外幣收據與信用卡刷卡紀錄進行交叉比對。
 
@@ -258,10 +451,15 @@ def match_foreign_receipts_to_statements(all_docs: list) -> list:
     1. 從 all_docs 中區分出 receipts 和 credit_card_statements
     2. 對每張外幣收據，在刷卡紀錄的交易明細中搜尋匹配項
     3. 匹配依據：日期相近（±7天）+ 原幣金額吻合 + 廠商名稱模糊匹配
+       （交易先建立索引，只對原幣金額吻合或日期相近的候選評分，見 matcher.py）
     4. 匹配成功 → 用刷卡紀錄的台幣金額覆蓋收據的 amount
 
     Args:
         all_docs: OCR 辨識後的全部文件列表（含收據與刷卡紀錄）
+        mode:     "optimal"=全域最佳指派（結果與檔案順序無關，需 numpy/scipy）
+                  "greedy" =逐張比對，先比對的收據優先取得交易
+        matcher:  OCR 期間已餵入 all_docs 的 IncrementalMatcher；沿用其交易索引，
+                  greedy 模式直接採用其配對結果
 
     Returns:
         list: 僅包含收據的列表（不含刷卡紀錄本身），外幣收據已替換為台幣金額
@@ -277,27 +475,30 @@ def match_foreign_receipts_to_statements(all_docs: list) -> list:
             receipts.append(doc)
 
     if statements:
-        print(f"\n  找到 {len(statements)} 張信用卡刷卡紀錄，開始交叉比對...")
-
-    # 彙整所有刷卡紀錄中的交易明細
-    all_transactions = []
-    for stmt in statements:
-        stmt_items = stmt.get("items", [])
-        for item in stmt_items:
-            all_transactions.append({
-                "name": item.get("name", ""),
-                "twd_amount": item.get("price", 0),
-                "original_currency": item.get("original_currency", ""),
-                "original_price": item.get("original_price", 0),
-                "date": stmt.get("date", ""),
-                "_used": False,
-            })
-
-    # 對每張外幣收據嘗試比對
-    for receipt in receipts:
+        events.info(f"\n  找到 {len(statements)} 張信用卡刷卡紀錄，開始交叉比對...")
+
+    # 彙整所有刷卡紀錄中的交易明細（建立索引，日期只解析一次）
+    if matcher is not None:
+        index = matcher.index
+    else:
+        index = TransactionIndex(statements, aliases=_match_aliases())
+    foreign = [r for r in receipts if r.get("currency", "TWD") != "TWD"]
+
+    # 全域最佳指派：一次算出所有收據的匹配
+    assigned = None
+    if mode == "optimal" and foreign and len(index):
+        try:
+            assigned = assign_optimal(index, foreign)
+        except ImportError as e:
+            events.warn(f"    [WARN] 最佳指派需要 numpy/scipy（{e}），改用逐張比對")
+    if assigned is None and matcher is not None:
+        # 辨識期間已逐張比對完成（索引中的交易已標記使用）
+        assigned = [matcher.result(r) for r in foreign]
+
+    # 對每張外幣收據套用比對結果；廠商名稱也相符的配對才學成別名（執行結束前寫入一次）
+    learned = {}
+    for pos, receipt in enumerate(foreign):
         currency = receipt.get("currency", "TWD")
-        if currency == "TWD":
-            continue  # 國內發票不需要比對
 
         orig_amount = receipt.get("original_amount", receipt.get("amount", 0))
         try:
@@ -305,78 +506,38 @@ def match_foreign_receipts_to_statements(all_docs: list) -> list:
         except (ValueError, TypeError):
             orig_amount = 0
 
-        vendor = receipt.get("vendor", "").lower()
-        receipt_date = receipt.get("date", "")
-
-        best_match = None
-        best_score = 0
-
-        for txn in all_transactions:
-            if txn["_used"]:
-                continue
-
-            score = 0
-
-            # 廠商名稱模糊比對（部分匹配即可）
-            txn_name = txn["name"].lower()
-            if vendor and txn_name:
-                # 檢查任一方是否包含另一方的關鍵部分
-                vendor_words = [w for w in vendor.split() if len(w) > 2]
-                for word in vendor_words:
-                    if word in txn_name:
-                        score += 3
-                        break
-                if any(w in vendor for w in txn_name.split() if len(w) > 2):
-                    score += 3
-
-            # 原幣金額比對
-            txn_orig = float(txn.get("original_price", 0) or 0)
-            if txn_orig > 0 and abs(txn_orig - orig_amount) < 0.01:
-                score += 5  # 原幣金額完全吻合 → 強匹配
-            elif txn.get("original_currency", "").upper() == currency.upper():
-                score += 1  # 至少幣別相同
-
-            # 日期相近度（刷卡因時區差異可能前後差 1 天）
-            if receipt_date and txn["date"]:
-                try:
-                    from datetime import datetime
-                    r_date = datetime.strptime(receipt_date, "%Y-%m-%d")
-                    t_date = datetime.strptime(txn["date"], "%Y-%m-%d")
-                    day_diff = abs((r_date - t_date).days)
-                    if day_diff <= 1:
-                        score += 3  # ±1天：高度吻合（時區差異）
-                    elif day_diff <= 3:
-                        score += 2
-                    elif day_diff <= 7:
-                        score += 1
-                except (ValueError, TypeError):
-                    pass
-
-            if score > best_score:
-                best_score = score
-                best_match = txn
+        if assigned is not None:
+            best_match, best_score = assigned[pos]
+        else:
+            # 逐張比對（只對索引中的候選交易評分）
+            best_match, best_score = index.best_match(receipt)
 
         # 判斷是否達到可信的匹配門檻
-        if best_match and best_score >= 5:
-            try:
-                twd_amount = int(float(best_match["twd_amount"]))
-            except (ValueError, TypeError):
-                twd_amount = 0
-
+        if best_match and best_score >= MATCH_THRESHOLD:
+            twd_amount = best_match.twd_cents // 100
             if twd_amount > 0:
-                best_match["_used"] = True
+                best_match.used = True
+                if vendor_points(index.key(receipt), best_match) > 0:
+                    learned[best_match.name] = receipt.get("vendor", "")
                 receipt["_matched_twd"] = twd_amount
                 receipt["amount"] = twd_amount
                 receipt["_original_currency"] = currency
                 receipt["_original_amount"] = orig_amount
-                print(f"    ✓ {receipt.get('vendor', '?')} {currency} {orig_amount}"
-                      f" → 刷卡台幣 NT${twd_amount} (匹配分數: {best_score})")
+                events.info(f"    ✓ {receipt.get('vendor', '?')} {currency} {orig_amount}"
+                            f" → 刷卡台幣 NT${twd_amount} (匹配分數: {best_score})",
+                            vendor=receipt.get("vendor", ""), twd=twd_amount, score=best_score)
             else:
-                print(f"    ✗ {receipt.get('vendor', '?')} 匹配到但台幣金額無效")
-        elif currency != "TWD":
-            print(f"    ⚠ {receipt.get('vendor', '?')} {currency} {orig_amount}"
-                  f" → 未找到匹配的刷卡紀錄 (最高分數: {best_score})")
-            print(f"      請手動確認台幣金額！")
+                events.warn(f"    ✗ {receipt.get('vendor', '?')} 匹配到但台幣金額無效")
+        else:
+            events.warn(f"    ⚠ {receipt.get('vendor', '?')} {currency} {orig_amount}"
+                        f" → 未找到匹配的刷卡紀錄 (最高分數: {best_score})",
+                        vendor=receipt.get("vendor", ""), score=best_score)
+            events.warn(f"      請手動確認台幣金額！")
+
+    try:
+        remember_aliases(VENDOR_ALIASES_FILE, learned)
+    except ValueError as e:
+        events.warn(f"    [WARN] 學到的廠商別名檔損毀，未更新（請修正 {VENDOR_ALIASES_FILE}）: {e}")
 
     return receipts
 
@@ -400,28 +561,38 @@ _AI_SERVICE_NAMES = {
 }
 
 
+# 預先建好的名稱索引（"GOOGLE*CLOUD"、"ANTHROPIC* CLAUDE.AI" 等寫法都能對應）
+_AI_SERVICE_INDEX = VendorIndex.from_aliases(_AI_SERVICE_NAMES)
+
+
 def _get_ai_service_name(vendor: str) -> str:
     """根據廠商名稱，回傳標準化的 AI 服務品名。找不到則回傳 None。"""
-    v_lower = vendor.lower()
-    for keyword, name in _AI_SERVICE_NAMES.items():
-        if keyword in v_lower:
-            return name
-    return None
+    name, _similarity = _AI_SERVICE_INDEX.best(vendor or "")
+    return name
 
 
-def normalize_foreign_receipts(receipts: list) -> list:
+def normalize_foreign_receipts(receipts: list, rates: RateTable = None,
+                               confirm_unmatched: bool = True) -> list:
     """
     正規化外幣收據：
     1. AI 服務品名標準化（Google→Google Gemini AI服務費 等）
     2. 外幣收據清空 invoice_no（用收據流水號取代，避免格式不符導致存入失敗）
-    3. 檢查外幣收據是否有台幣金額（未匹配到刷卡紀錄時暫停警告）
+    3. 未匹配到刷卡紀錄 → 以本地匯率表估算暫定台幣金額，標記待對帳
+       （確認存入後才列入待對帳清單，見 _record_reconcile）
+    4. 仍無台幣金額（查無匯率）時暫停警告
 
     應在 match_foreign_receipts_to_statements() 之後呼叫。
+
+    Args:
+        receipts: 收據列表
+        rates:    本地匯率表（fx_rates.RateTable），None 表示不使用
+        confirm_unmatched: 有未匹配的外幣收據時詢問是否繼續；
+                  False 時只警告（watcher.py 會把這些收據留到刷卡紀錄進來）
     """
     has_unmatched_foreign = False
 
     for receipt in receipts:
-        currency = receipt.get("currency", "TWD")
+        currency = normalize_currency(receipt.get("currency") or "TWD")
         vendor = receipt.get("vendor", "")
 
         if currency == "TWD":
@@ -433,7 +604,7 @@ def normalize_foreign_receipts(receipts: list) -> list:
                     old_name = item.get("name", "")
                     if not _is_tax_item(old_name):
                         item["name"] = ai_name
-                print(f"    [AI品名] {vendor} → 品項統一為 '{ai_name}'")
+                events.info(f"    [AI品名] {vendor} → 品項統一為 '{ai_name}'")
             continue
 
         # ── 外幣收據處理 ──
@@ -446,18 +617,42 @@ def normalize_foreign_receipts(receipts: list) -> list:
                 old_name = item.get("name", "")
                 if not _is_tax_item(old_name):
                     item["name"] = ai_name
-            print(f"    [AI品名] {vendor} → 品項統一為 '{ai_name}'")
+            events.info(f"    [AI品名] {vendor} → 品項統一為 '{ai_name}'")
 
         # (2) 清空 invoice_no（外幣收據格式不符學校系統，改用收據流水號）
         if receipt.get("invoice_no"):
-            print(f"    [發票號] {vendor}: 清除外幣 invoice '{receipt['invoice_no']}' → 改用收據流水號")
+            events.info(f"    [發票號] {vendor}: 清除外幣 invoice '{receipt['invoice_no']}' → 改用收據流水號")
             receipt["invoice_no"] = ""
 
-        # (3) 外幣收據已匹配台幣 → 將所有品項合併為一筆（台幣金額）
+        # (2.5) 未匹配刷卡紀錄 → 用本地匯率表估算暫定台幣金額（之後需對帳）
+        if not receipt.get("_matched_twd") and rates is not None:
+            try:
+                orig_amt = float(receipt.get("original_amount", receipt.get("amount", 0)))
+            except (ValueError, TypeError):
+                orig_amt = 0
+            rate, rate_date = rates.lookup(currency, receipt.get("date", ""),
+                                           max_age_days=FX_MAX_RATE_AGE_DAYS)
+            if rate and orig_amt > 0:
+                twd = provisional_twd(orig_amt, rate, FX_CARD_FEE_RATE)
+                receipt["_provisional_twd"] = twd
+                receipt["_needs_reconcile"] = True
+                receipt["_fx_rate"] = rate
+                receipt["_fx_rate_date"] = rate_date
+                receipt["_original_currency"] = currency
+                receipt["_original_amount"] = orig_amt
+                receipt["amount"] = twd
+                events.info(f"    [暫定匯率] {vendor}: {currency} {orig_amt} × {rate} ({rate_date})"
+                            f" → 暫定 NT${twd}（確認存入後列入待對帳清單）",
+                            vendor=vendor, fx_rate=rate, provisional_twd=twd)
+            elif orig_amt > 0 and not parse_day(receipt.get("date")):
+                events.warn(f"    [WARN] {vendor}: 收據日期無法辨識（{receipt.get('date')!r}），"
+                            f"不估算暫定匯率")
+
+        # (3) 外幣收據已有台幣金額（刷卡或暫定匯率）→ 將所有品項合併為一筆
         #     原因：OCR 品項價格是外幣原價，直接進入稅額處理會產生錯誤的「其他差額」
         #     例：Claude USD$5 → 刷卡 NT$158 → 應合併為「Claude AI服務費 158」
-        if receipt.get("_matched_twd"):
-            twd_amount = receipt["_matched_twd"]
+        twd_amount = receipt.get("_matched_twd") or receipt.get("_provisional_twd")
+        if twd_amount:
             items = receipt.get("items", [])
             # 找主品名：AI 服務標準名 > 第一個非稅品項名 > 廠商名
             main_name = ai_name
@@ -483,31 +678,33 @@ def normalize_foreign_receipts(receipts: list) -> list:
             if main_spec:
                 consolidated["spec"] = main_spec
             receipt["items"] = [consolidated]
-            print(f"    [外幣合併] {vendor}: 合併為 '{main_name}' NT${twd_amount}")
+            events.info(f"    [外幣合併] {vendor}: 合併為 '{main_name}' NT${twd_amount}")
 
         # (4) 檢查是否有台幣金額
-        if not receipt.get("_matched_twd"):
+        if not twd_amount:
             has_unmatched_foreign = True
             orig_amt = receipt.get("original_amount", receipt.get("amount", "?"))
-            print(f"\n    *** 警告: {vendor} 為外幣收據 ({currency} {orig_amt}) ***")
-            print(f"    *** 未找到對應的刷卡紀錄，目前金額 NT${receipt.get('amount', 0)} 可能不正確！ ***")
-            print(f"    *** 建議: 將信用卡帳單圖片/PDF 一併放入 receipts/ 目錄重新辨識 ***")
+            events.warn(f"\n    *** 警告: {vendor} 為外幣收據 ({currency} {orig_amt}) ***")
+            events.warn(f"    *** 未找到對應的刷卡紀錄，目前金額 NT${receipt.get('amount', 0)} 可能不正確！ ***")
+            events.warn(f"    *** 建議: 將信用卡帳單圖片/PDF 一併放入 receipts/ 目錄重新辨識 ***")
 
-    if has_unmatched_foreign:
+    if has_unmatched_foreign and confirm_unmatched:
         print(f"\n  ──────────────────────────────────────────────")
         print(f"  有外幣收據尚未匹配到刷卡紀錄！")
         print(f"  請確認以下任一方式提供台幣金額：")
         print(f"    1. 將信用卡月結單/刷卡明細的圖片或 PDF 放入 receipts/ 目錄")
-        print(f"    2. 手動修改 output/ 中的 OCR JSON 檔，將 amount 改為台幣金額")
+        print(f"    2. 手動修改 {artifacts.directory()}/ 中的 OCR JSON 檔，將 amount 改為台幣金額")
+        print(f"    3. 匯入匯率表: python fx_rates.py import <匯率.csv>")
         print(f"  ──────────────────────────────────────────────")
 
-        user_continue = _timed_input(
+        user_continue = policy.current().ask(
+            "unmatched_foreign",
             "\n  外幣收據金額可能有誤，是否仍要繼續？(y/n, 15秒後自動取消): ",
             timeout=15, default="n"
         ).strip().lower()
         if user_continue != "y":
             print("  已取消。請加入刷卡紀錄後重新執行。")
-            sys.exit(0)
+            sys.exit(2 if policy.current().unattended else 0)
 
     return receipts
 
@@ -516,7 +713,7 @@ def normalize_foreign_receipts(receipts: list) -> list:
 #  每張收據的稅額預處理
 # ════════════════════════════════════════════════════════════
 
-def _process_receipt_tax(receipt: dict) -> list:
+def _process_receipt_tax(receipt: Receipt) -> list:
     """
     針對單張收據做稅額智慧處理，回傳處理後的品項列表。
 
@@ -530,65 +727,38 @@ def _process_receipt_tax(receipt: dict) -> list:
       Case C: 無稅額 → 直接使用品項
 
     Returns:
-        處理後的品項列表，每筆格式: {"name", "quantity", "price", "spec"(可選)}
+        處理後的 Item 列表
     """
-    items = receipt.get("items", [])
-    try:
-        amount = int(float(receipt.get("amount", 0)))
-    except (ValueError, TypeError):
-        amount = 0
+    items = receipt.items
+    amount = receipt.amount_cents
 
     if not items:
         # 無品項明細 → 用廠商名+總金額建立代表品項
-        return [{
-            "name": receipt.get("vendor", "核銷明細"),
-            "quantity": 1,
-            "price": amount,
-        }]
+        return [Item(receipt.vendor or "核銷明細", 1, amount)]
 
-    tax_items = [i for i in items if _is_tax_item(i.get("name", ""))]
-    regular_items = [i for i in items if not _is_tax_item(i.get("name", ""))]
+    tax_items = [i for i in items if _is_tax_item(i.name)]
+    regular_items = [i for i in items if not _is_tax_item(i.name)]
 
     if not regular_items:
         # 只有稅額項目？不太可能，但保險起見用總金額
-        return [{
-            "name": receipt.get("vendor", "核銷明細"),
-            "quantity": 1,
-            "price": amount,
-        }]
+        return [Item(receipt.vendor or "核銷明細", 1, amount)]
 
     # 計算各項合計
-    def _item_total(item):
-        try:
-            q = int(float(item.get("quantity", 1)))
-        except (ValueError, TypeError):
-            q = 1
-        try:
-            p = int(float(item.get("price", 0)))
-        except (ValueError, TypeError):
-            p = 0
-        return p * q
-
-    regular_sum = sum(_item_total(i) for i in regular_items)
-    tax_sum = sum(_item_total(i) for i in tax_items)
+    regular_sum = sum(i.total_cents for i in regular_items)
+    tax_sum = sum(i.total_cents for i in tax_items)
 
     if not tax_items:
         # ── Case C: 無稅額 → 直接使用品項 ──
         result = list(regular_items)
         diff = amount - regular_sum
         if diff > 0:
-            result.append({"name": "其他差額", "quantity": 1, "price": diff})
+            result.append(Item("其他差額", 1, diff))
         return result
 
     if len(regular_items) == 1:
         # ── Case A: 單品項 + 稅額 → 合併（用收據總金額） ──
         item = regular_items[0]
-        return [{
-            "name": item.get("name", ""),
-            "spec": item.get("spec", ""),
-            "quantity": 1,
-            "price": amount,   # 用收據總金額（已含稅）
-        }]
+        return [Item(item.name, 1, amount, item.spec)]   # 用收據總金額（已含稅）
 
     # ── Case B: 多品項 + 稅額 ──
     result = list(regular_items)
@@ -596,14 +766,14 @@ def _process_receipt_tax(receipt: dict) -> list:
     if regular_sum == amount:
         # 品項合計 == 收據金額 → 稅已含在品項價格中，不加稅
         pass
-    elif abs(regular_sum + tax_sum - amount) <= 1:
-        # 品項 + 稅額 ≈ 收據金額 → 品項為未稅價，加「其他差額」
-        result.append({"name": "其他差額", "spec": "稅額", "quantity": 1, "price": tax_sum})
+    elif abs(regular_sum + tax_sum - amount) <= 100:
+        # 品項 + 稅額 ≈ 收據金額（誤差 1 元內）→ 品項為未稅價，加「其他差額」
+        result.append(Item("其他差額", 1, tax_sum, "稅額"))
     else:
         # 其他情況 → 用收據金額補差額
         diff = amount - regular_sum
         if diff > 0:
-            result.append({"name": "其他差額", "quantity": 1, "price": diff})
+            result.append(Item("其他差額", 1, diff))
         elif diff < 0:
             # 品項合計 > 收據金額，可能 OCR 有誤，但不壓縮成一行
             # 保留品項，讓使用者自行檢查
@@ -612,13 +782,120 @@ def _process_receipt_tax(receipt: dict) -> list:
     return result
 
 
+# ════════════════════════════════════════════════════════════
+#  送出紀錄（避免重複核銷）
+# ════════════════════════════════════════════════════════════
+
+def attach_fingerprints(docs: list) -> None:
+    """
+    為每張收據（OCR dict）設定 _fingerprint（來源檔案雜湊 + 發票號碼 + 金額 + 日期）。
+
+    必須在外幣比對與正規化之前呼叫：之後外幣收據的金額會換成台幣（刷卡或暫定匯率，
+    可能隨刷卡紀錄或匯率表改變）、發票號碼會被清空，指紋就不再穩定。
+    已有 _fingerprint 的收據（接續執行、watcher 保留的收據）不重新計算。
+    """
+    file_hashes = {}
+    receipts_dir = Path(profiles.current().receipts_dir)
+    for doc in docs:
+        if doc.get("doc_type", "receipt") == "credit_card_statement" or doc.get("_fingerprint"):
+            continue
+        source = doc.get("_source_image", "") or ""
+        if source not in file_hashes:
+            file_hashes[source] = file_sha256(receipts_dir / source) if source else ""
+        currency = str(doc.get("_original_currency") or doc.get("currency") or "TWD").strip().upper()
+        if currency == "TWD":
+            amount = doc.get("amount", 0)
+        else:
+            amount = doc.get("_original_amount", doc.get("original_amount", doc.get("amount", 0)))
+        day = parse_day(doc.get("date"))
+        doc["_fingerprint"] = receipt_fingerprint(
+            file_hashes[source], str(doc.get("invoice_no", "") or ""), to_cents(amount),
+            day.isoformat() if day else "", currency)
+
+
+def filter_submitted(receipts: list, resubmit: bool = False) -> list:
+    """
+    開瀏覽器前檢查送出紀錄：
+    - saved：已存入（列出請購單號）→ 略過
+    - pending：上次填單中斷，不確定是否已存入 → 警告並詢問（預設略過）
+    resubmit=True 時只列出，不略過。
+
+    Args:
+        receipts: Receipt 列表
+
+    Returns:
+        list: 要送出的收據
+    """
+    found = SubmissionLedger(profiles.current().ledger_db).lookup(
+        [r.fingerprint for r in receipts if r.fingerprint])
+    if not found:
+        return receipts
+
+    saved = [r for r in receipts if found.get(r.fingerprint, {}).get("status") == "saved"]
+    pending = [r for r in receipts if found.get(r.fingerprint, {}).get("status") == "pending"]
+
+    if saved:
+        events.info(f"\n[INFO] {len(saved)} 張收據已存入過：")
+        for r in saved:
+            rec = found[r.fingerprint]
+            events.info(f"  - {r.source or '?'} {r.vendor or '?'} NT${r.amount}"
+                        f" → 請購單 {rec['record_no'] or '(單號未知)'}（{rec['updated_at']}）")
+    if pending:
+        events.warn(f"\n[WARN] {len(pending)} 張收據上次填單未確認完成（可能已存入，請先到系統查詢）：")
+        for r in pending:
+            rec = found[r.fingerprint]
+            events.warn(f"  - {r.source or '?'} {r.vendor or '?'} NT${r.amount}"
+                        f"（{rec['updated_at']}）")
+
+    if resubmit:
+        events.info("  (--resubmit) 仍會重新送出以上收據")
+        return receipts
+
+    skip = {id(r) for r in saved}
+    if pending:
+        again = policy.current().ask(
+            "resend_pending", "  是否重新送出未確認的收據？(y/n, 10秒後自動n): ",
+            timeout=10, default="n").strip().lower()
+        if again != "y":
+            skip.update(id(r) for r in pending)
+    remaining = [r for r in receipts if id(r) not in skip]
+    events.info(f"  略過 {len(skip)} 張，剩 {len(remaining)} 張待送出",
+                skipped=len(skip), remaining=len(remaining))
+    return remaining
+
+
+def prepare_submission(docs: list, mode: str = MATCH_MODE) -> tuple:
+    """
+    非互動的 Step 2.5~2.6：附上指紋 → 外幣比對 → 正規化 → 轉為 Receipt
+    （watcher.py / jobserver.py 用；docs 會被改寫，需要保留原始結果時請傳副本）。
+
+    Returns:
+        (ready, held)
+        ready: [(doc, Receipt), ...] 可送出的收據（保留對應的原始 dict）
+        held:  [doc, ...] 外幣收據尚無台幣金額（等刷卡紀錄或匯率）
+    """
+    attach_fingerprints(docs)
+    receipts = match_foreign_receipts_to_statements(docs, mode=mode)
+    receipts = normalize_foreign_receipts(receipts, rates=RateTable.load(FX_RATES_FILE),
+                                          confirm_unmatched=False)
+    ready, held = [], []
+    for doc in receipts:
+        if (doc.get("currency", "TWD") != "TWD"
+                and not (doc.get("_matched_twd") or doc.get("_provisional_twd"))):
+            held.append(doc)
+            continue
+        ready.append((doc, Receipt.from_dict(doc)))
+    return ready, held
+
+
 # ════════════════════════════════════════════════════════════
 #  收據合併
 # ════════════════════════════════════════════════════════════
 
 def merge_receipts(receipts: list) -> dict:
     """
-    將多張收據合併為一份 receipt_data，填入同一張請購單。
+    將多張收據（Receipt）合併為一份 receipt_data，填入同一張請購單。
+    回傳值是填單邊界的 dict（fill_expense_form 的輸入格式）。
 
     合併規則：
     - items:      所有品項串接（超過 14 項時截斷並警告）
@@ -634,36 +911,24 @@ def merge_receipts(receipts: list) -> dict:
     # 單張也做稅額預處理
     if len(receipts) == 1:
         r = receipts[0]
-        processed = _process_receipt_tax(r)
-        result = dict(r)  # shallow copy
-        result["items"] = processed
-        return result
+        return r.to_dict(items=_process_receipt_tax(r))
 
     all_items = []
-    total_amount = 0
+    total_cents = 0
     dates = []
     vendors = []
 
     for r in receipts:
         # 每張收據先做稅額預處理，再合併品項
-        processed = _process_receipt_tax(r)
-        all_items.extend(processed)
-
-        try:
-            total_amount += int(float(r.get("amount", 0)))
-        except (ValueError, TypeError):
-            pass
-
-        d = r.get("date", "")
-        if d:
-            dates.append(d)
-
-        v = r.get("vendor", "")
-        if v and v not in vendors:
-            vendors.append(v)
+        all_items.extend(_process_receipt_tax(r))
+        total_cents += r.amount_cents
+        if r.day:
+            dates.append(r.day)
+        if r.vendor and r.vendor not in vendors:
+            vendors.append(r.vendor)
 
     # 選日期（最早）
-    merged_date = min(dates) if dates else date_cls.today().isoformat()
+    merged_date = min(dates).isoformat() if dates else date_cls.today().isoformat()
 
     # 選廠商名
     if not vendors:
@@ -673,57 +938,88 @@ def merge_receipts(receipts: list) -> dict:
     else:
         merged_vendor = f"{vendors[0]} 等{len(vendors)}家"
 
-    # 品項數量警告
-    if len(all_items) > 14:
-        print(f"  [WARN] 合計品項 {len(all_items)} 項，超過系統上限 14 項")
-        print(f"         將截斷至 14 項（超出金額會進入「差額」列）")
+    # 品項數量警告（正常流程已由 planner 拆單，不會超過）
+    if len(all_items) > APPP_MAX_ROWS:
+        print(f"  [WARN] 合計品項 {len(all_items)} 項，超過系統上限 {APPP_MAX_ROWS} 項")
+        print(f"         將截斷至 {APPP_MAX_ROWS} 項（超出金額會進入「差額」列）")
 
     return {
         "date": merged_date,
         "vendor": merged_vendor,
-        "amount": total_amount,
-        "tax_id": receipts[0].get("tax_id", ""),
+        "amount": total_cents // 100,
+        "tax_id": receipts[0].tax_id,
         "invoice_no": "",          # 多張合併統一用自動收據號碼
-        "items": all_items,
+        "items": [i.to_dict() for i in all_items],
         "_source_count": len(receipts),
         "_vendors": vendors,
-        "_receipts": receipts,     # 保留原始清單供 APPA 多行填寫用
+        "_receipts": [r.to_dict() for r in receipts],   # 保留原始清單供 APPA 多行填寫用
     }
 
 
-# ════════════════════════════════════════════════════════════
-#  填單（單次登入，處理合併後的 receipt_data）
-# ════════════════════════════════════════════════════════════
-
-def process_batch(merged_data: dict, plan_name: str = "",
-                  headless: bool = True, auto_save: bool = True,
-                  use_project: bool = False,
-                  source_stem: str = "batch",
-                  auto_close: bool = False):
+def build_batches(requisitions: list) -> list:
+    """
+    將 planner.group_receipts() 規劃的每張請購單合併為 receipt_data，
+    並帶上規則指定的計畫（"_plan_name" / "_use_project"）與科目（"subject_code"）。
     """
-    將合併後的 receipt_data 填入核銷系統（一張請購單）。
+    batches = []
+    for req in requisitions:
+        merged = merge_receipts(req["receipts"])
+        if req["plan"]:
+            # 規則指定計畫 → 走計畫請購路徑（同 --plan）
+            merged["_plan_name"] = req["plan"]
+            merged["_use_project"] = True
+        if req["subject"]:
+            merged["subject_code"] = req["subject"]
+        batches.append(merged)
+    return batches
 
-    Args:
-        merged_data:  merge_receipts() 回傳的合併 receipt_data
-        plan_name:    計畫名稱關鍵字（進系統後下拉選單篩選用）
-        headless:     是否使用 headless 瀏覽器
-        auto_save:    是否在金額一致時自動存入
-        use_project:  True=計畫請購, False=部門請購
-        source_stem:  截圖檔名前綴
-        auto_close:   完成後是否自動關閉瀏覽器
+
+def _item_rows(receipt: Receipt) -> int:
+    """收據經稅額預處理後佔用的品名列數（planner 用）。"""
+    return len(_process_receipt_tax(receipt))
+
+
+def _receipt_seq_dates(merged_data: dict) -> dict:
     """
-    print(f"\n{'='*60}")
-    print(f"填入核銷系統...")
-    print(f"{'='*60}")
+    一張請購單在各日期需要保留幾個收據流水號 {收據日期: 張數}：
+    沒有有效發票號碼的收據各用一個，依收據自己的日期（沒有日期的用請購單日期），
+    與 form_filler.fill_appa_frame 的取號方式相同。
+    """
+    receipts = merged_data.get("_receipts") or [merged_data]
+    counts = {}
+    for r in receipts:
+        if not _sanitize_receipt_no(r.get("invoice_no", "")):
+            day = r.get("date") or merged_data.get("date", "")
+            counts[day] = counts.get(day, 0) + 1
+    return counts
 
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-    # 存合併後的 OCR 結果（供事後檢查）
-    ocr_out = Path(OUTPUT_DIR) / f"{source_stem}_merged_ocr.json"
-    with open(ocr_out, "w", encoding="utf-8") as f:
-        json.dump(merged_data, f, ensure_ascii=False, indent=2)
-    print(f"  合併 OCR: {ocr_out}")
+# ════════════════════════════════════════════════════════════
+#  填單（單次登入，依序處理一或多張請購單）
+# ════════════════════════════════════════════════════════════
+
+def _record_reconcile(receipts: list, record_no: str) -> None:
+    """確認存入後，把以暫定匯率計價的收據列入待對帳清單（ocr-only、取消或存入失敗時不記錄）。"""
+    for r in receipts:
+        if not r.get("_needs_reconcile"):
+            continue
+        try:
+            add_pending(FX_RECONCILE_FILE, r, record_no)
+            events.info(f"  [待對帳] {r.get('vendor', '')}: 暫定 NT${r.get('_provisional_twd')}"
+                        f" 已列入待對帳清單", vendor=r.get("vendor", ""), record_no=record_no)
+        except ValueError as e:
+            events.warn(f"  [WARN] {r.get('vendor', '')}: 暫定 NT${r.get('_provisional_twd')}，"
+                        f"但待對帳清單損毀、未記錄（請修正 {FX_RECONCILE_FILE} 後手動對帳）: {e}")
+
 
+def _fill_one(menu_page, context, merged_data: dict, plan_name: str,
+              auto_save: bool, use_project: bool, source_stem: str) -> dict:
+    """
+    在已登入的 session 中導航到新請購單並填入一份 receipt_data。
+
+    Returns:
+        dict: fill_expense_form() 的結果 {"saved", "record_no"}
+    """
     # 計算收據流水號
     receipt_date = merged_data.get("date", "")
     if not receipt_date:
@@ -731,100 +1027,216 @@ def process_batch(merged_data: dict, plan_name: str = "",
         merged_data["date"] = receipt_date
         print(f"  日期未辨識，使用今天: {receipt_date}")
 
-    if merged_data.get("invoice_no"):
-        print("  此為單張發票，不計算收據流水號")
-        receipt_seq = 0
+    # 每個收據日期各自向帳本保留，編出的號碼（收據+日期+流水號）才不會與之後同日重複
+    receipt_seq, receipt_seqs = 0, {}
+    needs = _receipt_seq_dates(merged_data)
+    if not needs:
+        print("  收據皆有發票號碼，不計算收據流水號")
     else:
-        receipt_seq = get_next_receipt_seq(receipt_date)
-        print(f"  收據流水號: {receipt_seq:02d}")
+        for day in sorted(needs):
+            count = needs[day]
+            first = receipt_seqs[day] = get_next_receipt_seq(day, count)
+            if count > 1:
+                events.info(f"  收據流水號 {day}: {first:02d}~{first + count - 1:02d}",
+                            date=day, receipt_seq=first, count=count)
+            else:
+                events.info(f"  收據流水號 {day}: {first:02d}", date=day, receipt_seq=first, count=1)
+        receipt_seq = receipt_seqs.get(receipt_date, 0)
+        merged_data["_receipt_seqs"] = {day: [receipt_seqs[day], needs[day]] for day in sorted(needs)}
 
-    # 登入 → 導航 → 填三區塊 → 存入
-    pw, browser, context = start_browser(headless=headless)
-    try:
-        menu_page = login(context)
+    # 存合併後的 OCR 結果（含流水號，供事後檢查與帳本補登）
+    ocr_out = artifacts.path(f"{source_stem}_merged_ocr.json")
+    with open(ocr_out, "w", encoding="utf-8") as f:
+        json.dump(merged_data, f, ensure_ascii=False, indent=2)
+    events.info(f"  合併 OCR: {ocr_out}", path=str(ocr_out))
 
-        frames = navigate_to_expense_form(
-            menu_page, use_project=use_project, plan_name=plan_name
-        )
+    # 送出紀錄：先登記 pending，確認存入後改為 saved（中斷時保持 pending）
+    receipts = merged_data.get("_receipts") or [merged_data]
+    submissions = SubmissionLedger(profiles.current().ledger_db)
+    submissions.mark_pending(receipts)
 
-        fill_expense_form(
-            frames, merged_data,
-            menu_page=menu_page,
-            context=context,
-            plan_name=plan_name,
-            receipt_seq=receipt_seq,
-            auto_save=auto_save,
-            use_project=use_project,
-        )
+    frames = navigate_to_expense_form(
+        menu_page, use_project=use_project, plan_name=plan_name
+    )
+
+    result = fill_expense_form(
+        frames, merged_data,
+        menu_page=menu_page,
+        context=context,
+        plan_name=plan_name,
+        receipt_seq=receipt_seq,
+        auto_save=auto_save,
+        use_project=use_project,
+        receipt_seqs=receipt_seqs,
+    )
+    if result["saved"] and result.get("confirmed"):
+        submissions.mark_saved(receipts, result["record_no"])
+        _record_reconcile(receipts, result["record_no"])
+    elif result["saved"]:
+        # 沒有看到存入成功的 dialog：可能已存入，保持 pending，下次執行會警告
+        events.warn("  [WARN] 未確認存入成功，送出紀錄保持「未確認」，請到系統查詢")
+    elif result["saved"] is False:
+        submissions.forget(receipts)   # 確定未存入，下次可直接重送
+
+    with profiling.span("screenshot"):
+        screenshot_path = str(artifacts.screenshot(menu_page, f"{source_stem}_filled",
+                                                   full_page=True))
+    events.info(f"  截圖已存: {screenshot_path}", path=screenshot_path)
+
+    if not auto_save:
+        print("\n  [提示] 系統已暫停自動存入！您可以：")
+        print("         1. 切換到視窗去檢查欄位（經費/品名/受款人）。")
+        print("         2. 直接在網頁上修改內容。")
+        print("         3. 從網頁上按下「存入」。")
+        policy.current().wait("\n  [按 Enter 繼續，或等待 60 秒自動繼續...] ", timeout=60)
+    return result
+
+
+def fill_batches(menu_page, context, batches: list, plan_name: str = "",
+                 auto_save: bool = True, use_project: bool = False,
+                 source_stem: str = "batch",
+                 skip=(), on_result=None) -> list:
+    """
+    在已登入的瀏覽器中，依序將多份合併後的 receipt_data 各填成一張請購單。
+    參數與回傳值同 process_batches()（不含瀏覽器啟動/關閉）；
+    watcher.py 保持同一個登入工作階段時直接呼叫。
+    """
+    results = []
+    for k, merged_data in enumerate(batches, 1):
+        if k in skip:
+            continue
+        stem = f"{source_stem}_{k}" if len(batches) > 1 else source_stem
+        if len(batches) > 1:
+            print(f"\n── 請購單 {k}/{len(batches)} ──")
+        try:
+            with events.bind(batch=k), profiling.span("fill"):
+                result = _fill_one(
+                    menu_page, context, merged_data,
+                    plan_name=merged_data.get("_plan_name") or plan_name,
+                    auto_save=auto_save,
+                    use_project=merged_data.get("_use_project", use_project),
+                    source_stem=stem,
+                )
+            # saved：存入成功 dialog 已確認；unconfirmed：已按存入但未見 dialog；
+            # manual：未啟用自動存入，由使用者在網頁上存入
+            if result["saved"] is None:
+                outcome = "manual"
+            elif result["saved"]:
+                outcome = "saved" if result.get("confirmed") else "unconfirmed"
+            else:
+                outcome = "failed"
+            results.append({"index": k, "ok": result["saved"] is not False, "outcome": outcome,
+                            "error": "" if result["saved"] is not False else "自動存入失敗",
+                            "record_no": result["record_no"]})
+        except Exception as e:
+            if len(batches) == 1:
+                raise
+            print(f"  [ERROR] 請購單 {k} 填單失敗: {e}")
+            results.append({"index": k, "ok": False, "outcome": "failed", "error": str(e),
+                            "record_no": ""})
+        events.emit("requisition", batch=k, outcome=results[-1]["outcome"],
+                    record_no=results[-1]["record_no"], error=results[-1]["error"],
+                    receipts=len(merged_data.get("_receipts") or [merged_data]))
+        if on_result:
+            on_result(results[-1])
+        max_failures = policy.current().max_failures
+        if max_failures and sum(not r["ok"] for r in results) >= max_failures:
+            print(f"  [ABORT] 已失敗 {max_failures} 張（政策 abort.max_failures），"
+                  f"停止填寫其餘請購單")
+            break
+    return results
+
+
+def process_batches(batches: list, plan_name: str = "",
+                    headless: bool = True, auto_save: bool = True,
+                    use_project: bool = False,
+                    source_stem: str = "batch",
+                    auto_close: bool = False,
+                    skip=(), on_result=None,
+                    session: BrowserSession = None) -> list:
+    """
+    登入一次，依序將多份合併後的 receipt_data 各填成一張請購單。
+
+    Args:
+        batches:      merge_receipts() 回傳的 receipt_data 列表
+                      （可各自帶 "_plan_name" / "_use_project" 覆寫
+                      plan_name / use_project，"subject_code" 指定科目）
+        plan_name:    計畫名稱關鍵字（進系統後下拉選單篩選用）
+        headless:     是否使用 headless 瀏覽器
+        auto_save:    是否在金額一致時自動存入
+        use_project:  True=計畫請購, False=部門請購
+        source_stem:  截圖檔名前綴（多張時加 _1、_2...）
+        auto_close:   完成後是否自動關閉瀏覽器
+        skip:         不需處理的請購單序號（1 起算，接續執行時略過已完成者）
+        on_result:    每張請購單完成後呼叫 on_result(結果 dict)（寫入 checkpoint 用）
+        session:      已預先登入的 BrowserSession（須由同一執行緒建立），
+                      None 時在此啟動瀏覽器；結束時一律關閉
 
-        screenshot_path = f"{OUTPUT_DIR}/{source_stem}_filled.png"
-        menu_page.screenshot(path=screenshot_path, full_page=True)
-        print(f"  截圖已存: {screenshot_path}")
+    Returns:
+        list[dict]: 每張請購單的結果 {"index", "ok", "error", "record_no"}
+        （單張失敗不影響後續請購單；略過的請購單不列入）
+    """
+    print(f"\n{'='*60}")
+    if len(batches) > 1:
+        print(f"填入核銷系統（共 {len(batches)} 張請購單）...")
+    else:
+        print(f"填入核銷系統...")
+    print(f"{'='*60}")
 
-        if not auto_save:
-            print("\n  [提示] 系統已暫停自動存入！您可以：")
-            print("         1. 切換到視窗去檢查欄位（經費/品名/受款人）。")
-            print("         2. 直接在網頁上修改內容。")
-            print("         3. 從網頁上按下「存入」。")
-            _timed_input("\n  [按 Enter 繼續，或等待 60 秒自動繼續...] ",
-                         timeout=60, default="")
+    # 登入一次 → 每張請購單各自導航 → 填三區塊 → 存入
+    if session is None:
+        session = BrowserSession(headless=headless)
+    try:
+        menu_page, context = session.page()
+        results = fill_batches(
+            menu_page, context, batches,
+            plan_name=plan_name, auto_save=auto_save, use_project=use_project,
+            source_stem=source_stem, skip=skip, on_result=on_result,
+        )
 
         if not auto_close:
-            _timed_input("\n  [保留瀏覽器] 按 Enter 關閉，或等待 60 秒自動關閉...",
-                         timeout=60, default="")
+            policy.current().wait("\n  [保留瀏覽器] 按 Enter 關閉，或等待 60 秒自動關閉...",
+                                  timeout=60)
     finally:
-        browser.close()
-        pw.stop()
+        session.close()
 
     print("完成！")
+    return results
+
+
+def process_batch(merged_data: dict, plan_name: str = "",
+                  headless: bool = True, auto_save: bool = True,
+                  use_project: bool = False,
+                  source_stem: str = "batch",
+                  auto_close: bool = False):
+    """將合併後的 receipt_data 填入核銷系統（一張請購單）。參數同 process_batches()。"""
+    process_batches(
+        [merged_data],
+        plan_name=plan_name,
+        headless=headless,
+        auto_save=auto_save,
+        use_project=use_project,
+        source_stem=source_stem,
+        auto_close=auto_close,
+    )
 
 
 # ════════════════════════════════════════════════════════════
 #  主程式
 # ════════════════════════════════════════════════════════════
 
-def main():
-    parser = argparse.ArgumentParser(
-        description="核銷自動填單：OCR 辨識發票 → 合併 → 填入一張請購單"
-    )
-    parser.add_argument(
-        "--plan", type=str, default="",
-        help="計畫名稱關鍵字（如 '高教深耕'），跳過互動選擇"
-    )
-    parser.add_argument(
-        "--auto-save", action="store_true",
-        help="自動存入（預設為手動確認後存入）"
-    )
-    parser.add_argument(
-        "--headless", action="store_true",
-        help="不顯示瀏覽器視窗（預設會顯示視窗供查看）"
-    )
-    parser.add_argument(
-        "--close", action="store_true",
-        help="完成後自動關閉瀏覽器（預設會保持開啟讓您繼續操作）"
-    )
-    parser.add_argument(
-        "--ocr-only", action="store_true",
-        help="僅執行 OCR 辨識，不填入系統"
-    )
-    parser.add_argument(
-        "--project", action="store_true",
-        help="使用「計畫請購」路徑（預設為「部門請購」）"
-    )
-    parser.add_argument(
-        "--test", action="store_true",
-        help="使用測試資料（不進行 OCR，直接填入固定的測試資料）"
-    )
-    args = parser.parse_args()
-
-    headless = args.headless
-    auto_save = args.auto_save
-    auto_close = args.close
-    use_project = args.project
-    use_test_data = args.test
+def _collect_receipts(args, run: RunState, saved_docs: list = None,
+                      saved_names: list = None, while_ocr=None) -> tuple:
+    """
+    Step 1~3.5：掃描、OCR、外幣比對、正規化、略過已送出的收據。
+    各階段結果寫入執行狀態目錄，接續執行時從最後完成的階段繼續。
+    saved_docs 為 --from-json 讀入的單張 OCR 結果（取代掃描與 OCR）。
+    while_ocr 在 OCR 於背景執行緒進行時由目前執行緒呼叫（預先登入用）。
 
-    # ── Step 1~3: 掃描與 OCR 或測試資料 ──────────────────────────
-    if use_test_data:
+    Returns:
+        (Receipt 列表, 來源檔名列表)
+    """
+    if args.test:
         print("\n[測試模式] 啟用，直接使用測試資料，不進行 OCR 辨識。")
         # 測試用收據（收據號碼自動產生，不指定 invoice_no）
         all_receipts = [{
@@ -838,12 +1250,23 @@ def main():
             "payee": "測試受款人",
             "_source_image": "test_dummy.jpg"
         }]
-        images = [Path("test_dummy.jpg")]
+        return [Receipt.from_dict(r) for r in all_receipts], ["test_dummy.jpg"]
+
+    matcher = None   # 本次重新 OCR 時為增量比對器
+    if run.done("ocr"):
+        stage = run.load("ocr")
+        all_receipts, file_names = stage["receipts"], stage["files"]
+        print(f"  [接續] 載入 OCR 結果（{len(file_names)} 個檔案、{len(all_receipts)} 筆），略過辨識")
+    elif saved_docs:
+        all_receipts, file_names = saved_docs, saved_names
+        print(f"\n[重播] 載入 {len(all_receipts)} 筆保存的 OCR 結果（{len(file_names)} 個來源檔），"
+              f"不重新辨識")
+        run.save("ocr", {"files": file_names, "receipts": all_receipts})
     else:
         images = get_receipt_files()
         if not images:
             print(f"receipts/ 目錄中沒有找到收據檔案。")
-            print(f"請將發票/收據檔案放入 {RECEIPTS_DIR}/ 目錄。")
+            print(f"請將發票/收據檔案放入 {profiles.current().receipts_dir}/ 目錄。")
             print(f"支援格式: 圖片(JPG/PNG/WebP) 及 PDF")
             sys.exit(0)
 
@@ -859,106 +1282,423 @@ def main():
             print(f"  {i}. {img.name}")
 
         # ── Step 2: OCR 所有檔案 ──────────────────────
-        print("\n開始辨識...")
-        all_receipts = ocr_all_files(images)
+        print("\n開始辨識...（每張辨識完立即檢查，Ctrl+C 可中止）")
+        stop = threading.Event()
+        matcher = IncrementalMatcher(aliases=_match_aliases())
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            future = pool.submit(ocr_with_feedback, images, stop, matcher)
+            try:
+                if while_ocr:
+                    while_ocr()
+                with profiling.span("ocr_wait"):
+                    all_receipts = future.result()
+            except KeyboardInterrupt:
+                print("\n  [中止] 等待目前的檔案辨識完成...")
+                stop.set()
+                all_receipts = future.result()
+
+        if stop.is_set():
+            save_ocr_results(all_receipts)
+            print(f"\n已中止辨識（完成 {len(all_receipts)} 張，結果存在 {run.dir}/）。")
+            print(f"  修正檔案後重新執行，或修改 *_ocr.json 後用 --from-json {run.dir}/ 填單")
+            sys.exit(0)
 
         if not all_receipts:
             print("OCR 失敗，無法辨識任何收據。")
             sys.exit(1)
 
-        # 儲存各張 OCR 結果
-        os.makedirs(OUTPUT_DIR, exist_ok=True)
-        saved_stems = {}
-        for r in all_receipts:
-            src = r.get("_source_image", "receipt")
-            stem = Path(src).stem
-            # 同一張圖片可能有多張收據，加序號區分
-            saved_stems[stem] = saved_stems.get(stem, 0) + 1
-            suffix = f"_{saved_stems[stem]}" if saved_stems[stem] > 1 else ""
-            out = Path(OUTPUT_DIR) / f"{stem}{suffix}_ocr.json"
-            with open(out, "w", encoding="utf-8") as f:
-                json.dump(r, f, ensure_ascii=False, indent=2)
+        save_ocr_results(all_receipts)
+
+        file_names = [img.name for img in images]
+        run.save("ocr", {"files": file_names, "receipts": all_receipts})
 
+    if run.done("normalized"):
+        all_receipts = [Receipt.from_dict(r) for r in run.load("normalized")]
+        print(f"  [接續] 載入比對/正規化結果（{len(all_receipts)} 張收據）")
+    else:
         # ── Step 2.5: 外幣收據 ↔ 刷卡紀錄交叉比對 ─────
         # 從 all_receipts 中分離出刷卡紀錄，並為外幣收據匹配台幣金額
-        all_receipts = match_foreign_receipts_to_statements(all_receipts)
+        # 指紋取 OCR 原始值（原幣金額、發票號碼），比對與正規化會改寫這些欄位
+        # （舊版的 matched 紀錄沒有指紋：外幣收據改用比對時保留的 _original_amount）
+        if run.done("matched"):
+            all_receipts = run.load("matched")
+            attach_fingerprints(all_receipts)
+        else:
+            attach_fingerprints(all_receipts)
+            with profiling.span("match"):
+                all_receipts = match_foreign_receipts_to_statements(
+                    all_receipts, mode=args.match_mode, matcher=matcher)
+            run.save("matched", all_receipts)
 
         # ── Step 2.6: 外幣收據正規化 ─────────────────
-        # AI 服務品名標準化 + 清空外幣 invoice_no + 未匹配匯率警告
-        all_receipts = normalize_foreign_receipts(all_receipts)
+        # AI 服務品名標準化 + 清空外幣 invoice_no + 未匹配時用本地匯率表暫估
+        with profiling.span("normalize"):
+            all_receipts = normalize_foreign_receipts(
+                all_receipts, rates=RateTable.load(FX_RATES_FILE))
 
-        # ── Step 3: 顯示辨識摘要 ──────────────────────
-        show_ocr_summary(all_receipts)
+            # ── 轉為 Receipt（金額以分為整數、日期已解析），之後不再重複解析 ──
+            all_receipts = [Receipt.from_dict(r) for r in all_receipts]
+        run.save("normalized", [r.to_dict() for r in all_receipts])
 
-        # ── OCR-only 模式 ─────────────────────────────
-        if args.ocr_only:
-            print("\nOCR 完成！（--ocr-only 模式，不填入系統）")
-            sys.exit(0)
+    # ── Step 3: 顯示辨識摘要 ──────────────────────
+    show_ocr_summary(all_receipts)
 
-    # ── Step 4: 選擇計畫類型 ──────────────────────
-    plan_name, plan_need_project = choose_plan(preset=args.plan)
-    if plan_need_project:
-        use_project = True
-
-    mode_str = "計畫請購" if use_project else "部門請購"
-    print(f"\n{'─'*40}")
-    print(f"  請購類型: {mode_str}")
-    print(f"  計畫: {plan_name or '(進入系統後從下拉選單選擇)'}")
-    print(f"  自動存入: {'是' if auto_save else '否'}")
-    print(f"  瀏覽器: {'headless' if headless else '有畫面'}")
-    print(f"  收據數: {len(all_receipts)} 張 -> 合併為 1 張請購單")
-    print(f"  測試模式: {'是' if use_test_data else '否'}")
-    print(f"{'─'*40}")
-
-    # ── Step 5: 使用者確認 ────────────────────────
-    if use_test_data:
-        confirm = "y"
-    else:
-        confirm = _timed_input("\n是否將以上收據合併填入核銷系統？(y/n, 10秒後自動y): ",
-                               timeout=10, default="y").strip().lower()
+    # ── OCR-only 模式 ─────────────────────────────
+    if args.ocr_only:
+        print("\nOCR 完成！（--ocr-only 模式，不填入系統）")
+        sys.exit(0)
 
-    if confirm != "y":
-        print("已取消。")
+    # ── Step 3.5: 略過已送出的收據（開瀏覽器之前）──
+    with profiling.span("dedupe"):
+        all_receipts = filter_submitted(all_receipts, resubmit=args.resubmit)
+    if not all_receipts:
+        print("\n沒有需要送出的收據。")
         sys.exit(0)
+    return all_receipts, file_names
 
-    # ── Step 6: 合併所有收據 ──────────────────────
-    merged = merge_receipts(all_receipts)
-    n_items = len(merged.get("items", []))
-    print(f"\n合併後: {n_items} 個品項，總金額 NT${merged.get('amount', 0)}")
 
-    # 截圖前綴：單張圖片用其名稱，多張用 batch_日期
-    if use_test_data:
-        source_stem = "test_dummy"
-    elif len(images) == 1:
-        source_stem = images[0].stem
+def main():
+    parser = argparse.ArgumentParser(
+        description="核銷自動填單：OCR 辨識發票 → 合併 → 填入一張請購單"
+    )
+    parser.add_argument(
+        "--plan", type=str, default="",
+        help="計畫名稱關鍵字（如 '高教深耕'），跳過互動選擇"
+    )
+    parser.add_argument(
+        "--auto-save", action="store_true",
+        help="自動存入（預設為手動確認後存入）"
+    )
+    parser.add_argument(
+        "--headless", action="store_true",
+        help="不顯示瀏覽器視窗（預設會顯示視窗供查看）"
+    )
+    parser.add_argument(
+        "--close", action="store_true",
+        help="完成後自動關閉瀏覽器（預設會保持開啟讓您繼續操作）"
+    )
+    parser.add_argument(
+        "--ocr-only", action="store_true",
+        help="僅執行 OCR 辨識，不填入系統"
+    )
+    parser.add_argument(
+        "--project", action="store_true",
+        help="使用「計畫請購」路徑（預設為「部門請購」）"
+    )
+    parser.add_argument(
+        "--match-mode", choices=["optimal", "greedy"], default=MATCH_MODE,
+        help=f"外幣收據與刷卡紀錄的比對方式（預設 {MATCH_MODE}）"
+    )
+    parser.add_argument(
+        "--rules", type=str, default=BATCH_RULES_FILE,
+        help=f"請購單分組規則檔（預設 {BATCH_RULES_FILE}，不存在則全部合併）"
+    )
+    parser.add_argument(
+        "--resubmit", action="store_true",
+        help="重新送出已存入/未確認的收據（預設會略過，避免重複核銷）"
+    )
+    parser.add_argument(
+        "--resume", type=str, default="", metavar="RUN_ID",
+        help="從某次執行的最後完成階段接續（RUN_ID 或 last），不重新 OCR"
+    )
+    parser.add_argument(
+        "--policy", type=str, default=POLICY_FILE,
+        help=f"執行政策檔：提示預設答案與中止條件（預設 {POLICY_FILE}）"
+    )
+    parser.add_argument(
+        "--unattended", action="store_true",
+        help="無人值守：不等待任何輸入，依政策檔作答（隱含 --auto-save --close）"
+    )
+    parser.add_argument(
+        "--from-json", nargs="+", default=[], metavar="PATH",
+        help="從保存的 OCR JSON 填單（檔案或目錄，可為 *_merged_ocr.json），不重新 OCR"
+    )
+    parser.add_argument(
+        "--user", type=str, default="",
+        help=f"以 {PROFILES_DIR}/<名稱>/ 的帳密、收據資料夾與帳本執行（見 profiles.py）"
+    )
+    parser.add_argument(
+        "--profile", action="store_true",
+        help="記錄各階段與瀏覽器子步驟的耗時，報告存到執行狀態目錄的 profile.txt"
+    )
+    parser.add_argument(
+        "--cprofile", action="store_true",
+        help="同 --profile，並以 cProfile 剖析 Python 程式（另存 profile.pstats）"
+    )
+    parser.add_argument(
+        "--metrics-file", type=str, default=METRICS_FILE,
+        help=f"執行結束時更新的 Prometheus 指標檔（預設 {METRICS_FILE}，空字串停用）"
+    )
+    verbosity = parser.add_mutually_exclusive_group()
+    verbosity.add_argument(
+        "-v", "--verbose", action="store_true",
+        help="終端機顯示診斷訊息（[PRE-CYCLE]、品項明細等；事件紀錄檔一律完整）"
+    )
+    verbosity.add_argument(
+        "-q", "--quiet", action="store_true",
+        help="終端機只顯示警告與錯誤"
+    )
+    parser.add_argument(
+        "--test", action="store_true",
+        help="使用測試資料（不進行 OCR，直接填入固定的測試資料）"
+    )
+    args = parser.parse_args()
+    events.set_verbosity("verbose" if args.verbose else "quiet" if args.quiet else "normal")
+
+    try:
+        policy.use(Policy.load(args.policy, unattended=args.unattended))
+    except (ValueError, OSError) as e:
+        print(f"[ERROR] 政策檔 {args.policy} 無法讀取: {e}")
+        sys.exit(1)
+    if args.user:
+        try:
+            profiles.use(profiles.discover(names=[args.user])[0])
+        except (FileNotFoundError, ValueError) as e:
+            print(f"[ERROR] {e}")
+            sys.exit(1)
+
+    # ── 執行狀態目錄（各階段 checkpoint，--resume 接續）──
+    try:
+        run = (RunState.open(RUNS_DIR, args.resume) if args.resume
+               else RunState.create(RUNS_DIR))
+    except FileNotFoundError as e:
+        print(f"[ERROR] {e}")
+        sys.exit(1)
+    if args.resume:
+        print(f"\n[接續] 執行 {run.run_id}，最後完成階段: {run.last_stage() or '(無)'}")
     else:
-        source_stem = f"batch_{date_cls.today().strftime('%Y%m%d')}"
+        print(f"\n執行 ID: {run.run_id}（中斷後可用 --resume {run.run_id} 接續）")
+
+    # 瀏覽器啟動與登入不需要 OCR 結果：OCR 進行時先登入，確認後直接填單。
+    # Playwright sync API 綁定建立它的執行緒，所以瀏覽器留在主執行緒、OCR 改在背景執行緒
+    # 每個步驟一行 JSON（events.py），接續執行時附加到同一檔；指標由同樣的事件累計
+    metrics.enable(args.metrics_file)
+    user = profiles.current().name
+    log_path = events.open_log(run.dir, run_id=run.run_id, **({"user": user} if user else {}))
+    events.emit("run", outcome="start", resume=bool(args.resume), log=str(log_path))
+    if args.profile or args.cprofile:
+        profiling.enable(cprofile=args.cprofile)
+    session = BrowserSession(headless=args.headless)
+    outcome, started = "error", time.perf_counter()
+    try:
+        # 截圖、OCR 結果、驗證碼等產出寫到執行狀態目錄（artifacts.py）
+        with artifacts.use(run.dir):
+            _run(args, run, session)
+        outcome = "ok"
+    except SystemExit as e:
+        outcome = "ok" if not e.code else f"exit {e.code}"
+        raise
+    finally:
+        session.close()
+        if profiling.enabled():
+            _write_profile(run)
+        duration = time.perf_counter() - started
+        events.emit("run", outcome=outcome, duration_ms=round(duration * 1000, 1))
+        events.close()
+        _finish_run(run, outcome, duration)
+
+
+def _finish_run(run: RunState, outcome: str, duration: float) -> None:
+    """寫入執行的 manifest.json，並依保存期限清理舊的執行產出。"""
+    try:
+        run.write_manifest(inputs_dir=profiles.current().receipts_dir,
+                           outcome=outcome, duration_s=round(duration, 1))
+    except (OSError, ValueError) as e:
+        print(f"  [WARN] manifest 寫入失敗: {e}")
+    artifacts.prune_after_run(keep=[run.dir])
+
+
+def _write_profile(run: RunState) -> None:
+    """--profile：印出耗時最多的階段，完整報告存到執行狀態目錄。"""
+    stages = profiling.stages()
+    path = profiling.write(run.dir)
+    print(f"\n耗時最多的階段（牆鐘 / CPU / 等待，秒）：")
+    for r in stages[:profiling.TOP_N]:
+        print(f"  {r['wall']:>8.2f} {r['cpu']:>7.2f} {r['idle']:>8.2f}  {r['stage']}")
+    print(f"剖析報告: {path}")
+
+
+def _run(args, run: RunState, session: BrowserSession) -> None:
+    """main() 主體：OCR → 規劃 → 確認 → 填單。session 在 OCR 期間預先登入。"""
+    run_policy = policy.current()
+    headless = args.headless
+    # 無人值守時沒有人按「存入」或關閉瀏覽器
+    auto_save = args.auto_save or args.unattended
+    auto_close = args.close or args.unattended
+    use_project = args.project
+    use_test_data = args.test
+
+    def _prelogin():
+        try:
+            with profiling.span("prelogin"):
+                session.page()
+            print("  [預先登入] 已登入核銷系統，等待辨識完成...")
+        except Exception as e:
+            # 填單前 session.page() 會再試一次
+            print(f"  [WARN] 預先登入失敗，填單前重新登入: {e}")
+
+    replay_batches = []
+    if run.done("merged"):
+        stage = run.load("merged")
+        batches = stage["batches"]
+        plan_name = stage["plan_name"]
+        use_project = stage["use_project"]
+        source_stem = stage["source_stem"]
+        print(f"  [接續] 載入 {len(batches)} 張請購單，略過 OCR 與規劃")
+    else:
+        saved_docs, file_names = [], []
+        if args.from_json:
+            saved_docs, replay_batches, file_names = load_saved_ocr(args.from_json)
+
+        if replay_batches:
+            # 合併檔已是請購單：略過比對、正規化與規劃
+            print(f"\n[重播] 載入 {len(replay_batches)} 份合併 OCR 結果，直接填單")
+            n_receipts = sum(len(b.get("_receipts") or [b]) for b in replay_batches)
+        else:
+            # ── Step 1~3: 掃描與 OCR 或測試資料 ──────────────────────────
+            all_receipts, file_names = _collect_receipts(
+                args, run, saved_docs, file_names,
+                while_ocr=None if args.ocr_only else _prelogin)
+            n_receipts = len(all_receipts)
+
+        # ── Step 4: 選擇計畫類型 ──────────────────────
+        plan_name, plan_need_project = choose_plan(preset=args.plan or run_policy.plan,
+                                                   mode=run_policy.mode)
+        if plan_need_project:
+            use_project = True
+
+        # 依規則檔（計畫/科目/月份）與 APPP/APPA 列數上限規劃請購單
+        requisitions = []
+        if not replay_batches:
+            with profiling.span("plan"):
+                rules = BatchRules.load(args.rules)
+                requisitions = group_receipts(all_receipts, rules, _item_rows)
+
+        mode_str = "計畫請購" if use_project else "部門請購"
+        print(f"\n{'─'*40}")
+        print(f"  請購類型: {mode_str}")
+        print(f"  計畫: {plan_name or '(進入系統後從下拉選單選擇)'}")
+        print(f"  自動存入: {'是' if auto_save else '否'}")
+        print(f"  瀏覽器: {'headless' if headless else '有畫面'}")
+        print(f"  收據數: {n_receipts} 張 -> 合併為 {len(replay_batches or requisitions)} 張請購單")
+        print(f"  測試模式: {'是' if use_test_data else '否'}")
+        if args.unattended:
+            print(f"  無人值守: 是（政策檔 {args.policy}）")
+        print(f"{'─'*40}")
+        if len(requisitions) > 1:
+            show_plan_table(requisitions, _item_rows, default_plan=plan_name)
+
+        # ── Step 5: 使用者確認 ────────────────────────
+        if use_test_data:
+            confirm = "y"
+        else:
+            with profiling.span("confirm"):
+                confirm = policy.current().ask(
+                    "confirm", "\n是否將以上收據合併填入核銷系統？(y/n, 10秒後自動y): ",
+                    timeout=10, default="y").strip().lower()
+
+        if confirm != "y":
+            print("已取消。")
+            sys.exit(0)
+
+        # ── Step 6: 各組收據合併為請購單 ──────────────
+        with profiling.span("merge"):
+            batches = replay_batches or build_batches(requisitions)
+        for k, merged in enumerate(batches, 1):
+            n_items = len(merged.get("items", []))
+            label = f"請購單 {k}: " if len(batches) > 1 else "合併後: "
+            print(f"\n{label}{n_items} 個品項，總金額 NT${merged.get('amount', 0)}")
+
+        # 截圖前綴：單張圖片用其名稱，多張用 batch_日期（重播用 replay_日期）
+        if use_test_data:
+            source_stem = "test_dummy"
+        elif len(file_names) == 1:
+            source_stem = Path(file_names[0]).stem
+        else:
+            prefix = "replay" if args.from_json else "batch"
+            source_stem = f"{prefix}_{date_cls.today().strftime('%Y%m%d')}"
+        run.save("merged", {
+            "plan_name": plan_name,
+            "use_project": use_project,
+            "source_stem": source_stem,
+            "batches": batches,
+        })
+
+    # ── 政策中止條件（張數 / 金額上限）──────────────
+    reason = run_policy.check_requisitions(batches)
+    if reason:
+        print(f"\n[ABORT] {reason}（政策檔 {args.policy}），不送出任何請購單")
+        print(f"  調整政策或收據後可用 --resume {run.run_id} 接續")
+        sys.exit(2)
 
     # ── Step 7: 填入系統 ──────────────────────────
+    # 已完成的請購單（接續時）不再處理
+    filled = {r["index"]: r for r in run.load("filled", [])}
+    skip = {k for k, r in filled.items() if r["ok"]}
+    if args.resume or replay_batches:
+        for k, merged in enumerate(batches, 1):
+            if k in skip:
+                continue
+            # 上次可能在存入前後中斷：再檢查一次送出紀錄
+            receipts = [Receipt.from_dict(r) for r in merged.get("_receipts") or [merged]]
+            if len(filter_submitted(receipts, resubmit=args.resubmit)) < len(receipts):
+                skip.add(k)
+        if skip:
+            tag = "接續" if args.resume else "重播"
+            print(f"  [{tag}] 略過請購單: {', '.join(map(str, sorted(skip)))}"
+                  f"（已完成或已送出）")
+    if len(skip) >= len(batches):
+        print("\n沒有需要送出的請購單。")
+        sys.exit(0)
+
+    def _checkpoint(result: dict) -> None:
+        filled[result["index"]] = result
+        all_ok = all(filled.get(k, {}).get("ok") or k in skip
+                     for k in range(1, len(batches) + 1))
+        run.save("filled", sorted(filled.values(), key=lambda r: r["index"]),
+                 complete=all_ok)
+
     try:
-        process_batch(
-            merged,
+        results = process_batches(
+            batches,
             plan_name=plan_name,
             headless=headless,
             auto_save=auto_save,
             use_project=use_project,
             source_stem=source_stem,
             auto_close=auto_close,
+            skip=skip,
+            on_result=_checkpoint,
+            session=session,
         )
     except Exception as e:
         print(f"\n[ERROR] 填單失敗: {e}")
+        print(f"  OCR 與規劃結果已保存，可用 --resume {run.run_id} 重新填單")
         import traceback
         traceback.print_exc()
         sys.exit(1)
 
     # ── 結果摘要 ──────────────────────────────────
+    failed = [r for r in results if not r["ok"]]
     print(f"\n{'='*60}")
-    print(f"全部完成！")
+    records = [r["record_no"] for r in results if r["record_no"]]
+    if records:
+        print(f"請購單號: {', '.join(records)}")
+    if failed:
+        print(f"完成 {len(results) - len(failed)}/{len(results)} 張請購單，失敗：")
+        for r in failed:
+            print(f"  請購單 {r['index']}: {r['error']}")
+        print(f"  修正後可用 --resume {run.run_id} 只重送失敗的請購單")
+    else:
+        print(f"全部完成！")
     if _receipt_counter:
-        print("收據流水號統計：")
+        print("收據流水號統計（本次 / 當日累計）：")
+        totals = _get_ledger().counts()
         for day, count in sorted(_receipt_counter.items()):
-            print(f"  {day[:4]}/{day[4:6]}/{day[6:]}: {count} 張")
+            print(f"  {day[:4]}/{day[4:6]}/{day[6:]}: {count} 張 / 至 {totals.get(day, count):02d}")
     print(f"{'='*60}")
+    if failed:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,441 @@
+"""外幣收據 ↔ 信用卡刷卡紀錄比對：交易索引與評分。
+
+原本的比對對每張外幣收據掃描全部交易，並在內層迴圈重新切字、
+重新 strptime 日期；刷卡紀錄累積一年後就成為瓶頸。
+
+這裡先把交易整理成索引（日期只解析一次、幣別寫法統一為 ISO 代碼）：
+    - 依原幣金額[分]   → 原幣金額吻合的候選（不分幣別，同評分規則）
+    - 依日期（日序數） → ±7 天內的候選
+    - 依廠商名稱（vendors.VendorIndex）與別名 → 名稱相符的候選
+只對候選交易評分：
+    原幣金額吻合 +5（否則幣別相同 +1）、廠商名稱相符 +6 / 部分相符 +3、
+    日期 ±1/3/7 天 +3/+2/+1
+不在候選中的交易（金額不符、日期超過 ±7 天、名稱不相符）最多 1+3 分，
+達不到 MATCH_THRESHOLD，所以達門檻的結果與全掃描相同。
+
+OCR 逐檔完成時可用 IncrementalMatcher 邊辨識邊比對：收據或刷卡紀錄一到，
+就對目前已知的交易 / 尚未匹配的收據解出配對，不必等最慢的檔案。
+"""
+
+from records import Transaction, normalize_currency, parse_day, to_cents
+from vendors import VendorIndex, STRONG_SIMILARITY, WEAK_SIMILARITY
+
+MATCH_THRESHOLD = 5     # 達到此分數才視為匹配成功
+DATE_WINDOW_DAYS = 7    # 日期加分的最大天數差
+NAME_ONLY_MAX = 7       # 只有廠商名稱相符的交易最高分（名稱 +6、幣別 +1）
+
+
+def parse_date(text) -> int:
+    """將 YYYY-MM-DD 轉為日序數（date.toordinal），無法解析回傳 None。"""
+    day = parse_day(text)
+    return day.toordinal() if day else None
+
+
+class ReceiptKey:
+    """外幣收據的比對鍵（每張收據只計算一次）。"""
+
+    __slots__ = ("vendor", "vendor_hits", "alias", "currency", "amount_cents", "day")
+
+    def __init__(self, receipt: dict, vendor_hits: dict = None, alias=None):
+        self.vendor = (receipt.get("vendor", "") or "").lower()
+        self.vendor_hits = vendor_hits or {}   # {交易名稱條目: 相似度}
+        self.alias = alias
+        self.currency = normalize_currency(receipt.get("currency", "TWD"))
+        self.amount_cents = to_cents(receipt.get("original_amount", receipt.get("amount", 0)))
+        self.day = parse_date(receipt.get("date", ""))
+
+
+def vendor_points(key: ReceiptKey, txn: Transaction) -> int:
+    """
+    廠商名稱分數：相符 +6、部分相符 +3。
+    收據廠商與刷卡名稱對應到同一個別名（如 Claude ↔ ANTHROPIC*）視為相符。
+    """
+    if key.alias is not None and key.alias == txn.alias:
+        return 6
+    sim = key.vendor_hits.get(txn.vendor_entry, 0.0)
+    if sim >= STRONG_SIMILARITY:
+        return 6
+    if sim >= WEAK_SIMILARITY:
+        return 3
+    return 0
+
+
+def score(key: ReceiptKey, txn: Transaction) -> int:
+    """計算一張收據與一筆交易的匹配分數。"""
+    s = vendor_points(key, txn)
+
+    # 原幣金額比對（以分為單位比較）
+    if txn.original_cents > 0 and txn.original_cents == key.amount_cents:
+        s += 5  # 原幣金額完全吻合 → 強匹配
+    elif txn.currency == key.currency:
+        s += 1  # 至少幣別相同
+
+    # 日期相近度（刷卡因時區差異可能前後差 1 天）
+    if key.day is not None and txn.day is not None:
+        day_diff = abs(key.day - txn.day)
+        if day_diff <= 1:
+            s += 3
+        elif day_diff <= 3:
+            s += 2
+        elif day_diff <= DATE_WINDOW_DAYS:
+            s += 1
+
+    return s
+
+
+class TransactionIndex:
+    """
+    刷卡交易索引。
+
+    - by_amount: 原幣金額分 → [交易序號]
+    - by_day:    日序數 → [交易序號]
+    - by_vendor: 交易名稱條目 → [交易序號]（名稱查詢走 VendorIndex）
+    - by_alias:  別名標準名稱 → [交易序號]
+
+    原幣金額吻合、日期在 ±7 天內、或廠商名稱相符（相似度達 STRONG_SIMILARITY
+    或同一別名，+6 分）的交易才會成為候選。
+
+    Args:
+        statements: 刷卡紀錄列表
+        aliases:    別名表 {關鍵字: 標準名稱}（如 AI 服務品名表、學到的別名）
+    """
+
+    def __init__(self, statements: list, aliases: dict = None):
+        self.transactions = []
+        self.by_amount = {}
+        self.by_day = {}
+        self.by_vendor = {}
+        self.by_alias = {}
+        self.vendors = VendorIndex()
+        self.aliases = VendorIndex.from_aliases(aliases or {})
+        for stmt in statements:
+            stmt_date = stmt.get("date", "")
+            for item in stmt.get("items", []):
+                self.add(item, stmt_date)
+
+    def add(self, item: dict, stmt_date: str) -> Transaction:
+        txn = Transaction.from_item(len(self.transactions), item, stmt_date)
+        self.transactions.append(txn)
+        if txn.original_cents > 0:
+            self.by_amount.setdefault(txn.original_cents, []).append(txn.idx)
+        if txn.day is not None:
+            self.by_day.setdefault(txn.day, []).append(txn.idx)
+        if txn.name:
+            txn.vendor_entry = self.vendors.add(txn.name)
+            txn.alias, _ = self.aliases.best(txn.name)
+            self.by_vendor.setdefault(txn.vendor_entry, []).append(txn.idx)
+            if txn.alias is not None:
+                self.by_alias.setdefault(txn.alias, []).append(txn.idx)
+        return txn
+
+    def key(self, receipt: dict) -> ReceiptKey:
+        """建立收據比對鍵，並查詢廠商名稱索引（每張收據一次）。"""
+        vendor = receipt.get("vendor", "") or ""
+        hits = self.vendors.query(vendor) if vendor else {}
+        alias = self.aliases.best(vendor)[0] if vendor else None
+        return ReceiptKey(receipt, hits, alias)
+
+    def __len__(self):
+        return len(self.transactions)
+
+    def candidates(self, key: ReceiptKey, by_name: bool = True) -> list:
+        """
+        回傳候選交易序號（已排序，保持原本「先出現者優先」的平手規則）。
+        by_name=False 時不含只靠廠商名稱成為候選的交易（見 best_match）。
+        """
+        found = set()
+        if key.amount_cents > 0:
+            # 原幣金額吻合即 +5，與幣別無關（刷卡紀錄常未辨識出幣別）
+            found.update(self.by_amount.get(key.amount_cents, ()))
+        if key.day is not None:
+            for d in range(key.day - DATE_WINDOW_DAYS, key.day + DATE_WINDOW_DAYS + 1):
+                found.update(self.by_day.get(d, ()))
+        if by_name:
+            found.update(self._name_candidates(key))
+        return sorted(found)
+
+    def _name_candidates(self, key: ReceiptKey) -> set:
+        """廠商名稱相符（+6）的交易；部分相符（+3）加上幣別（+1）達不到門檻，不列入。"""
+        found = set()
+        for entry, sim in key.vendor_hits.items():
+            if sim >= STRONG_SIMILARITY:
+                found.update(self.by_vendor.get(entry, ()))
+        if key.alias is not None:
+            found.update(self.by_alias.get(key.alias, ()))
+        return found
+
+    def best_match(self, receipt: dict) -> tuple:
+        """
+        找出收據的最佳交易（略過已使用的交易）。
+
+        只靠名稱成為候選的交易分數固定為 6 或 7（幣別相同），
+        金額 / 日期候選已超過 NAME_ONLY_MAX 時不必逐一評分。
+
+        Returns:
+            (Transaction 或 None, 最高分數)
+        """
+        key = self.key(receipt)
+        best, best_score = None, 0
+        for idx in self.candidates(key, by_name=False):
+            txn = self.transactions[idx]
+            if txn.used:
+                continue
+            s = score(key, txn)
+            if s > best_score:
+                best, best_score = txn, s
+        if best_score <= NAME_ONLY_MAX:
+            for idx in sorted(self._name_candidates(key)):
+                txn = self.transactions[idx]
+                if txn.used:
+                    continue
+                s = score(key, txn)
+                if s > best_score or (s == best_score and best is not None and idx < best.idx):
+                    best, best_score = txn, s
+        return best, best_score
+
+
+# ════════════════════════════════════════════════════════════
+#  增量比對（OCR 結果陸續到達時）
+# ════════════════════════════════════════════════════════════
+
+class MatchEvent:
+    """增量比對的配對事件：收據（dict）↔ 交易，附分數。"""
+
+    __slots__ = ("receipt", "txn", "score")
+
+    def __init__(self, receipt: dict, txn: Transaction, score: int):
+        self.receipt = receipt
+        self.txn = txn
+        self.score = score
+
+
+class IncrementalMatcher:
+    """
+    邊辨識邊比對：維持刷卡交易索引（index）與尚未匹配的外幣收據（open）。
+
+    - 外幣收據到達：立即對已知的未使用交易找最佳配對
+    - 刷卡紀錄到達：交易加入索引，再為尚未匹配的收據重新找配對
+      （收據廠商名稱要對新加入的交易名稱重新查詢，所以重建比對鍵）
+    分數達 MATCH_THRESHOLD 且台幣金額有效即成立（先到先得，同逐張比對）。
+
+    Args:
+        aliases: 別名表 {關鍵字: 標準名稱}（同 TransactionIndex）
+    """
+
+    def __init__(self, aliases: dict = None):
+        self.index = TransactionIndex([], aliases=aliases)
+        self.open = []       # 尚未匹配的外幣收據（到達順序）
+        self.matches = {}    # id(收據) → MatchEvent
+
+    def add(self, doc: dict) -> list:
+        """加入一份 OCR 結果（收據或刷卡紀錄），回傳因此成立的 MatchEvent 列表。"""
+        if doc.get("doc_type", "receipt") == "credit_card_statement":
+            return self.add_statement(doc)
+        if doc.get("currency", "TWD") == "TWD":
+            return []
+        event = self._resolve(doc)
+        if event is None:
+            self.open.append(doc)
+            return []
+        return [event]
+
+    def add_statement(self, statement: dict) -> list:
+        stmt_date = statement.get("date", "")
+        added = [self.index.add(item, stmt_date) for item in statement.get("items", [])]
+        if not added or not self.open:
+            return []
+        events, still_open = [], []
+        for receipt in self.open:
+            event = self._resolve(receipt)
+            if event is None:
+                still_open.append(receipt)
+            else:
+                events.append(event)
+        self.open = still_open
+        return events
+
+    def _resolve(self, receipt: dict):
+        txn, best = self.index.best_match(receipt)
+        if txn is None or best < MATCH_THRESHOLD or not _valid_twd(txn):
+            return None
+        txn.used = True
+        event = MatchEvent(receipt, txn, best)
+        self.matches[id(receipt)] = event
+        return event
+
+    def result(self, receipt: dict) -> tuple:
+        """
+        收據目前的比對結果，格式同 TransactionIndex.best_match()：
+        已配對回傳 (Transaction, 分數)；未配對回傳 (None, 目前最高候選分數)。
+        """
+        event = self.matches.get(id(receipt))
+        if event is not None:
+            return event.txn, event.score
+        return None, self.index.best_match(receipt)[1]
+
+
+# ════════════════════════════════════════════════════════════
+#  全域最佳指派（order-independent）
+# ════════════════════════════════════════════════════════════
+
+DENSE_LIMIT = 250_000   # 連通分量的 收據數×交易數 超過此值改用稀疏解法
+_NO_DAY = -10**9        # 日期無法解析時的哨兵值
+
+
+def _receipt_sort_key(key: ReceiptKey) -> tuple:
+    return (key.vendor, key.day if key.day is not None else _NO_DAY,
+            key.currency, key.amount_cents)
+
+
+def _txn_sort_key(txn: Transaction) -> tuple:
+    return (txn.day if txn.day is not None else _NO_DAY, txn.currency,
+            txn.original_cents, txn.name_lower, txn.twd_cents)
+
+
+def _valid_twd(txn: Transaction) -> bool:
+    return txn.twd_cents >= 100
+
+
+def _edge_scores(np, keys: list, txns: list, rows, cols, vendor_pts):
+    """以 NumPy 向量化計算候選邊的分數（金額/幣別/日期），廠商分數由呼叫端提供。"""
+    currencies = {c: i for i, c in enumerate(
+        sorted({k.currency for k in keys} | {t.currency for t in txns}))}
+
+    r_amount = np.array([k.amount_cents for k in keys], dtype=np.int64)[rows]
+    r_cur = np.array([currencies[k.currency] for k in keys])[rows]
+    r_day = np.array([_NO_DAY if k.day is None else k.day for k in keys])[rows]
+    t_price = np.array([t.original_cents for t in txns], dtype=np.int64)[cols]
+    t_cur = np.array([currencies[t.currency] for t in txns])[cols]
+    t_day = np.array([_NO_DAY if t.day is None else t.day for t in txns])[cols]
+
+    amount_ok = (t_price > 0) & (t_price == r_amount)
+    pts = vendor_pts + np.where(amount_ok, 5, np.where(t_cur == r_cur, 1, 0))
+
+    has_day = (r_day != _NO_DAY) & (t_day != _NO_DAY)
+    diff = np.abs(r_day - t_day)
+    pts += np.select(
+        [has_day & (diff <= 1), has_day & (diff <= 3), has_day & (diff <= DATE_WINDOW_DAYS)],
+        [3, 2, 1], default=0)
+    return pts
+
+
+def _components(n_rows: int, rows: list, cols: list, n_cols: int) -> list:
+    """以 union-find 將候選邊切成互不相干的連通分量，回傳每個分量的邊序號列表。"""
+    parent = list(range(n_rows + n_cols))
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for r, c in zip(rows, cols):
+        a, b = find(r), find(n_rows + c)
+        if a != b:
+            parent[a] = b
+
+    groups = {}
+    for e, r in enumerate(rows):
+        groups.setdefault(find(r), []).append(e)
+    return list(groups.values())
+
+
+def _solve_component(np, sp, edge_ids: list, rows, cols, pts) -> list:
+    """對一個連通分量求最大總分指派，回傳被選中的邊序號。"""
+    from scipy.optimize import linear_sum_assignment
+
+    r_ids = sorted({int(rows[e]) for e in edge_ids})
+    c_ids = sorted({int(cols[e]) for e in edge_ids})
+    r_pos = {r: i for i, r in enumerate(r_ids)}
+    c_pos = {c: i for i, c in enumerate(c_ids)}
+    er = np.array([r_pos[int(rows[e])] for e in edge_ids])
+    ec = np.array([c_pos[int(cols[e])] for e in edge_ids])
+    ew = pts[edge_ids]
+    lookup = {(int(a), int(b)): e for a, b, e in zip(er, ec, edge_ids)}
+
+    if len(r_ids) * len(c_ids) <= DENSE_LIMIT:
+        matrix = np.zeros((len(r_ids), len(c_ids)))
+        matrix[er, ec] = ew
+        ri, ci = linear_sum_assignment(matrix, maximize=True)
+    else:
+        # 稀疏解法：最小成本完全匹配。每張收據多一個「不匹配」虛擬欄，
+        # 保證完全匹配存在；成本 = 上限 - 分數（> 0，避免被視為無邊）
+        from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+        ceiling = float(ew.max()) + 1
+        n_r, n_c = len(r_ids), len(c_ids)
+        data = np.concatenate([ceiling - ew, np.full(n_r, ceiling)])
+        ii = np.concatenate([er, np.arange(n_r)])
+        jj = np.concatenate([ec, n_c + np.arange(n_r)])
+        graph = sp.csr_matrix((data, (ii, jj)), shape=(n_r, n_c + n_r))
+        ri, ci = min_weight_full_bipartite_matching(graph)
+        keep = ci < n_c
+        ri, ci = ri[keep], ci[keep]
+
+    return [lookup[(int(a), int(b))] for a, b in zip(ri, ci) if (int(a), int(b)) in lookup]
+
+
+def assign_optimal(index: TransactionIndex, receipts: list) -> list:
+    """
+    全域最佳指派：同時考慮所有收據與交易，使匹配總分最大。
+
+    與逐張貪婪比對不同，結果不受檔案順序影響（收據與交易先依內容排序），
+    也不會發生前面的收據「搶走」後面收據更吻合的交易。
+
+    - 候選邊來自 TransactionIndex（稀疏分數矩陣）
+    - 分數以 NumPy 向量化計算，規則與 score() 相同
+    - 每個連通分量用 Hungarian（scipy linear_sum_assignment）求解；
+      分量過大時改用稀疏的最小成本完全匹配
+
+    需要 numpy 與 scipy；未安裝時拋出 ImportError，由呼叫端改用貪婪比對。
+
+    Returns:
+        與 receipts 對齊的 [(Transaction 或 None, 分數)]；
+        未匹配者的分數為其最高候選分數（供訊息顯示）
+    """
+    import numpy as np
+    import scipy.sparse as sp
+
+    keys = [index.key(r) for r in receipts]
+    order = sorted(range(len(keys)), key=lambda i: _receipt_sort_key(keys[i]))
+    txns = sorted((t for t in index.transactions if _valid_twd(t)), key=_txn_sort_key)
+    t_pos = {t.idx: j for j, t in enumerate(txns)}
+
+    # 稀疏候選邊（row = 排序後收據位置，col = 排序後交易位置）
+    rows, cols, vendor_pts = [], [], []
+    for row, i in enumerate(order):
+        key = keys[i]
+        for idx in index.candidates(key):
+            j = t_pos.get(idx)
+            if j is None:
+                continue
+            rows.append(row)
+            cols.append(j)
+            vendor_pts.append(vendor_points(key, txns[j]))
+
+    results = [(None, 0)] * len(receipts)
+    if not rows:
+        return results
+
+    rows_a = np.array(rows)
+    cols_a = np.array(cols)
+    pts = _edge_scores(np, [keys[i] for i in order], txns, rows_a, cols_a,
+                       np.array(vendor_pts))
+
+    best_seen = np.zeros(len(order), dtype=int)
+    np.maximum.at(best_seen, rows_a, pts)
+    for row, i in enumerate(order):
+        results[i] = (None, int(best_seen[row]))
+
+    # 只保留達門檻的邊參與指派
+    strong = np.nonzero(pts >= MATCH_THRESHOLD)[0]
+    if strong.size == 0:
+        return results
+    s_rows = [int(rows_a[e]) for e in strong]
+    s_cols = [int(cols_a[e]) for e in strong]
+    for comp in _components(len(order), s_rows, s_cols, len(txns)):
+        edge_ids = [int(strong[e]) for e in comp]
+        for e in _solve_component(np, sp, edge_ids, rows_a, cols_a, pts):
+            i = order[int(rows_a[e])]
+            results[i] = (txns[int(cols_a[e])], int(pts[e]))
+
+    return results
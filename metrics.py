@@ -0,0 +1,227 @@
+"""Prometheus 指標：寫成 node_exporter textfile collector 格式（.prom），供排程執行時告警。
+
+指標（由 events.py 的事件累計，前綴 receipt_）：
+    receipt_runs_total{outcome}             執行次數（ok / failed）
+    receipt_last_run_timestamp_seconds      最後一次執行結束時間（排程停擺告警用）
+    receipt_last_run_success                最後一次執行是否成功（1 / 0）
+    receipt_last_run_duration_seconds       最後一次執行耗時
+    receipt_run_receipts                    每次執行確認存入的收據張數（histogram）
+    receipt_ocr_seconds                     每次 OCR API 呼叫耗時（histogram）
+    receipt_login_attempts_total            登入嘗試次數（每次嘗試辨識一次驗證碼）
+    receipt_logins_total                    登入成功次數
+    receipt_login_failures_total{reason}    登入失敗（bad_captcha / bad_password / unknown）
+    receipt_fill_seconds                    每張請購單填單耗時（histogram）
+    receipt_save_wait_seconds               存入後等待系統確認的時間（histogram）
+    receipt_requisitions_total{outcome}     請購單結果：saved（存入成功 dialog 已確認）/
+                                            unconfirmed（已按存入但未見確認）/
+                                            manual（未啟用自動存入）/ failed
+
+常用查詢：
+    每次成功登入的嘗試數  rate(receipt_login_attempts_total[1d]) / rate(receipt_logins_total[1d])
+    驗證碼正確率          1 - rate(receipt_login_failures_total{reason="bad_captcha"}[1d])
+                            / rate(receipt_login_attempts_total[1d])
+    填單變慢              histogram_quantile(0.9, rate(receipt_fill_seconds_bucket[1d]))
+
+計數器跨執行累計在 SQLite（METRICS_DB，多個程序同時更新也不會遺失）；
+每次執行結束時在同一交易中重寫 .prom（暫存檔 + rename，node_exporter 不會讀到寫一半的檔案）。
+
+用法：
+    python main.py --metrics-file /var/lib/node_exporter/textfile_collector/receipts.prom
+    python metrics.py                       # 印出目前的指標
+"""
+
+import math
+import os
+import sys
+import threading
+import time
+from contextlib import closing
+from pathlib import Path
+
+from config import METRICS_FILE, METRICS_DB
+from ledger import _SqliteStore
+import events
+
+PREFIX = "receipt_"
+# 名稱 → (類型, 說明, histogram 上界)
+FAMILIES = {
+    "runs_total": ("counter", "執行次數", None),
+    "last_run_timestamp_seconds": ("gauge", "最後一次執行結束時間（Unix 秒）", None),
+    "last_run_success": ("gauge", "最後一次執行是否成功", None),
+    "last_run_duration_seconds": ("gauge", "最後一次執行耗時（秒）", None),
+    "run_receipts": ("histogram", "每次執行確認存入的收據張數", (0, 1, 2, 5, 10, 20, 50, 100)),
+    "ocr_seconds": ("histogram", "OCR API 呼叫耗時（秒）", (1, 2, 5, 10, 20, 30, 60, 120)),
+    "login_attempts_total": ("counter", "登入嘗試次數", None),
+    "logins_total": ("counter", "登入成功次數", None),
+    "login_failures_total": ("counter", "登入失敗次數", None),
+    "fill_seconds": ("histogram", "每張請購單填單耗時（秒）", (30, 60, 90, 120, 180, 300, 600)),
+    "save_wait_seconds": ("histogram", "存入後等待系統確認的時間（秒）", (1, 2, 5, 10, 20, 30, 45, 60)),
+    "requisitions_total": ("counter", "請購單結果（saved / unconfirmed / manual / failed）", None),
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    name   TEXT NOT NULL,          -- 含 _bucket / _sum / _count 後綴
+    labels TEXT NOT NULL,          -- 'outcome="ok"'，無標籤為空字串
+    value  REAL NOT NULL,
+    PRIMARY KEY (name, labels)
+);
+"""
+
+
+class MetricsStore(_SqliteStore):
+    """指標數值（跨程序累計）。"""
+
+    SCHEMA = _SCHEMA
+
+    def apply(self, incs: dict, sets: dict, textfile: str = "") -> None:
+        """原子地累加 incs、設定 sets（{(名稱, 標籤): 值}）；textfile 不為空時在同一交易重寫。"""
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO samples (name, labels, value) VALUES (?, ?, ?) "
+                "ON CONFLICT(name, labels) DO UPDATE SET value = value + excluded.value",
+                [(n, l, v) for (n, l), v in incs.items()])
+            conn.executemany(
+                "INSERT INTO samples (name, labels, value) VALUES (?, ?, ?) "
+                "ON CONFLICT(name, labels) DO UPDATE SET value = excluded.value",
+                [(n, l, v) for (n, l), v in sets.items()])
+            if textfile:
+                rows = conn.execute("SELECT name, labels, value FROM samples").fetchall()
+                _write_atomic(textfile, render(rows))
+
+    def samples(self) -> list:
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT name, labels, value FROM samples").fetchall()
+
+
+def _family(name: str) -> str:
+    for suffix in ("_bucket", "_sum", "_count"):
+        if name.endswith(suffix) and FAMILIES.get(name[:-len(suffix)], ("",))[0] == "histogram":
+            return name[:-len(suffix)]
+    return name
+
+
+def _le_key(labels: str) -> float:
+    le = labels.rsplit('le="', 1)[-1].rstrip('"') if 'le="' in labels else ""
+    return math.inf if le in ("+Inf", "") else float(le)
+
+
+def render(rows) -> str:
+    """[(名稱, 標籤, 值)] → Prometheus text exposition format。"""
+    by_family = {}
+    for name, labels, value in rows:
+        by_family.setdefault(_family(name), []).append((name, labels, value))
+    lines = []
+    for family in sorted(by_family):
+        kind, help_text, _ = FAMILIES.get(family, ("untyped", "", None))
+        lines.append(f"# HELP {PREFIX}{family} {help_text}")
+        lines.append(f"# TYPE {PREFIX}{family} {kind}")
+        order = {"_bucket": 0, "_sum": 1, "_count": 2}
+        for name, labels, value in sorted(
+                by_family[family],
+                key=lambda r: (order.get(r[0][len(family):], 0), r[1].split('le="')[0], _le_key(r[1]))):
+            text = str(int(value)) if float(value).is_integer() else repr(float(value))
+            lines.append(f"{PREFIX}{name}{{{labels}}} {text}" if labels
+                         else f"{PREFIX}{name} {text}")
+    return "\n".join(lines) + "\n"
+
+
+def _write_atomic(path: str, text: str) -> None:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def _labels(**labels) -> str:
+    return ",".join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+
+
+class Collector:
+    """把事件換算成指標增量；執行結束（run 事件）時寫入 SQLite 與 .prom。"""
+
+    def __init__(self, textfile: str = METRICS_FILE, db: str = METRICS_DB):
+        self.textfile = textfile
+        self.store = MetricsStore(db)
+        self._lock = threading.Lock()
+        self._incs = {}
+        self._sets = {}
+        self._local = threading.local()     # 本執行緒這次執行存入的收據張數
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, _labels(**labels))
+        with self._lock:
+            self._incs[key] = self._incs.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self._sets[(name, _labels(**labels))] = value
+
+    def observe(self, name: str, value: float) -> None:
+        for bound in FAMILIES[name][2]:     # 未落入的桶也寫出 0，讓每個桶都存在
+            self.inc(f"{name}_bucket", 1 if value <= bound else 0, le=f"{bound:g}")
+        self.inc(f"{name}_bucket", le="+Inf")
+        self.inc(f"{name}_sum", value)
+        self.inc(f"{name}_count")
+
+    def flush(self) -> None:
+        """寫入累積的增量並重寫 .prom（失敗時只警告，不影響核銷流程）。"""
+        with self._lock:
+            incs, sets = self._incs, self._sets
+            self._incs, self._sets = {}, {}
+        try:
+            self.store.apply(incs, sets, self.textfile)
+        except Exception as e:
+            print(f"  [WARN] 指標檔 {self.textfile} 寫入失敗: {e}")
+
+    def on_event(self, record: dict) -> None:
+        event = record.get("event")
+        if event == "step":
+            seconds = record["duration_ms"] / 1000
+            if record["step"] == "ocr/api":
+                self.observe("ocr_seconds", seconds)
+            elif record["step"] == "fill":
+                self.observe("fill_seconds", seconds)
+            elif record["action"] == "submit_wait":
+                self.observe("save_wait_seconds", seconds)
+            elif record["action"] == "captcha":
+                self.inc("login_attempts_total")
+        elif event == "log" and record.get("action") == "login":
+            if record.get("outcome") == "ok":
+                self.inc("logins_total")
+            else:
+                self.inc("login_failures_total", reason=record.get("outcome", "unknown"))
+        elif event == "requisition":
+            self.inc("requisitions_total", outcome=record["outcome"])
+            if record["outcome"] == "saved":
+                self._local.receipts = getattr(self._local, "receipts", 0) + record.get("receipts", 0)
+        elif event == "run" and record.get("outcome") != "start":
+            ok = record.get("outcome") == "ok"
+            self.inc("runs_total", outcome="ok" if ok else "failed")
+            self.set("last_run_timestamp_seconds", round(time.time()))
+            self.set("last_run_success", 1 if ok else 0)
+            if "duration_ms" in record:
+                self.set("last_run_duration_seconds", record["duration_ms"] / 1000)
+            self.observe("run_receipts", getattr(self._local, "receipts", 0))
+            self._local.receipts = 0
+            self.flush()
+
+
+def enable(textfile: str = METRICS_FILE, db: str = METRICS_DB) -> Collector:
+    """開始收集指標（textfile 為空字串時不啟用，回傳 None）。"""
+    if not textfile:
+        return None
+    collector = Collector(textfile, db)
+    events.add_listener(collector.on_event)
+    return collector
+
+
+def main():
+    store = MetricsStore(METRICS_DB)
+    sys.stdout.write(render(store.samples()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""多位使用者同時核銷：每位同仁用自己的帳密、收據資料夾與帳本，平行處理。
+
+使用者設定見 profiles.py（profiles/<名稱>/credentials.env、receipts/）。
+每位使用者在自己的執行緒中：
+    OCR（背景執行緒，同時啟動瀏覽器並登入）→ 外幣比對 / 正規化
+    → 略過已送出的收據 → 規劃請購單 → 填入系統
+總時間約為最慢的一位，而不是所有人相加；同時處理的人數由 --workers 限制。
+所有使用者共用的學到的廠商別名與待對帳清單經由 jsonfile.py 加鎖讀改寫，不會互相覆蓋。
+
+Playwright sync API 只能在建立它的執行緒使用，無法讓一個瀏覽器的多個 context
+在不同執行緒同時操作，所以每位使用者各自啟動一個瀏覽器（工作階段互相隔離）。
+一律以無人值守模式執行（依政策檔作答，見 policy.py）；輸出的每一行前面
+標示使用者名稱。失敗的使用者可用
+    python main.py --user <名稱> --resume <執行ID>
+接續。
+
+用法：
+    python multiuser.py --headless                 # profiles/ 下所有使用者
+    python multiuser.py --users alice bob --workers 2
+"""
+
+import argparse
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date as date_cls
+
+from config import (
+    PROFILES_DIR, MULTIUSER_WORKERS, MATCH_MODE, BATCH_RULES_FILE, POLICY_FILE, RUNS_DIR,
+)
+from main import (
+    get_receipt_files, ocr_all_files, prepare_submission, filter_submitted,
+    choose_plan, build_batches, fill_batches, _item_rows, BrowserSession,
+)
+from planner import BatchRules, group_receipts
+from runstate import RunState
+import artifacts
+import policy
+import profiles
+from policy import Policy
+
+
+class _LabeledOutput:
+    """多執行緒同時輸出時，在每一行前面加上該執行緒的使用者名稱（[alice] ...）。"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def label(self, name: str) -> None:
+        """之後本執行緒的輸出都加上 [name]。"""
+        self._local.label = name
+        self._local.buf = ""
+
+    def write(self, text: str) -> int:
+        label = getattr(self._local, "label", None)
+        if label is None:
+            with self._lock:
+                return self.stream.write(text)
+        # 整行輸出，避免不同使用者的訊息在同一行交錯
+        *lines, self._local.buf = (self._local.buf + text).split("\n")
+        if lines:
+            with self._lock:
+                self.stream.write("".join(f"[{label}] {line}\n" for line in lines))
+        return len(text)
+
+    def flush(self) -> None:
+        buf = getattr(self._local, "buf", "")
+        if buf:
+            self._local.buf = ""
+            self.write(buf + "\n")
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def process_user(profile: profiles.Profile, args, rules: BatchRules,
+                 plan_name: str, use_project: bool, out: _LabeledOutput) -> dict:
+    """
+    處理一位使用者的收據資料夾（在呼叫端的工作執行緒中執行）。
+
+    Returns:
+        dict: {"user", "receipts", "requisitions", "ok", "failed",
+               "record_nos", "error", "run_id"}
+    """
+    profiles.use(profile)
+    out.label(profile.name)
+    summary = {"user": profile.name, "receipts": 0, "requisitions": 0, "ok": 0,
+               "failed": 0, "record_nos": [], "error": "", "run_id": ""}
+    session = BrowserSession(headless=args.headless)
+    run = None
+
+    def _ocr(images):
+        out.label(profile.name)
+        try:
+            return ocr_all_files(images)
+        finally:
+            out.flush()
+
+    try:
+        images = get_receipt_files()
+        if not images:
+            print("沒有收據檔案")
+            return summary
+
+        # OCR 在背景執行緒，本執行緒同時啟動瀏覽器並登入（同 main.py）
+        print(f"辨識 {len(images)} 個檔案，同時登入 {profile.username}...")
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            future = pool.submit(_ocr, images)
+            try:
+                session.page()
+            except Exception as e:
+                print(f"[WARN] 預先登入失敗，填單前重新登入: {e}")
+            docs = future.result()
+        if not docs:
+            summary["error"] = "OCR 沒有辨識到任何收據"
+            return summary
+
+        ready, held = prepare_submission(docs, mode=args.match_mode)
+        if held:
+            print(f"[WARN] {len(held)} 張外幣收據沒有台幣金額（缺刷卡紀錄與匯率），本次不送出")
+        receipts = filter_submitted([r for _, r in ready])
+        summary["receipts"] = len(receipts)
+        if not receipts:
+            print("沒有需要送出的收據")
+            return summary
+
+        requisitions = group_receipts(receipts, rules, _item_rows)
+        batches = build_batches(requisitions)
+        summary["requisitions"] = len(batches)
+        reason = policy.current().check_requisitions(batches)
+        if reason:
+            summary["error"] = f"{reason}（政策檔 {args.policy}）"
+            return summary
+
+        run = RunState.create(RUNS_DIR)
+        summary["run_id"] = run.run_id
+        source_stem = f"{profile.name}_{date_cls.today().strftime('%Y%m%d')}"
+        run.save("normalized", [r.to_dict() for r in receipts])
+        run.save("merged", {
+            "plan_name": plan_name,
+            "use_project": use_project,
+            "source_stem": source_stem,
+            "batches": batches,
+        })
+        filled = []
+
+        def _checkpoint(result: dict) -> None:
+            filled.append(result)
+            run.save("filled", filled,
+                     complete=len(filled) == len(batches) and all(r["ok"] for r in filled))
+
+        menu_page, context = session.page()
+        with artifacts.use(run.dir):
+            results = fill_batches(
+                menu_page, context, batches,
+                plan_name=plan_name, auto_save=True, use_project=use_project,
+                source_stem=source_stem, on_result=_checkpoint,
+            )
+        summary["ok"] = sum(r["ok"] for r in results)
+        summary["failed"] = len(batches) - summary["ok"]
+        summary["record_nos"] = [r["record_no"] for r in results if r["record_no"]]
+    except Exception as e:
+        print(f"[ERROR] {e}")
+        summary["error"] = str(e)
+    finally:
+        session.close()
+        if run is not None:
+            try:
+                run.write_manifest(inputs_dir=profile.receipts_dir,
+                                   outcome="failed" if summary["error"] or summary["failed"]
+                                   else "ok")
+            except (OSError, ValueError) as e:
+                print(f"[WARN] manifest 寫入失敗: {e}")
+        out.flush()
+    return summary
+
+
+def print_summary(summaries: list, heading: str, resume_command) -> None:
+    """印出 process_user() 結果表；失敗且有執行 ID 者附上 resume_command(summary) 接續指令。"""
+    print(f"\n{'='*72}")
+    print(f"  {heading:<12} {'收據':>4} {'請購單':>6} {'成功':>4} {'失敗':>4}  請購單號 / 錯誤")
+    for s in summaries:
+        detail = s["error"] or ", ".join(s["record_nos"]) or "-"
+        print(f"  {s['user']:<12} {s['receipts']:>4} {s['requisitions']:>6} "
+              f"{s['ok']:>4} {s['failed']:>4}  {detail}")
+        if (s["error"] or s["failed"]) and s["run_id"]:
+            print(f"  {'':<12} 接續: {resume_command(s)}")
+    print(f"{'='*72}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=f"多位使用者平行核銷（{PROFILES_DIR}/<名稱>/ 各自的帳密與收據）"
+    )
+    parser.add_argument("--users", nargs="+", default=[], metavar="NAME",
+                        help=f"只處理這些使用者（預設 {PROFILES_DIR}/ 下全部）")
+    parser.add_argument("--profiles", type=str, default=PROFILES_DIR,
+                        help=f"使用者設定目錄（預設 {PROFILES_DIR}）")
+    parser.add_argument("--workers", type=int, default=MULTIUSER_WORKERS,
+                        help=f"同時處理的使用者數（預設 {MULTIUSER_WORKERS}）")
+    parser.add_argument("--plan", type=str, default="", help="計畫名稱關鍵字（同 main.py）")
+    parser.add_argument("--project", action="store_true", help="使用「計畫請購」路徑")
+    parser.add_argument("--match-mode", choices=["optimal", "greedy"], default=MATCH_MODE,
+                        help=f"外幣收據與刷卡紀錄的比對方式（預設 {MATCH_MODE}）")
+    parser.add_argument("--rules", type=str, default=BATCH_RULES_FILE,
+                        help=f"請購單分組規則檔（預設 {BATCH_RULES_FILE}）")
+    parser.add_argument("--policy", type=str, default=POLICY_FILE,
+                        help=f"執行政策檔（預設 {POLICY_FILE}）")
+    parser.add_argument("--headless", action="store_true", help="不顯示瀏覽器視窗")
+    args = parser.parse_args()
+
+    try:
+        run_policy = policy.use(Policy.load(args.policy, unattended=True))
+    except (ValueError, OSError) as e:
+        print(f"[ERROR] 政策檔 {args.policy} 無法讀取: {e}")
+        sys.exit(1)
+    try:
+        users = profiles.discover(args.profiles, names=args.users)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"[ERROR] {e}")
+        sys.exit(1)
+    if not users:
+        print(f"{args.profiles}/ 中沒有使用者（每位需要 {args.profiles}/<名稱>/credentials.env）")
+        sys.exit(0)
+
+    plan_name, need_project = choose_plan(preset=args.plan or run_policy.plan,
+                                          mode=run_policy.mode)
+    rules = BatchRules.load(args.rules)
+    workers = max(1, min(args.workers, len(users)))
+    print(f"\n處理 {len(users)} 位使用者（同時 {workers} 位）: "
+          f"{', '.join(u.name for u in users)}")
+
+    out = _LabeledOutput(sys.stdout)
+    sys.stdout = out
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="user") as pool:
+            summaries = list(pool.map(
+                lambda u: process_user(u, args, rules, plan_name,
+                                       args.project or need_project, out),
+                users))
+    finally:
+        sys.stdout = out.stream
+
+    artifacts.prune_after_run(keep=[RunState.path(RUNS_DIR, s["run_id"])
+                                    for s in summaries if s["run_id"]])
+    print_summary(summaries, "使用者",
+                  lambda s: f"python main.py --user {s['user']} --resume {s['run_id']}")
+    if any(s["error"] or s["failed"] for s in summaries):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""請購單規劃：依分組規則與系統列數上限，把一批收據分成數張請購單。
+
+分組規則檔（config.BATCH_RULES_FILE，JSON）：
+    {
+      "subjects": {"全家": "110704-8012", "Anthropic": "110704-8022"},
+      "plans":    {"實驗": "高教深耕", "Claude": "國科會"},
+      "split_by_month": true,
+      "default_plan": "",
+      "default_subject": ""
+    }
+    subjects: 廠商關鍵字 → 會計科目代碼（比對收據廠商）
+    plans:    關鍵字 → 計畫名稱關鍵字（比對廠商與品名）
+    split_by_month: 不同月份的收據分開請購
+規則依檔案中的順序比對，先符合者優先；沒有規則檔時全部收據為同一組。
+
+核銷表單每張請購單的列數有限：
+    APPP（品名）最多 APPP_MAX_ROWS 列（超過會被截斷併入「其他差額」）
+    APPA（受款人）最多 APPA_MAX_ROWS 列（每張收據一列）
+
+這是二維 bin packing：每張收據有「品名列數」與「受款人列數(=1)」兩個尺寸。
+先用 First-Fit Decreasing（品名列數多的先放）得到可行解，未達下界時以它的張數
+為上界做分支定界，找出最少張數（收據不超過 PLAN_EXACT_MAX 張、搜尋節點不超過
+PLAN_EXACT_NODES 時；否則沿用 FFD 的結果，可能多一張）。
+同一張請購單內的收據維持原本順序。
+"""
+
+import json
+from pathlib import Path
+
+from config import APPP_MAX_ROWS, APPA_MAX_ROWS, PLAN_EXACT_MAX, PLAN_EXACT_NODES
+from vendors import VendorIndex
+
+
+def plan_requisitions(receipts: list, item_rows,
+                      max_item_rows: int = APPP_MAX_ROWS,
+                      max_payee_rows: int = APPA_MAX_ROWS) -> list:
+    """
+    將收據分組，每組合併為一張請購單。
+
+    Args:
+        receipts:       收據列表（records.Receipt）
+        item_rows:      函式 receipt → 該收據稅額處理後的品名列數
+        max_item_rows:  每張請購單品名列數上限
+        max_payee_rows: 每張請購單受款人列數上限
+
+    Returns:
+        list[list[Receipt]]: 每個元素為一張請購單的收據（保持原本順序）
+    """
+    if not receipts:
+        return []
+
+    sizes = [max(1, item_rows(r)) for r in receipts]
+    order = sorted(range(len(receipts)), key=lambda i: (-sizes[i], i))
+
+    bins = []        # [收據序號...]
+    fits = []        # 未超過上限的收據（依品名列數由多到少）
+    for i in order:
+        if sizes[i] > max_item_rows:
+            # 單張收據就超過上限：自己一張（填單時超出部分併入差額列）
+            print(f"  [WARN] {receipts[i].vendor or '?'} 有 {sizes[i]} 個品項，"
+                  f"超過單張請購單上限 {max_item_rows} 項")
+            bins.append([i])
+        else:
+            fits.append(i)
+
+    packed = _first_fit(fits, sizes, max_item_rows, max_payee_rows)
+    if 0 < len(fits) <= PLAN_EXACT_MAX:
+        packed = _exact(fits, sizes, max_item_rows, max_payee_rows, packed)
+    bins.extend(packed)
+
+    # 依各組第一張收據的原始位置排序，組內維持原順序
+    groups = [sorted(members) for members in bins]
+    groups.sort(key=lambda members: members[0])
+    return [[receipts[i] for i in members] for members in groups]
+
+
+def _first_fit(order: list, sizes: list, max_item_rows: int, max_payee_rows: int) -> list:
+    """First-Fit Decreasing：依 order 放入第一張放得下的請購單。"""
+    bins, used_rows = [], []
+    for i in order:
+        for b, members in enumerate(bins):
+            if (used_rows[b] + sizes[i] <= max_item_rows
+                    and len(members) < max_payee_rows):
+                members.append(i)
+                used_rows[b] += sizes[i]
+                break
+        else:
+            bins.append([i])
+            used_rows.append(sizes[i])
+    return bins
+
+
+def _exact(order: list, sizes: list, max_item_rows: int, max_payee_rows: int,
+           best: list) -> list:
+    """
+    分支定界找最少張數：best（FFD 的結果）為上界，依 order 逐張放入既有或新的請購單。
+
+    剪枝：已用張數 + 剩餘列數放不進現有空位所需的張數 ≥ 目前最佳時放棄；
+    狀態相同（已用列數、收據數）的請購單只試一次。超過 PLAN_EXACT_NODES 個節點時
+    回傳目前找到的最佳解。
+    """
+    total = sum(sizes[i] for i in order)
+    lower = max(-(-total // max_item_rows), -(-len(order) // max_payee_rows))
+    if len(best) <= lower:
+        return best
+
+    remaining = [0] * (len(order) + 1)     # remaining[k] = order[k:] 的列數總和
+    for k in range(len(order) - 1, -1, -1):
+        remaining[k] = remaining[k + 1] + sizes[order[k]]
+
+    bins, used_rows = [], []
+    nodes = 0
+
+    def search(k: int) -> bool:
+        """回傳 True 表示已達下界或超過節點上限，停止搜尋。"""
+        nonlocal best, nodes
+        nodes += 1
+        if nodes > PLAN_EXACT_NODES:
+            return True
+        if k == len(order):
+            best = [list(members) for members in bins]
+            return len(best) <= lower
+        free = sum(max_item_rows - used for used, members in zip(used_rows, bins)
+                   if len(members) < max_payee_rows)
+        if len(bins) + max(0, -(-(remaining[k] - free) // max_item_rows)) >= len(best):
+            return False
+
+        i = order[k]
+        tried = set()
+        for b, members in enumerate(bins):
+            state = (used_rows[b], len(members))
+            if (state in tried or used_rows[b] + sizes[i] > max_item_rows
+                    or len(members) >= max_payee_rows):
+                continue
+            tried.add(state)
+            members.append(i)
+            used_rows[b] += sizes[i]
+            stop = search(k + 1)
+            members.pop()
+            used_rows[b] -= sizes[i]
+            if stop:
+                return True
+        if len(bins) + 1 < len(best):
+            bins.append([i])
+            used_rows.append(sizes[i])
+            stop = search(k + 1)
+            bins.pop()
+            used_rows.pop()
+            if stop:
+                return True
+        return False
+
+    search(0)
+    return best
+
+
+# ════════════════════════════════════════════════════════════
+#  依規則分組（計畫 / 科目 / 月份）
+# ════════════════════════════════════════════════════════════
+
+class BatchRules:
+    """分組規則：廠商 → 科目、關鍵字 → 計畫、是否依月份分開。"""
+
+    def __init__(self, subjects: dict = None, plans: dict = None,
+                 split_by_month: bool = False,
+                 default_plan: str = "", default_subject: str = ""):
+        self.subjects = dict(subjects or {})
+        self.plans = dict(plans or {})
+        self.split_by_month = split_by_month
+        self.default_plan = default_plan
+        self.default_subject = default_subject
+        self._subject_index = VendorIndex.from_aliases(self.subjects)
+
+    @classmethod
+    def load(cls, path) -> "BatchRules":
+        """讀取 JSON 規則檔；檔案不存在回傳空規則（全部同一組）。"""
+        if not path or not Path(path).exists():
+            return cls()
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(
+            subjects=data.get("subjects", {}),
+            plans=data.get("plans", {}),
+            split_by_month=bool(data.get("split_by_month", False)),
+            default_plan=data.get("default_plan", ""),
+            default_subject=data.get("default_subject", ""),
+        )
+
+    def subject_for(self, receipt) -> str:
+        """廠商 → 科目：先比對關鍵字子字串，再用模糊比對。"""
+        vendor = receipt.vendor
+        lower = vendor.lower()
+        for keyword, code in self.subjects.items():
+            if keyword.lower() in lower:
+                return code
+        code, _ = self._subject_index.best(vendor)
+        return code or self.default_subject
+
+    def plan_for(self, receipt) -> str:
+        """關鍵字 → 計畫：比對廠商與所有品名。"""
+        text = " ".join([receipt.vendor] + [item.name for item in receipt.items]).lower()
+        for keyword, plan in self.plans.items():
+            if keyword.lower() in text:
+                return plan
+        return self.default_plan
+
+    def group_key(self, receipt) -> tuple:
+        """(計畫, 科目, 月份 "YYYY-MM" 或 "")。"""
+        month = receipt.iso_date[:7] if self.split_by_month else ""
+        return self.plan_for(receipt), self.subject_for(receipt), month
+
+
+def group_receipts(receipts: list, rules: BatchRules, item_rows) -> list:
+    """
+    依規則分組，每組再依列數上限拆成請購單。
+
+    Returns:
+        list[dict]: 每個元素為一張請購單
+            {"plan": 計畫, "subject": 科目, "month": 月份, "receipts": [...]}
+        組的順序依各組第一張收據出現的順序。
+    """
+    groups = {}
+    for r in receipts:
+        groups.setdefault(rules.group_key(r), []).append(r)
+
+    requisitions = []
+    for (plan, subject, month), members in groups.items():
+        for chunk in plan_requisitions(members, item_rows):
+            requisitions.append({
+                "plan": plan, "subject": subject, "month": month,
+                "receipts": chunk,
+            })
+    return requisitions
+
+
+def show_plan_table(requisitions: list, item_rows, default_plan: str = "") -> None:
+    """印出請購單規劃表（計畫 / 科目 / 月份 / 收據數 / 品項 / 金額）。"""
+    print(f"\n請購單規劃：共 {len(requisitions)} 張")
+    print(f"{'─'*72}")
+    print(f"  {'#':>2}  {'計畫':<12} {'科目':<12} {'月份':<8} {'收據':>4} {'品項':>4} {'金額':>10}")
+    for k, req in enumerate(requisitions, 1):
+        group = req["receipts"]
+        rows = sum(max(1, item_rows(r)) for r in group)
+        total = sum(r.amount_cents for r in group) // 100
+        plan = req["plan"] or default_plan or "(下拉選擇)"
+        subject = req["subject"] or "(系統預設)"
+        print(f"  {k:>2}  {plan:<12} {subject:<12} {req['month'] or '-':<8} "
+              f"{len(group):>4} {rows:>4} {'NT$' + str(total):>10}")
+    print(f"{'─'*72}")
@@ -0,0 +1,143 @@
+"""執行政策：互動提示的預設答案與中止條件，供無人值守（--unattended）執行。
+
+互動模式下每個提示都會等待使用者輸入（逾時採預設值）；無人值守時
+完全不讀 stdin，直接採用政策檔的答案（沒有設定則用提示本身的預設值），
+手動檢查用的等待（60 秒）也一律略過。
+
+政策檔（config.POLICY_FILE，JSON）：
+    {
+      "plan": "國科會",
+      "mode": "project",
+      "answers": {
+        "confirm": "y",
+        "unmatched_foreign": "n",
+        "resend_pending": "n",
+        "bugetno": "0"
+      },
+      "abort": {
+        "plan_not_found": true,
+        "max_requisitions": 10,
+        "max_amount": 50000,
+        "max_failures": 3
+      }
+    }
+    plan:    計畫名稱關鍵字（同 --plan）
+    mode:    "project"（計畫請購）/ "department"（部門請購），空字串為詢問
+    answers: 提示代號 → 答案
+        plan_type          核銷類型（1=部門、2=計畫）
+        confirm            是否合併填入（y/n）
+        unmatched_foreign  外幣收據未匹配刷卡紀錄時是否繼續（y/n）
+        resend_pending     是否重送上次未確認的收據（y/n）
+        bugetno            找不到計畫時選第幾個（0=第一個）
+        ocr_abort          辨識中發現可疑收據時是否中止辨識（y/n）
+    abort:   中止條件（0 或 false 為不檢查）
+        plan_not_found     下拉選單找不到 plan 時該張請購單失敗（不自動選第一個）
+        max_requisitions   請購單張數超過時整批不送
+        max_amount         任一張請購單金額超過時整批不送
+        max_failures       失敗張數達到時停止填其餘請購單
+"""
+
+import json
+import threading
+from pathlib import Path
+
+MODES = ("", "project", "department")
+
+
+def timed_input(prompt: str, timeout: int = 10, default: str = "") -> str:
+    """
+    帶超時的 input()。超過 timeout 秒未輸入則自動回傳 default。
+    Windows 相容（使用 threading）。
+    """
+    result = [default]
+
+    def _ask():
+        try:
+            result[0] = input(prompt)
+        except EOFError:
+            result[0] = default
+
+    t = threading.Thread(target=_ask, daemon=True)
+    t.start()
+    t.join(timeout)
+    if t.is_alive():
+        print(f"\n    (超過 {timeout} 秒未選擇，自動使用預設值)")
+        return default
+    return result[0]
+
+
+class Policy:
+    """提示答案與中止條件。unattended=True 時 ask() / wait() 不會等待 stdin。"""
+
+    def __init__(self, plan: str = "", mode: str = "", answers: dict = None,
+                 abort: dict = None, unattended: bool = False):
+        if mode not in MODES:
+            raise ValueError(f"政策檔 mode 必須是 {MODES[1:]} 之一: {mode!r}")
+        self.plan = plan
+        self.mode = mode
+        self.answers = {k: str(v) for k, v in (answers or {}).items()}
+        abort = abort or {}
+        self.plan_not_found = bool(abort.get("plan_not_found", False))
+        self.max_requisitions = int(abort.get("max_requisitions", 0) or 0)
+        self.max_amount = int(abort.get("max_amount", 0) or 0)
+        self.max_failures = int(abort.get("max_failures", 0) or 0)
+        self.unattended = unattended
+
+    @classmethod
+    def load(cls, path, unattended: bool = False) -> "Policy":
+        """讀取 JSON 政策檔；檔案不存在回傳空政策（全部使用提示預設值）。"""
+        if not path or not Path(path).exists():
+            return cls(unattended=unattended)
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(
+            plan=data.get("plan", ""),
+            mode=data.get("mode", ""),
+            answers=data.get("answers", {}),
+            abort=data.get("abort", {}),
+            unattended=unattended,
+        )
+
+    def ask(self, key: str, prompt: str, timeout: int = 10, default: str = "") -> str:
+        """
+        詢問使用者。無人值守時直接回傳政策答案（或 default）。
+        互動時政策答案取代 default 作為逾時預設值。
+        """
+        answer = self.answers.get(key, default)
+        if self.unattended:
+            print(f"{prompt}{answer}  (政策: {key})")
+            return answer
+        return timed_input(prompt, timeout=timeout, default=answer)
+
+    def wait(self, prompt: str, timeout: int = 60) -> None:
+        """手動檢查用的「按 Enter 繼續」等待；無人值守時略過。"""
+        if not self.unattended:
+            timed_input(prompt, timeout=timeout, default="")
+
+    def check_requisitions(self, batches: list) -> str:
+        """檢查請購單張數與金額上限，違反時回傳原因，否則回傳空字串。"""
+        if self.max_requisitions and len(batches) > self.max_requisitions:
+            return f"請購單 {len(batches)} 張，超過上限 {self.max_requisitions} 張"
+        if self.max_amount:
+            for k, merged in enumerate(batches, 1):
+                try:
+                    amount = float(merged.get("amount", 0) or 0)
+                except (ValueError, TypeError):
+                    amount = 0
+                if amount > self.max_amount:
+                    return f"請購單 {k} 金額 NT${amount:g}，超過上限 NT${self.max_amount}"
+        return ""
+
+
+# 目前生效的政策（main() 啟動時以 use() 設定；form_filler 透過 current() 取用）
+_current = Policy()
+
+
+def use(policy: Policy) -> Policy:
+    global _current
+    _current = policy
+    return policy
+
+
+def current() -> Policy:
+    return _current
@@ -0,0 +1,88 @@
+"""使用者設定檔：多位同仁各自的帳密、受款人、收據資料夾與帳本（multiuser.py 用）。
+
+目錄結構（config.PROFILES_DIR）：
+    profiles/
+      alice/
+        credentials.env   NCUT_USERNAME / NCUT_PASSWORD（可選 PAYEE_CODE，預設同帳號）
+        receipts/         該同仁的收據
+        ledger.sqlite3    該同仁的收據流水號與送出紀錄（自動建立）
+
+登入、受款人、掃描收據與帳本都透過 current() 取得目前使用者；沒有呼叫 use()
+時為 config 中的單一使用者（credentials.env、receipts/、output/ledger.sqlite3），
+main.py / watcher.py / jobserver.py 的行為不變。
+
+Playwright sync API 綁定執行緒，multiuser.py 每位使用者在自己的執行緒處理，
+所以目前使用者存在執行緒區域變數：use() 只影響呼叫它的執行緒。
+"""
+
+import threading
+from pathlib import Path
+
+from dotenv import dotenv_values
+
+from config import USERNAME, PASSWORD, PAYEE_CODE, RECEIPTS_DIR, LEDGER_DB, PROFILES_DIR
+
+
+class Profile:
+    """一位使用者：登入帳密、受款人代碼、收據資料夾、帳本路徑。name 空字串為預設使用者。"""
+
+    def __init__(self, name: str, username: str, password: str, payee_code: str = "",
+                 receipts_dir=RECEIPTS_DIR, ledger_db=LEDGER_DB):
+        self.name = name
+        self.username = username
+        self.password = password
+        self.payee_code = payee_code or username
+        self.receipts_dir = str(receipts_dir)
+        self.ledger_db = str(ledger_db)
+
+    @classmethod
+    def load(cls, directory) -> "Profile":
+        """讀取 profiles/<名稱>/credentials.env；缺少帳密時拋出 ValueError。"""
+        directory = Path(directory)
+        env = dotenv_values(directory / "credentials.env")
+        username = env.get("NCUT_USERNAME") or ""
+        password = env.get("NCUT_PASSWORD") or ""
+        if not username or not password:
+            raise ValueError(f"{directory / 'credentials.env'} 缺少 NCUT_USERNAME / NCUT_PASSWORD")
+        return cls(
+            name=directory.name,
+            username=username,
+            password=password,
+            payee_code=env.get("PAYEE_CODE") or "",
+            receipts_dir=directory / "receipts",
+            ledger_db=directory / "ledger.sqlite3",
+        )
+
+    def __repr__(self):
+        return f"Profile({self.name or '(預設)'!r}, {self.username!r})"
+
+
+def discover(root=PROFILES_DIR, names=None) -> list:
+    """
+    列出 root 下所有含 credentials.env 的使用者資料夾（依名稱排序）。
+    names 指定時只載入這些使用者，找不到時拋出 FileNotFoundError。
+    """
+    root = Path(root)
+    if names:
+        dirs = [root / n for n in names]
+        missing = [d.name for d in dirs if not (d / "credentials.env").exists()]
+        if missing:
+            raise FileNotFoundError(f"{root}/ 中找不到使用者: {', '.join(missing)}")
+    else:
+        dirs = sorted(d for d in root.iterdir()
+                      if (d / "credentials.env").exists()) if root.exists() else []
+    return [Profile.load(d) for d in dirs]
+
+
+# 預設使用者（config / credentials.env）；各執行緒以 use() 切換
+_default = Profile("", USERNAME, PASSWORD, PAYEE_CODE)
+_local = threading.local()
+
+
+def use(profile: Profile) -> Profile:
+    _local.profile = profile
+    return profile
+
+
+def current() -> Profile:
+    return getattr(_local, "profile", _default)
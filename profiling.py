@@ -0,0 +1,166 @@
+"""執行剖析：各階段與瀏覽器子步驟花了多少時間（python main.py --profile）。
+
+span(name) 記錄一段程式的牆鐘時間與所在執行緒的 CPU 時間，兩者之差為「等待」：
+網路與伺服器回應、瀏覽器端的處理、固定的 sleep / wait_for_timeout、等待使用者輸入。
+巢狀的 span 名稱以 / 連接（fill/form/appy），同名 span 累計次數與時間；
+各執行緒各自巢狀（背景 OCR 執行緒的 span 從 ocr 開始）。未啟用時不做任何記錄。
+
+    with profiling.span("match"):
+        ...
+
+    @profiling.timed("login")
+    def login(...):
+        ...
+
+report() 依牆鐘時間排列所有階段，另列 CPU 與等待最多的項目。
+add_listener() 註冊的函式在每個 span 結束時收到其耗時（events.py 寫成 JSON 事件），
+有監聽者時即使未啟用 --profile 也會計時。
+enable(cprofile=True) 時同時以 cProfile 剖析主執行緒的 Python 程式
+（背景 OCR 執行緒不在 cProfile 範圍內，其耗時見 span）。
+
+用法：
+    python main.py --profile              # 報告存到 output/runs/<年>/<月>/<run-id>/profile.txt
+    python main.py --profile --cprofile   # 另存 profile.pstats（python -m pstats 檢視）
+"""
+
+import cProfile
+import functools
+import io
+import json
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+TOP_N = 5               # CPU / 等待排行列出的項目數
+CPROFILE_LINES = 25     # 報告中附上的 cProfile 函式數（依累計時間）
+
+_enabled = False
+_lock = threading.Lock()
+_local = threading.local()
+_totals: dict = {}      # 名稱路徑 → [次數, 牆鐘秒數, CPU 秒數]
+_started = (0.0, 0.0)   # enable() 時的 (perf_counter, process_time)
+_cprofile = None
+_listeners: list = []   # fn(名稱路徑, 牆鐘秒數, CPU 秒數, 錯誤訊息, 識別欄位)
+
+
+def enable(cprofile: bool = False) -> None:
+    """開始記錄 span（清除先前的紀錄）；cprofile=True 時同時啟動 cProfile。"""
+    global _enabled, _started, _cprofile
+    with _lock:
+        _totals.clear()
+    _started = (time.perf_counter(), time.process_time())
+    _enabled = True
+    if cprofile:
+        _cprofile = cProfile.Profile()
+        _cprofile.enable()
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def add_listener(fn) -> None:
+    """每個 span 結束時呼叫 fn(名稱路徑, 牆鐘秒數, CPU 秒數, 錯誤訊息或 "", 識別欄位 dict)。"""
+    if fn not in _listeners:
+        _listeners.append(fn)
+
+
+def remove_listener(fn) -> None:
+    if fn in _listeners:
+        _listeners.remove(fn)
+
+
+@contextmanager
+def span(name: str, **ids):
+    """記錄 with 區塊的牆鐘與 CPU 時間；ids 為交給監聽者的識別欄位（如 file=...）。
+    未啟用且沒有監聽者時不做任何事。"""
+    if not _enabled and not _listeners:
+        yield
+        return
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    stack.append(name)
+    path = "/".join(stack)
+    error = ""
+    wall0, cpu0 = time.perf_counter(), time.thread_time()
+    try:
+        yield
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        wall, cpu = time.perf_counter() - wall0, time.thread_time() - cpu0
+        stack.pop()
+        if _enabled:
+            with _lock:
+                total = _totals.setdefault(path, [0, 0.0, 0.0])
+                total[0] += 1
+                total[1] += wall
+                total[2] += cpu
+        for fn in list(_listeners):
+            fn(path, wall, cpu, error, ids)
+
+
+def timed(name: str):
+    """裝飾器：每次呼叫都包在 span(name) 中。"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled and not _listeners:
+                return fn(*args, **kwargs)
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def stages() -> list:
+    """各階段統計，依牆鐘時間由多到少：[{"stage", "count", "wall", "cpu", "idle"}]。"""
+    with _lock:
+        items = [(path, list(t)) for path, t in _totals.items()]
+    rows = [{"stage": path, "count": n, "wall": wall, "cpu": cpu, "idle": max(0.0, wall - cpu)}
+            for path, (n, wall, cpu) in items]
+    return sorted(rows, key=lambda r: r["wall"], reverse=True)
+
+
+def report() -> str:
+    """文字報告：全部階段（依牆鐘時間）+ CPU / 等待排行 + cProfile 摘要。"""
+    rows = stages()
+    wall = time.perf_counter() - _started[0]
+    cpu = time.process_time() - _started[1]
+    width = max([len(r["stage"]) for r in rows] + [12])
+    lines = [f"總時間 {wall:.1f} 秒，CPU {cpu:.1f} 秒（所有執行緒）", "",
+             f"{'階段':<{width}} {'次數':>5} {'牆鐘 s':>9} {'CPU s':>8} {'等待 s':>9} {'等待%':>6}"]
+    for r in rows:
+        pct = r["idle"] / r["wall"] * 100 if r["wall"] else 0.0
+        lines.append(f"{r['stage']:<{width}} {r['count']:>5} {r['wall']:>9.2f} "
+                     f"{r['cpu']:>8.2f} {r['idle']:>9.2f} {pct:>5.0f}%")
+    for key, title in (("cpu", "CPU 最多"), ("idle", "等待最多")):
+        lines += ["", f"{title}:"]
+        for r in sorted(rows, key=lambda r: r[key], reverse=True)[:TOP_N]:
+            lines.append(f"  {r[key]:>8.2f} s  {r['stage']}")
+    if _cprofile is not None:
+        buf = io.StringIO()
+        pstats.Stats(_cprofile, stream=buf).sort_stats("cumulative").print_stats(CPROFILE_LINES)
+        lines += ["", "cProfile（主執行緒，依累計時間）:", buf.getvalue()]
+    return "\n".join(lines)
+
+
+def write(directory) -> Path:
+    """停止 cProfile，將報告寫入 directory/profile.txt（另存 profile.json、profile.pstats）。"""
+    global _enabled
+    if _cprofile is not None:
+        _cprofile.disable()
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / "profile.txt"
+    path.write_text(report() + "\n", encoding="utf-8")
+    with open(directory / "profile.json", "w", encoding="utf-8") as f:
+        json.dump(stages(), f, ensure_ascii=False, indent=2)
+    if _cprofile is not None:
+        _cprofile.dump_stats(str(directory / "profile.pstats"))
+    _enabled = False
+    return path
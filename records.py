@@ -0,0 +1,196 @@
+"""收據 / 品項 / 刷卡交易的資料結構（__slots__ dataclass，金額以「分」為整數）。
+
+OCR 回傳的是鬆散的 dict：金額可能是字串、浮點數或整數，每個使用端都要
+再 int(float(...)) 一次。外幣比對與正規化完成後，main.py 只做一次轉換
+（Receipt.from_dict），之後的指紋、分組、稅額處理、合併都直接使用這些
+物件；到填單邊界（merge_receipts 的結果）與 JSON checkpoint 才轉回 dict。
+"""
+
+import re
+from dataclasses import dataclass, field
+from datetime import date, datetime
+
+_NUMBER_RE = re.compile(r"[^0-9.\-]")
+
+
+def to_cents(value) -> int:
+    """'1,234.5' / 1234.5 / 'NT$1234' → 123450；無法解析回傳 0。"""
+    if value is None or value == "":
+        return 0
+    if isinstance(value, bool):
+        return 0
+    if isinstance(value, int):
+        return value * 100
+    if isinstance(value, float):
+        return int(round(value * 100))
+    try:
+        return int(round(float(_NUMBER_RE.sub("", str(value))) * 100))
+    except ValueError:
+        return 0
+
+
+def from_cents(cents: int):
+    """123400 → 1234（整數元）；123450 → 1234.5。"""
+    if cents % 100 == 0:
+        return cents // 100
+    return round(cents / 100, 2)
+
+
+def parse_day(text):
+    """'YYYY-MM-DD' → date；無法解析回傳 None。"""
+    if isinstance(text, date):
+        return text
+    if not text:
+        return None
+    try:
+        return datetime.strptime(str(text).strip()[:10], "%Y-%m-%d").date()
+    except (ValueError, TypeError):
+        return None
+
+
+# 收據與刷卡紀錄上常見的幣別寫法 → ISO 代碼
+_CURRENCY_SYMBOLS = {
+    "US$": "USD", "$": "USD", "NT$": "TWD", "NTD": "TWD", "€": "EUR",
+    "¥": "JPY", "JP¥": "JPY", "円": "JPY", "£": "GBP", "HK$": "HKD",
+}
+
+
+def normalize_currency(text) -> str:
+    """'US$' / 'usd ' → 'USD'；無法辨識者原樣轉大寫（可能為空）。"""
+    code = str(text or "").strip().upper()
+    return _CURRENCY_SYMBOLS.get(code, code)
+
+
+def _to_quantity(value) -> int:
+    try:
+        return int(float(value))
+    except (ValueError, TypeError):
+        return 1
+
+
+@dataclass(slots=True)
+class Item:
+    """收據上的一個品項（單價以分為單位）。"""
+
+    name: str
+    quantity: int = 1
+    price_cents: int = 0
+    spec: str = ""
+
+    @property
+    def total_cents(self) -> int:
+        return self.price_cents * self.quantity
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Item":
+        return cls(
+            name=str(d.get("name", "") or ""),
+            quantity=_to_quantity(d.get("quantity", 1)),
+            price_cents=to_cents(d.get("price", 0)),
+            spec=str(d.get("spec", "") or ""),
+        )
+
+    def to_dict(self) -> dict:
+        d = {"name": self.name, "quantity": self.quantity,
+             "price": from_cents(self.price_cents)}
+        if self.spec:
+            d["spec"] = self.spec
+        return d
+
+
+# Receipt 有專屬欄位的 OCR key（其餘 key 原樣保存在 extra）
+_RECEIPT_KEYS = {"vendor", "date", "amount", "invoice_no", "tax_id", "currency",
+                 "original_amount", "items", "_source_image", "_fingerprint"}
+
+
+@dataclass(slots=True)
+class Receipt:
+    """一張收據。amount_cents 為台幣金額（外幣收據為刷卡/暫定台幣金額）。"""
+
+    vendor: str = ""
+    day: date = None
+    amount_cents: int = 0
+    invoice_no: str = ""
+    tax_id: str = ""
+    currency: str = "TWD"
+    original_cents: int = 0           # 外幣原幣金額（分）
+    items: list = field(default_factory=list)
+    source: str = ""                  # 來源檔名（_source_image）
+    fingerprint: str = ""             # 送出紀錄指紋（_fingerprint）
+    extra: dict = field(default_factory=dict)   # 其他 OCR / 比對欄位（_matched_twd 等）
+
+    @property
+    def iso_date(self) -> str:
+        return self.day.isoformat() if self.day else ""
+
+    @property
+    def amount(self):
+        """台幣金額（整數元或含小數）。"""
+        return from_cents(self.amount_cents)
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Receipt":
+        currency = str(d.get("currency", "TWD") or "TWD").strip().upper()
+        return cls(
+            vendor=str(d.get("vendor", "") or ""),
+            day=parse_day(d.get("date")),
+            amount_cents=to_cents(d.get("amount", 0)),
+            invoice_no=str(d.get("invoice_no", "") or ""),
+            tax_id=str(d.get("tax_id", "") or ""),
+            currency=currency,
+            original_cents=to_cents(d.get("original_amount", 0)),
+            items=[Item.from_dict(i) for i in d.get("items", []) or []],
+            source=str(d.get("_source_image", "") or ""),
+            fingerprint=str(d.get("_fingerprint", "") or ""),
+            extra={k: v for k, v in d.items() if k not in _RECEIPT_KEYS},
+        )
+
+    def to_dict(self, items: list = None) -> dict:
+        """轉回 OCR 格式的 dict（填單與 JSON 用）；items 可指定處理後的品項。"""
+        d = {
+            "date": self.iso_date,
+            "vendor": self.vendor,
+            "amount": self.amount,
+            "tax_id": self.tax_id,
+            "invoice_no": self.invoice_no,
+            "currency": self.currency,
+            "items": [i.to_dict() for i in (self.items if items is None else items)],
+        }
+        if self.original_cents:
+            d["original_amount"] = from_cents(self.original_cents)
+        if self.source:
+            d["_source_image"] = self.source
+        if self.fingerprint:
+            d["_fingerprint"] = self.fingerprint
+        d.update(self.extra)
+        return d
+
+
+@dataclass(slots=True)
+class Transaction:
+    """刷卡紀錄中的一筆交易（預先正規化，供比對索引與評分使用）。"""
+
+    idx: int
+    name: str
+    name_lower: str
+    twd_cents: int                    # 刷卡台幣金額（分）
+    currency: str                     # 原幣幣別（大寫，可能為空）
+    original_cents: int               # 原幣金額（分）
+    day: int = None                   # 日序數（date.toordinal），日期不明為 None
+    vendor_entry: int = None          # VendorIndex 條目序號（由 TransactionIndex 設定）
+    alias: str = None                 # 別名表對應的標準名稱
+    used: bool = False
+
+    @classmethod
+    def from_item(cls, idx: int, item: dict, stmt_date: str) -> "Transaction":
+        name = str(item.get("name", "") or "")
+        day = parse_day(stmt_date)
+        return cls(
+            idx=idx,
+            name=name,
+            name_lower=name.lower(),
+            twd_cents=to_cents(item.get("price", 0)),
+            currency=normalize_currency(item.get("original_currency", "")),
+            original_cents=to_cents(item.get("original_price", 0)),
+            day=day.toordinal() if day else None,
+        )
@@ -0,0 +1,173 @@
+"""執行狀態目錄：每次執行的各階段結果存到 output/runs/<年>/<月>/<run-id>/，中斷後可接續。
+
+階段（依序）：
+    ocr         OCR 原始結果（含刷卡紀錄）與來源檔名
+    matched     外幣收據 ↔ 刷卡紀錄比對後
+    normalized  外幣正規化 + 收據指紋
+    merged      請購單規劃與合併後的 receipt_data（含計畫/請購類型）
+    filled      各張請購單的填單結果（逐張更新）
+
+登入、導航、填單、存入、驗證需要瀏覽器，無法保存；接續時會從 merged
+重新登入，只填尚未完成的請購單。
+
+執行結束時 write_manifest() 寫入 manifest.json：輸入檔（大小、SHA-256）、
+目錄中的產出檔（截圖、OCR 結果…）、各張請購單的結果與單號、各階段完成時間。
+依年月分層讓單一目錄的項目數有上限；舊版的平面目錄（runs/<run-id>/）仍可接續。
+
+用法：
+    python main.py --resume 20260226-153012   # 從某次執行的最後完成階段接續
+    python main.py --resume last              # 接續最近一次執行
+"""
+
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+
+from ledger import file_sha256
+
+STAGES = ("ocr", "matched", "normalized", "merged", "filled")
+MANIFEST_NAME = "manifest.json"
+
+
+class RunState:
+    """一次執行的狀態目錄。各階段結果以 JSON 存放，寫入採暫存檔 + rename。"""
+
+    def __init__(self, root, run_id: str):
+        self.run_id = run_id
+        self.dir = self.path(root, run_id)
+        self._state_path = self.dir / "state.json"
+
+    @staticmethod
+    def path(root, run_id: str) -> Path:
+        """root/<年>/<月>/<run_id>（取自 ID 開頭的日期）；舊版平面目錄存在時沿用。"""
+        flat = Path(root) / run_id
+        if flat.exists():
+            return flat
+        return Path(root) / run_id[:4] / run_id[4:6] / run_id
+
+    @classmethod
+    def create(cls, root) -> "RunState":
+        run_id = datetime.now().strftime("%Y%m%d-%H%M%S")
+        run = cls(root, run_id)
+        suffix = 1
+        while True:
+            # 同一秒建立多個執行（multiuser.py 多執行緒）時各自取得不同的 ID
+            try:
+                run.dir.mkdir(parents=True)
+                break
+            except FileExistsError:
+                suffix += 1
+                run = cls(root, f"{run_id}-{suffix}")
+        run._write(run._state_path, {
+            "run_id": run.run_id,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "completed": [],
+        })
+        return run
+
+    @classmethod
+    def open(cls, root, run_id: str) -> "RunState":
+        """開啟既有的執行；run_id 為 "last" 時取最近一次。找不到時拋出 FileNotFoundError。"""
+        if run_id == "last":
+            root = Path(root)
+            runs = sorted(p.parent.name for pattern in ("*/*/*/state.json", "*/state.json")
+                          for p in root.glob(pattern))
+            if not runs:
+                raise FileNotFoundError(f"{root}/ 中沒有可接續的執行")
+            run_id = runs[-1]
+        run = cls(root, run_id)
+        if not run._state_path.exists():
+            raise FileNotFoundError(f"找不到執行紀錄: {run.dir}")
+        return run
+
+    @staticmethod
+    def _write(path: Path, data) -> None:
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+
+    def _state(self) -> dict:
+        with open(self._state_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def completed(self) -> list:
+        return self._state().get("completed", [])
+
+    def done(self, stage: str) -> bool:
+        return stage in self.completed()
+
+    def last_stage(self) -> str:
+        """最後完成的階段（依 STAGES 順序），尚無則回傳空字串。"""
+        completed = self.completed()
+        for stage in reversed(STAGES):
+            if stage in completed:
+                return stage
+        return ""
+
+    def save(self, stage: str, data, complete: bool = True) -> None:
+        """儲存階段結果；complete=False 時只寫入資料，不標記為完成（逐張更新用）。"""
+        self._write(self.dir / f"{stage}.json", data)
+        state = self._state()
+        if complete and stage not in state["completed"]:
+            state["completed"].append(stage)
+        state["updated_at"] = datetime.now().isoformat(timespec="seconds")
+        state.setdefault("stage_times", {})[stage] = state["updated_at"]
+        self._write(self._state_path, state)
+
+    def load(self, stage: str, default=None):
+        path = self.dir / f"{stage}.json"
+        if not path.exists():
+            return default
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def write_manifest(self, inputs_dir=None, **fields) -> Path:
+        """
+        寫入 manifest.json（接續執行時覆寫為最新內容），回傳路徑。
+
+        inputs_dir: 收據檔所在目錄，存在的輸入檔另記大小與 SHA-256
+        fields:     其他欄位原樣寫入（如 outcome、duration_s）
+        """
+        state = self._state()
+        created = datetime.fromisoformat(state["created_at"])
+        names = (self.load("ocr") or {}).get("files") or sorted(
+            {r["_source_image"] for r in self.load("normalized", []) if r.get("_source_image")})
+        inputs = []
+        for name in names:
+            entry = {"name": name}
+            path = Path(inputs_dir) / name if inputs_dir else None
+            if path is not None and path.is_file():
+                entry.update(bytes=path.stat().st_size, sha256=file_sha256(path))
+            inputs.append(entry)
+
+        batches = (self.load("merged") or {}).get("batches", [])
+        requisitions = []
+        for r in self.load("filled", []):
+            batch = batches[r["index"] - 1] if r["index"] <= len(batches) else {}
+            requisitions.append({
+                "index": r["index"], "ok": r["ok"], "record_no": r.get("record_no", ""),
+                "error": r.get("error", ""), "amount": batch.get("amount", 0),
+                "receipts": len(batch.get("_receipts") or [batch]) if batch else 0,
+            })
+
+        artifacts = [{"name": p.relative_to(self.dir).as_posix(), "bytes": p.stat().st_size,
+                      "sha256": file_sha256(p)}
+                     for p in sorted(self.dir.rglob("*"))
+                     if p.is_file() and p.name != MANIFEST_NAME and not p.name.endswith(".tmp")]
+        path = self.dir / MANIFEST_NAME
+        self._write(path, {
+            "run_id": self.run_id,
+            "created_at": state["created_at"],
+            "written_at": datetime.now().isoformat(timespec="seconds"),
+            **fields,
+            "completed": state.get("completed", []),
+            # 各階段完成時距建立執行的秒數（接續執行時包含中斷的時間）
+            "stage_seconds": {stage: (datetime.fromisoformat(t) - created).total_seconds()
+                              for stage, t in state.get("stage_times", {}).items()},
+            "inputs": inputs,
+            "requisitions": requisitions,
+            "artifacts": artifacts,
+        })
+        return path
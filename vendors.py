@@ -0,0 +1,191 @@
+"""廠商名稱正規化與模糊比對索引。
+
+信用卡帳單上的廠商名稱寫法五花八門（"ANTHROPIC* CLAUDE.AI SUBSCR"、
+"GOOGLE*CLOUD"），和收據上的 "Anthropic, PBC"、"Google Cloud" 很難用
+子字串直接比對。這裡把名稱正規化成字詞（token）與字元 3-gram，建立
+倒排索引，查詢時只計算共用 token / 3-gram 的候選，回傳相似度分數。
+
+同時支援別名表（關鍵字 → 標準名稱），例如 AI 服務品名對照表，
+以及從過去成功比對中學到的「收據廠商 ↔ 刷卡名稱」配對。
+"""
+
+import re
+
+import jsonfile
+
+STRONG_SIMILARITY = 0.8   # 視為同一廠商
+WEAK_SIMILARITY = 0.5     # 部分相符
+
+# 帳單/收據常見的無意義字詞（不參與 token 比對）
+_STOPWORDS = {
+    "inc", "llc", "ltd", "pbc", "corp", "com", "www", "the",
+    "subscr", "subscription", "payment", "pmt", "bill", "billing",
+}
+
+_SPLIT_RE = re.compile(r"[^0-9a-z\u4e00-\u9fff]+")
+
+
+def normalize_tokens(name: str) -> tuple:
+    """'ANTHROPIC* CLAUDE.AI SUBSCR' → ('anthropic', 'claude')（長度 > 2、去除贅字）。"""
+    words = _SPLIT_RE.split((name or "").lower())
+    return tuple(w for w in words if len(w) > 2 and w not in _STOPWORDS)
+
+
+def _grams(tokens: tuple) -> frozenset:
+    """每個 token 加上邊界後切 3-gram，避免 'aws' 誤中 'laws'。"""
+    grams = set()
+    for t in tokens:
+        padded = f" {t} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return frozenset(grams)
+
+
+def similarity(a_tokens: frozenset, a_grams: frozenset,
+               b_tokens: frozenset, b_grams: frozenset) -> float:
+    """
+    名稱相似度 (0~1)：取 token 重疊率與 3-gram 重疊率的較大者。
+    重疊率以較短的一方為分母，使「Google」與「GOOGLE*CLOUD」視為相符。
+    """
+    tok = 0.0
+    if a_tokens and b_tokens:
+        tok = len(a_tokens & b_tokens) / min(len(a_tokens), len(b_tokens))
+    gram = 0.0
+    if a_grams and b_grams:
+        gram = len(a_grams & b_grams) / min(len(a_grams), len(b_grams))
+    return max(tok, gram)
+
+
+class VendorIndex:
+    """
+    廠商名稱倒排索引（token → 條目、3-gram → 條目）。
+
+    每個條目有一個 label（例如標準品名或交易名稱），同一個正規化名稱
+    只會建立一個條目。查詢只計算與輸入共用 token / 3-gram 的條目。
+    """
+
+    def __init__(self):
+        self._labels = []
+        self._tokens = []
+        self._grams = []
+        self._exact = {}      # 正規化 token tuple → 條目序號
+        self._by_token = {}
+        self._by_gram = {}
+        self._cache = {}
+
+    @classmethod
+    def from_aliases(cls, aliases: dict) -> "VendorIndex":
+        """由別名表 {關鍵字: 標準名稱} 建立索引（保持字典順序作為平手規則）。"""
+        index = cls()
+        for keyword, label in aliases.items():
+            index.add(keyword, label)
+        return index
+
+    def __len__(self):
+        return len(self._labels)
+
+    def add(self, name: str, label=None) -> int:
+        """加入名稱，回傳條目序號（正規化後相同的名稱共用條目）。"""
+        tokens = normalize_tokens(name)
+        if tokens in self._exact:
+            return self._exact[tokens]
+        entry = len(self._labels)
+        self._labels.append(name if label is None else label)
+        self._tokens.append(frozenset(tokens))
+        grams = _grams(tokens)
+        self._grams.append(grams)
+        self._exact[tokens] = entry
+        for t in tokens:
+            self._by_token.setdefault(t, []).append(entry)
+        for g in grams:
+            self._by_gram.setdefault(g, []).append(entry)
+        self._cache.clear()
+        return entry
+
+    def label(self, entry: int):
+        return self._labels[entry]
+
+    def query(self, name: str, min_score: float = WEAK_SIMILARITY) -> dict:
+        """回傳 {條目序號: 相似度}（僅含 ≥ min_score 者）。"""
+        cache_key = (name, min_score)
+        if cache_key in self._cache:
+            return self._cache[cache_key]
+
+        tokens = normalize_tokens(name)
+        result = {}
+        if tokens:
+            exact = self._exact.get(tokens)
+            if exact is not None:
+                result[exact] = 1.0
+            q_tokens = frozenset(tokens)
+            q_grams = _grams(tokens)
+            candidates = set()
+            for t in q_tokens:
+                candidates.update(self._by_token.get(t, ()))
+            for g in q_grams:
+                candidates.update(self._by_gram.get(g, ()))
+            for entry in candidates:
+                if entry in result:
+                    continue
+                s = similarity(q_tokens, q_grams, self._tokens[entry], self._grams[entry])
+                if s >= min_score:
+                    result[entry] = s
+
+        self._cache[cache_key] = result
+        return result
+
+    def best(self, name: str, min_score: float = STRONG_SIMILARITY) -> tuple:
+        """回傳 (label, 相似度)；找不到回傳 (None, 0.0)。平手時取最早加入的條目。"""
+        hits = self.query(name, min_score)
+        if not hits:
+            return None, 0.0
+        entry = min(hits, key=lambda e: (-hits[e], e))
+        return self._labels[entry], hits[entry]
+
+
+# ════════════════════════════════════════════════════════════
+#  從過去比對學到的別名（刷卡名稱 → 收據廠商）
+# ════════════════════════════════════════════════════════════
+
+def learned_alias_table(learned: dict) -> dict:
+    """
+    將學到的 {刷卡名稱: 收據廠商} 轉成別名表：刷卡名稱與收據廠商
+    都對應到同一個標準名稱（收據廠商），可直接給 VendorIndex.from_aliases()。
+    """
+    table = {}
+    for txn_name, vendor in learned.items():
+        table.setdefault(vendor, vendor)
+        table.setdefault(txn_name, vendor)
+    return table
+
+
+def load_learned_aliases(path) -> dict:
+    """
+    讀取學到的別名表 {刷卡名稱: 收據廠商}，檔案不存在則回傳空 dict。
+
+    Raises:
+        ValueError: 檔案內容損毀（不當作空表，否則下次寫入會清掉所有別名）
+    """
+    return jsonfile.read(path, {})
+
+
+def remember_aliases(path, learned: dict) -> int:
+    """
+    記錄本次執行成功比對的 {刷卡名稱: 收據廠商}，供下次比對使用（每次執行寫一次）。
+
+    經由 jsonfile.update() 讀改寫：同時執行的其他使用者新增的別名不會被蓋掉。
+    Returns:
+        新增或變更的別名數
+    Raises:
+        ValueError: 既有檔案內容損毀（保持原樣，不寫入）
+    """
+    learned = {t: v for t, v in learned.items() if t and v}
+    changed = {}
+
+    def _merge(aliases: dict):
+        changed.update({t: v for t, v in learned.items() if aliases.get(t) != v})
+        aliases.update(changed)
+        return bool(changed)
+
+    if learned:
+        jsonfile.update(path, _merge, {})
+    return len(changed)
@@ -0,0 +1,477 @@
+"""監看 receipts/：新檔案放進來就在背景 OCR，累積到門檻或排程時間就自動送出。
+
+流程：
+    1. 監看 RECEIPTS_DIR（Linux 用 inotify，其他平台輪詢），檔案停止變動
+       WATCH_DEBOUNCE_SEC 秒後才辨識，避免讀到複製到一半的檔案
+    2. OCR 在背景執行緒進行，結果放進待送池（WATCH_POOL_FILE，重啟後不必重新 OCR）
+    3. 待送收據達到 --threshold 張，或每隔 --every 分鐘，依 main.py 相同流程
+       （外幣比對 → 正規化 → 略過已送出 → 分組規劃 → 合併）送出
+    4. 瀏覽器與登入工作階段常駐，送出時不必重新登入；閒置超過
+       WATCH_SESSION_MAX_AGE_MIN 分鐘才重新登入
+
+外幣收據還沒有刷卡紀錄（也查不到匯率）時會留在待送池，等刷卡帳單放進來再送。
+一律以無人值守模式執行（自動存入、依政策檔作答，見 policy.py）。
+每次送出都會建立執行狀態目錄，失敗時可用 python main.py --resume <執行ID> 接續。
+
+用法：
+    python watcher.py                        # 監看 receipts/（Ctrl+C 結束）
+    python watcher.py --threshold 3 --every 10
+    python watcher.py --scan-existing        # 啟動時也辨識目錄中尚未處理的檔案
+"""
+
+import argparse
+import copy
+import ctypes
+import ctypes.util
+import json
+import os
+import queue
+import select
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from config import (
+    RECEIPTS_DIR, RUNS_DIR, MATCH_MODE, BATCH_RULES_FILE, POLICY_FILE,
+    WATCH_DEBOUNCE_SEC, WATCH_POLL_SEC, WATCH_OCR_WORKERS, WATCH_THRESHOLD,
+    WATCH_INTERVAL_MIN, WATCH_SESSION_MAX_AGE_MIN, WATCH_POOL_FILE, METRICS_FILE,
+)
+from main import (
+    SUPPORTED_EXTENSIONS, ocr_all_files, save_ocr_results, prepare_submission,
+    filter_submitted, choose_plan, build_batches, fill_batches, _item_rows,
+    BrowserSession,
+)
+from planner import BatchRules, group_receipts
+from runstate import RunState
+import artifacts
+import events
+import metrics
+import policy
+from policy import Policy
+
+
+# ════════════════════════════════════════════════════════════
+#  目錄監看（inotify / 輪詢）
+# ════════════════════════════════════════════════════════════
+
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_INOTIFY_EVENT = struct.Struct("iIII")   # wd, mask, cookie, len（後接 name）
+
+
+class _Inotify:
+    """以 ctypes 呼叫 libc 的 inotify（不需額外套件）。不支援時建構失敗拋出 OSError。"""
+
+    def __init__(self, directory: str):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify 僅支援 Linux")
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 失敗")
+        mask = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+        if libc.inotify_add_watch(fd, os.fsencode(directory), mask) < 0:
+            err = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(err, f"inotify_add_watch 失敗: {directory}")
+        self.fd = fd
+
+    def read(self, timeout: float) -> list:
+        """等待最多 timeout 秒，回傳有變動的檔名。"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        names, pos = [], 0
+        while pos + _INOTIFY_EVENT.size <= len(data):
+            _, _, _, length = _INOTIFY_EVENT.unpack_from(data, pos)
+            pos += _INOTIFY_EVENT.size
+            name = data[pos:pos + length].rstrip(b"\0")
+            pos += length
+            if name:
+                names.append(os.fsdecode(name))
+        return names
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class _Poller:
+    """沒有 inotify 時的備案：定期比對目錄中各檔案的大小與修改時間。"""
+
+    def __init__(self, directory: str, interval: float):
+        self.directory = Path(directory)
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self) -> dict:
+        snapshot = {}
+        for p in self.directory.iterdir():
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            snapshot[p.name] = (st.st_size, st.st_mtime_ns)
+        return snapshot
+
+    def read(self, timeout: float) -> list:
+        time.sleep(min(timeout, self.interval))
+        current = self._scan()
+        changed = [name for name, sig in current.items() if self._snapshot.get(name) != sig]
+        self._snapshot = current
+        return changed
+
+    def close(self) -> None:
+        pass
+
+
+def watch_directory(directory: str, events: queue.Queue, stop: threading.Event,
+                    poll_interval: float = WATCH_POLL_SEC) -> None:
+    """監看執行緒：有變動的檔名以 ("file", 檔名) 放入 events，直到 stop 被設定。"""
+    try:
+        source = _Inotify(directory)
+        print(f"  監看方式: inotify（{directory}/）")
+    except (OSError, AttributeError) as e:
+        source = _Poller(directory, poll_interval)
+        print(f"  監看方式: 每 {poll_interval:g} 秒輪詢（{e}）")
+    try:
+        while not stop.is_set():
+            for name in source.read(timeout=1.0):
+                events.put(("file", name))
+    finally:
+        source.close()
+
+
+# ════════════════════════════════════════════════════════════
+#  待送池
+# ════════════════════════════════════════════════════════════
+
+class ReceiptPool:
+    """
+    來源檔案 → OCR 結果與送出狀態，存成 JSON（暫存檔 + rename）。
+
+    files[檔名] = {"sig": [大小, 修改時間], "docs": [OCR 結果...], "done": [bool...]}
+    刷卡紀錄（doc_type=credit_card_statement）不會標記完成，每次送出都參與比對。
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.files = {}
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.files = json.load(f).get("files", {})
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"files": self.files}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.path)
+
+    def known(self, name: str, sig: list) -> bool:
+        entry = self.files.get(name)
+        return entry is not None and entry["sig"] == sig
+
+    def add(self, name: str, sig: list, docs: list) -> None:
+        """加入（或取代同名檔案的）OCR 結果。"""
+        self.files[name] = {"sig": sig, "docs": docs, "done": [False] * len(docs)}
+
+    def pending(self) -> list:
+        """尚未送出的文件（含刷卡紀錄）：[((檔名, 序號), doc), ...]。"""
+        return [((name, i), doc)
+                for name, entry in self.files.items()
+                for i, (doc, done) in enumerate(zip(entry["docs"], entry["done"]))
+                if not done]
+
+    def pending_receipts(self) -> int:
+        return sum(1 for _, doc in self.pending()
+                   if doc.get("doc_type", "receipt") != "credit_card_statement")
+
+    def mark_done(self, keys) -> None:
+        for name, i in keys:
+            if name in self.files:
+                self.files[name]["done"][i] = True
+
+
+def _file_sig(path: Path) -> list:
+    st = path.stat()
+    return [st.st_size, st.st_mtime_ns]
+
+
+# ════════════════════════════════════════════════════════════
+#  常駐程式
+# ════════════════════════════════════════════════════════════
+
+class Watcher:
+    """主執行緒負責去抖動、送出與瀏覽器（Playwright sync API 只能在建立它的執行緒使用）。"""
+
+    def __init__(self, args, rules: BatchRules, plan_name: str, use_project: bool):
+        self.args = args
+        self.rules = rules
+        self.plan_name = plan_name
+        self.use_project = use_project
+        self.directory = Path(RECEIPTS_DIR)
+        self.events = queue.Queue()
+        self.pool = ReceiptPool(WATCH_POOL_FILE)
+        self.ocr = ThreadPoolExecutor(max_workers=args.ocr_workers,
+                                      thread_name_prefix="ocr")
+        self.waiting = {}        # 檔名 → (最後變動時間, 簽章)，去抖動中
+        self.in_flight = set()   # OCR 進行中的檔名
+        self.dirty = False       # 上次送出後待送池是否有新收據
+        self.last_flush = time.monotonic()
+        # 瀏覽器與登入常駐（只在主執行緒使用）
+        self.session = BrowserSession(headless=args.headless,
+                                      max_idle=WATCH_SESSION_MAX_AGE_MIN * 60)
+
+    # ── 檔案事件與 OCR ────────────────────────────────
+    def _on_file(self, name: str) -> None:
+        path = self.directory / name
+        if path.suffix.lower() not in SUPPORTED_EXTENSIONS or not path.is_file():
+            return
+        try:
+            sig = _file_sig(path)
+        except OSError:
+            return
+        if self.pool.known(name, sig):
+            return
+        self.waiting[name] = (time.monotonic(), sig)
+
+    def _start_ready_ocr(self) -> None:
+        now = time.monotonic()
+        for name, (seen, sig) in list(self.waiting.items()):
+            path = self.directory / name
+            try:
+                current = _file_sig(path)
+            except OSError:
+                del self.waiting[name]        # 檔案已被移走
+                continue
+            if current != sig:
+                self.waiting[name] = (now, current)
+                continue
+            if now - seen < self.args.debounce or name in self.in_flight:
+                continue
+            del self.waiting[name]
+            self.in_flight.add(name)
+            self.ocr.submit(self._ocr_one, name, path, sig)
+
+    def _ocr_one(self, name: str, path: Path, sig: list) -> None:
+        """背景執行緒：辨識單一檔案，結果交回主執行緒。"""
+        try:
+            docs = ocr_all_files([path])
+        except Exception as e:
+            print(f"    [ERROR] {name} OCR 失敗: {e}")
+            docs = []
+        self.events.put(("ocr", name, sig, docs))
+
+    def _on_ocr(self, name: str, sig: list, docs: list) -> None:
+        self.in_flight.discard(name)
+        # 失敗也記錄簽章：同一個檔案不再重試，檔案更新後才重新辨識
+        self.pool.add(name, sig, docs)
+        self.pool.save()
+        if docs:
+            save_ocr_results(docs)
+            self.dirty = True
+        print(f"  [待送] {name}: {len(docs)} 筆；待送收據共 {self.pool.pending_receipts()} 張")
+
+    # ── 送出 ─────────────────────────────────────────
+    def _due(self) -> bool:
+        count = self.pool.pending_receipts()
+        if not count:
+            return False
+        if self.dirty and count >= self.args.threshold:
+            return True
+        interval = self.args.every * 60
+        return bool(interval) and time.monotonic() - self.last_flush >= interval
+
+    def flush(self) -> None:
+        """送出待送收據；每次送出記為一次執行（Prometheus 指標見 metrics.py）。"""
+        outcome, started = "error", time.perf_counter()
+        try:
+            outcome = self._flush()
+        finally:
+            events.emit("run", outcome=outcome,
+                        duration_ms=round((time.perf_counter() - started) * 1000, 1))
+
+    def _flush(self) -> str:
+        """把待送池中可以送出的收據規劃成請購單並填入系統，回傳 "ok" / "failed"。"""
+        self.dirty = False
+        self.last_flush = time.monotonic()
+        entries = self.pool.pending()
+        print(f"\n{'='*60}")
+        print(f"送出待送收據（{self.pool.pending_receipts()} 張）")
+        print(f"{'='*60}")
+
+        # 比對與正規化會改寫 dict，對副本操作；待送池保留原始 OCR 結果
+        docs = [copy.deepcopy(doc) for _, doc in entries]
+        key_of = {id(doc): key for (key, _), doc in zip(entries, docs)}
+        ready, held = prepare_submission(docs, mode=MATCH_MODE)
+        if held:
+            print(f"  {len(held)} 張外幣收據尚無台幣金額，留在待送池等刷卡紀錄")
+        for doc, r in ready:
+            key_of[id(r)] = key_of[id(doc)]
+
+        receipts = [r for _, r in ready]
+        remaining = filter_submitted(receipts)
+        kept = {id(r) for r in remaining}
+        # 已存入或上次未確認（需人工查詢）的收據不再自動送出
+        self.pool.mark_done(key_of[id(r)] for r in receipts if id(r) not in kept)
+        self.pool.save()
+        if not remaining:
+            print("  沒有需要送出的收據。")
+            return "ok"
+
+        requisitions = group_receipts(remaining, self.rules, _item_rows)
+        batches = build_batches(requisitions)
+        reason = policy.current().check_requisitions(batches)
+        if reason:
+            print(f"  [ABORT] {reason}（政策檔 {self.args.policy}），本次不送出")
+            return "failed"
+
+        run = RunState.create(RUNS_DIR)
+        source_stem = f"watch_{run.run_id}"
+        run.save("normalized", [r.to_dict() for r in remaining])
+        run.save("merged", {
+            "plan_name": self.plan_name,
+            "use_project": self.use_project,
+            "source_stem": source_stem,
+            "batches": batches,
+        })
+        filled = []
+
+        def _checkpoint(result: dict) -> None:
+            filled.append(result)
+            if result["ok"]:
+                self.pool.mark_done(key_of[id(r)]
+                                    for r in requisitions[result["index"] - 1]["receipts"])
+                self.pool.save()
+            run.save("filled", filled,
+                     complete=len(filled) == len(batches) and all(r["ok"] for r in filled))
+
+        try:
+            menu_page, context = self.session.page()
+            with artifacts.use(run.dir):
+                results = fill_batches(
+                    menu_page, context, batches,
+                    plan_name=self.plan_name, auto_save=True, use_project=self.use_project,
+                    source_stem=source_stem, on_result=_checkpoint,
+                )
+        except Exception as e:
+            print(f"  [ERROR] 送出失敗: {e}（可用 python main.py --resume {run.run_id} 接續）")
+            self.session.drop()     # 工作階段可能已失效，下次重新登入
+            self._finish(run, "failed")
+            return "failed"
+        self.session.touch()
+
+        failed = [r for r in results if not r["ok"]]
+        records = [r["record_no"] for r in results if r["record_no"]]
+        print(f"  完成 {len(results) - len(failed)}/{len(batches)} 張請購單"
+              + (f"，請購單號: {', '.join(records)}" if records else ""))
+        if failed:
+            self.session.drop()
+            print(f"  失敗的請購單可用 python main.py --resume {run.run_id} 接續"
+                  f"（確定未存入的收據會在下次送出時重試）")
+        self._finish(run, "failed" if failed else "ok")
+        return "failed" if failed else "ok"
+
+    def _finish(self, run: RunState, outcome: str) -> None:
+        """寫入這次送出的 manifest.json，並依保存期限清理舊的執行產出。"""
+        try:
+            run.write_manifest(inputs_dir=self.directory, outcome=outcome)
+        except (OSError, ValueError) as e:
+            print(f"  [WARN] manifest 寫入失敗: {e}")
+        artifacts.prune_after_run(keep=[run.dir])
+
+    # ── 主迴圈 ───────────────────────────────────────
+    def run(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if self.args.scan_existing:
+            for p in sorted(self.directory.iterdir()):
+                self._on_file(p.name)
+        else:
+            # 只處理之後放進來的檔案；目錄中既有檔案視為已處理
+            for p in self.directory.iterdir():
+                if p.suffix.lower() in SUPPORTED_EXTENSIONS and p.name not in self.pool.files:
+                    self.pool.files[p.name] = {"sig": _file_sig(p), "docs": [], "done": []}
+            self.pool.save()
+
+        # 預先登入，第一次送出時不必等待
+        self.session.page()
+
+        stop = threading.Event()
+        thread = threading.Thread(
+            target=watch_directory, args=(str(self.directory), self.events, stop),
+            kwargs={"poll_interval": self.args.poll}, daemon=True)
+        thread.start()
+        print(f"\n監看中：{self.directory}/（達 {self.args.threshold} 張或每 "
+              f"{self.args.every or '-'} 分鐘送出，Ctrl+C 結束）")
+        try:
+            while True:
+                try:
+                    event = self.events.get(timeout=0.5)
+                except queue.Empty:
+                    event = None
+                if event and event[0] == "file":
+                    self._on_file(event[1])
+                elif event and event[0] == "ocr":
+                    self._on_ocr(*event[1:])
+                self._start_ready_ocr()
+                if self._due():
+                    self.flush()
+        except KeyboardInterrupt:
+            print("\n停止監看。")
+        finally:
+            stop.set()
+            self.ocr.shutdown(wait=False, cancel_futures=True)
+            self.session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="監看 receipts/，新收據自動 OCR 並依門檻/排程送出"
+    )
+    parser.add_argument("--threshold", type=int, default=WATCH_THRESHOLD,
+                        help=f"待送收據達到幾張即送出（預設 {WATCH_THRESHOLD}）")
+    parser.add_argument("--every", type=float, default=WATCH_INTERVAL_MIN,
+                        help=f"每隔幾分鐘送出待送收據，0=只看張數（預設 {WATCH_INTERVAL_MIN}）")
+    parser.add_argument("--debounce", type=float, default=WATCH_DEBOUNCE_SEC,
+                        help=f"檔案停止變動幾秒後才辨識（預設 {WATCH_DEBOUNCE_SEC:g}）")
+    parser.add_argument("--poll", type=float, default=WATCH_POLL_SEC,
+                        help=f"無 inotify 時的輪詢間隔秒數（預設 {WATCH_POLL_SEC:g}）")
+    parser.add_argument("--ocr-workers", type=int, default=WATCH_OCR_WORKERS,
+                        help=f"背景 OCR 執行緒數（預設 {WATCH_OCR_WORKERS}）")
+    parser.add_argument("--scan-existing", action="store_true",
+                        help="啟動時也辨識目錄中尚未處理的檔案")
+    parser.add_argument("--plan", type=str, default="", help="計畫名稱關鍵字（同 main.py）")
+    parser.add_argument("--project", action="store_true", help="使用「計畫請購」路徑")
+    parser.add_argument("--rules", type=str, default=BATCH_RULES_FILE,
+                        help=f"請購單分組規則檔（預設 {BATCH_RULES_FILE}）")
+    parser.add_argument("--policy", type=str, default=POLICY_FILE,
+                        help=f"執行政策檔（預設 {POLICY_FILE}）")
+    parser.add_argument("--metrics-file", type=str, default=METRICS_FILE,
+                        help=f"每次送出後更新的 Prometheus 指標檔（預設 {METRICS_FILE}，空字串停用）")
+    parser.add_argument("--headless", action="store_true", help="不顯示瀏覽器視窗")
+    args = parser.parse_args()
+
+    metrics.enable(args.metrics_file)
+    try:
+        run_policy = policy.use(Policy.load(args.policy, unattended=True))
+    except (ValueError, OSError) as e:
+        print(f"[ERROR] 政策檔 {args.policy} 無法讀取: {e}")
+        sys.exit(1)
+    plan_name, need_project = choose_plan(preset=args.plan or run_policy.plan,
+                                          mode=run_policy.mode)
+    watcher = Watcher(args, BatchRules.load(args.rules), plan_name,
+                      use_project=args.project or need_project)
+    watcher.run()
+
+
+if __name__ == "__main__":
+    main()